@@ -1,9 +1,40 @@
 #!/usr/bin/env python
 
-# read version from installed package
-from importlib.metadata import version
-__version__ = version(__name__)
+# The schema class is light and shares its name with its module, so it is
+# imported now. The rest of the package loads on first use, which keeps
+# `import ndp` and the command line fast.
+from ndp.schema import schema
 
 
-from ndp.reduce import *
-from ndp.schema import *
+# Public names and the modules that define them
+_exports = {
+    'ndpData' : 'ndp.reduce',
+    'STAGE_DEPENDS' : 'ndp.reduce',
+    'ndpBatch' : 'ndp.batch',
+    'reduce_sample' : 'ndp.batch',
+    'SHARED_OPS' : 'ndp.batch',
+    'has_op' : 'ndp.batch',
+    'signature' : 'ndp.batch',
+    'ndpLive' : 'ndp.live',
+    'LIVE_DATASETS' : 'ndp.live',
+}
+
+__all__ = ['schema'] + list(_exports)
+
+
+def __getattr__(name):
+    if name == '__version__':
+        # read version from installed package
+        from importlib.metadata import version
+        value = version(__name__)
+    elif name in _exports:
+        import importlib
+        value = getattr(importlib.import_module(_exports[name]), name)
+    else:
+        raise AttributeError("module 'ndp' has no attribute '%s'" % name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_exports) + ['__version__'])
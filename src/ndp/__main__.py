@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+''' Run reductions from the command line, see ndp.cli
+'''
+import sys
+
+from ndp.cli import main
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Batch reduction of many NDP samples that share background, reference and
+TRIM inputs
+"""
+
+import copy
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from ndp.reduce import ndpData
+
+
+# Order in which runschema applies the operations that produce shared products
+SHARED_OPS = ['Eval', 'Load', 'Norm', 'Corr', 'Absolute']
+
+
+def has_op(ops, name):
+    """
+    True if an operation in ops matches name the way runschema matches them
+    """
+
+    return any(name in op for op in ops)
+
+
+def signature(*items):
+    """
+    Key that identifies a shared product by the inputs it was derived from
+    """
+
+    return json.dumps(items, sort_keys=True)
+
+
+def reduce_sample(instrument, schema, shared):
+    """
+    Run the per-sample stages of one schema with the shared products filled in
+
+    Parameters
+    ----------
+    instrument : dictionary
+        Instrument configuration, as read by ndpData.readconfig
+    schema : dictionary
+        Schema of the sample
+    shared : dictionary
+        Shared products keyed by 'TRIM', 'Bgd Dat', 'Bgd Mon', 'Ref Dat' or
+        'Ref Mon'. 'TRIM' holds a (TRIM, detector) pair.
+
+    Returns
+    -------
+    ndpData object after runschema
+
+    """
+
+    ndp = ndpData()
+    ndp.instrument = copy.deepcopy(instrument)
+    for name, product in shared.items():
+        if name == 'TRIM':
+            ndp.TRIM, ndp.detector = copy.deepcopy(product)
+        else:
+            ndp.data[name] = copy.deepcopy(product)
+    ndp.shared = list(shared)
+    ndp.runschema(schema)
+
+    return ndp
+
+
+class ndpBatch():
+    """
+    Reduce a batch of samples, each described by its own schema.
+
+    Schemas are compared to find the TRIM layers, background datasets and
+    reference datasets they have in common. Each distinct shared product is
+    computed once and copied into the reduction of every sample that uses it,
+    so only the sample datasets are loaded and reduced per schema.
+
+    workers = number of processes used for the per-sample stages
+    """
+
+    def __init__(self, workers=1):
+
+        self.instrument = ndpData().instrument
+        self.workers = workers
+        self.schemas = []
+        self.products = {}
+        self.results = []
+
+
+    def readconfig(self, config_filename="instrument.dat"):
+        """
+        Read NDPReduce configuration file
+        """
+
+        with open(config_filename) as f:
+            self.instrument = json.load(f)
+        return
+
+
+    def add_schema(self, schema):
+        """
+        Add a schema filename, or a schema dictionary, to the batch
+        """
+
+        if not isinstance(schema, dict):
+            with open(schema) as f:
+                schema = json.load(f)
+        self.schemas.append(schema)
+        return
+
+
+    def shareable(self, schema):
+        """
+        True if the shared operations of a schema run in the usual order, which
+        is required for them to be computed ahead of the sample
+        """
+
+        ops = schema['Operations']
+        order = [SHARED_OPS.index(name) for op in ops for name in SHARED_OPS if name in op]
+        return order == sorted(order)
+
+
+    def plan(self, schema):
+        """
+        Find the shared products used by a schema
+
+        Returns
+        -------
+        Dictionary of product name to signature. Products are 'TRIM' and the
+        background and reference datatypes loaded by the schema.
+
+        """
+
+        if not self.shareable(schema):
+            return {}
+
+        ops = schema['Operations']
+        load = schema['Load'] if has_op(ops, 'Load') else []
+        norm = schema['Norm'] if has_op(ops, 'Norm') else []
+        corr = schema['Corr'] if has_op(ops, 'Corr') else []
+        plan = {}
+
+        if has_op(ops, 'Eval'):
+            plan['TRIM'] = signature('TRIM', self.instrument, schema['TRIM'], schema.get('Eval'))
+
+        bgd = [dt for dt in ['Bgd Dat', 'Bgd Mon'] if dt in load]
+        bgd_key = signature('Bgd', self.instrument, [[dt, schema[dt]] for dt in bgd], 'Bgd' in norm)
+        for dt in bgd:
+            plan[dt] = bgd_key
+
+        ref = [dt for dt in ['Ref Dat', 'Ref Mon'] if dt in load]
+        ref_key = signature('Ref', self.instrument, [[dt, schema[dt]] for dt in ref],
+                            'Ref' in norm, 'Ref' in corr, has_op(ops, 'Absolute'),
+                            schema['Absolute'].get('Ref Windows') if has_op(ops, 'Absolute') else None,
+                            bgd_key if 'Ref' in corr else None)
+        for dt in ref:
+            plan[dt] = ref_key
+
+        return plan
+
+
+    def compute(self, schema, plan):
+        """
+        Compute the shared products of a schema that are not already known
+        """
+
+        ops = schema['Operations']
+        norm = schema['Norm'] if has_op(ops, 'Norm') else []
+        corr = schema['Corr'] if has_op(ops, 'Corr') else []
+
+        if 'TRIM' in plan and plan['TRIM'] not in self.products:
+            ndp = ndpData()
+            ndp.instrument = self.instrument
+            ndp.schema = schema
+            ndp.set_TRIM()
+            self.products[plan['TRIM']] = {'TRIM': (ndp.TRIM, ndp.detector)}
+
+        bgd = [dt for dt in ['Bgd Dat', 'Bgd Mon'] if dt in plan]
+        if bgd and plan[bgd[0]] not in self.products:
+            ndp = ndpData()
+            ndp.instrument = self.instrument
+            for dt in bgd:
+                ndp.set_dataset(dt, schema[dt])
+            ndp.loaddatasets(bgd)
+            if 'Bgd' in norm:
+                ndp.normalize('Bgd')
+            self.products[plan[bgd[0]]] = {dt: ndp.data[dt] for dt in bgd}
+
+        ref = [dt for dt in ['Ref Dat', 'Ref Mon'] if dt in plan]
+        if ref and plan[ref[0]] not in self.products:
+            ndp = ndpData()
+            ndp.instrument = self.instrument
+            ndp.schema = schema
+            if 'Ref' in corr:
+                ndp.data['Bgd Dat'] = self.products[plan['Bgd Dat']]['Bgd Dat']
+            for dt in ref:
+                ndp.set_dataset(dt, schema[dt])
+            ndp.loaddatasets(ref)
+            if 'Ref' in norm:
+                ndp.normalize('Ref')
+            if 'Ref' in corr:
+                ndp.correct('Ref')
+            if has_op(ops, 'Absolute'):
+                ndp.ref_integrate()
+            self.products[plan[ref[0]]] = {dt: ndp.data[dt] for dt in ref}
+
+        return
+
+
+    def run(self):
+        """
+        Reduce every schema in the batch
+
+        Returns
+        -------
+        List of ndpData objects in the order the schemas were added
+
+        """
+
+        jobs = []
+        for schema in self.schemas:
+            plan = self.plan(schema)
+            self.compute(schema, plan)
+            shared = {}
+            for name, key in plan.items():
+                shared[name] = self.products[key][name]
+            jobs.append((self.instrument, schema, shared))
+
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(reduce_sample, *job) for job in jobs]
+                self.results = [future.result() for future in futures]
+        else:
+            self.results = [reduce_sample(*job) for job in jobs]
+
+        return self.results
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the NDP reduction on synthetic inputs
+
+Times each stage of ndpData.runschema, the peak memory traced while it
+runs, and the reduction of a batch of samples with ndpBatch. Results are
+written as JSON so runs can be compared.
+
+    python -m ndp.benchmark --size medium --output benchmark.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+from ndp.reduce import ndpData
+from ndp.cache import spectrumCache, trimCache
+from ndp.batch import ndpBatch
+from ndp.profiling import stageProfiler
+from ndp import synthetic
+
+
+# Files per dataset, channels, TRIM files and rows, and samples per batch
+SIZES = {
+    'small' : {'files': 2, 'channels': 4096, 'trim_files': 5, 'trim_rows': 200, 'samples': 2},
+    'medium' : {'files': 8, 'channels': 4096, 'trim_files': 8, 'trim_rows': 2000, 'samples': 8},
+    'large' : {'files': 32, 'channels': 16384, 'trim_files': 8, 'trim_rows': 20000, 'samples': 32},
+}
+
+# Stages of runschema, as named by the events of ndp.profiling
+STAGES = ['Eval', 'Load', 'Norm', 'Corr', 'Absolute', 'Bin', 'Save']
+
+
+def new_ndp(channels, cached=False):
+    """
+    ndpData object for synthetic spectra of channels channels
+    """
+
+    ndp = ndpData()
+    ndp.instrument = synthetic.instrument(channels)
+    ndp.detector["Channels"] = np.arange(channels)
+    ndp.cache = spectrumCache() if cached else None
+    ndp.trim_cache = trimCache() if cached else None
+    return ndp
+
+
+def bench_runschema(schema, channels, repeat=3, cached=False):
+    """
+    Time runschema and its stages
+
+    Returns
+    -------
+    Dictionary with the Total time of each repeat, and for each stage (and
+    for the file reads within them) the Time of each repeat and its median
+    and the bytes of the files read, and for each stage the peak traced memory
+
+    """
+
+    totals = []
+    times = {}
+    for i in range(repeat):
+        ndp = new_ndp(channels, cached)
+        profiler = stageProfiler()
+        ndp.add_hook(profiler)
+        t0 = time.perf_counter()
+        ndp.runschema(schema, incremental=False)
+        totals.append(time.perf_counter() - t0)
+        for stage, record in profiler.report()['Stages'].items():
+            times.setdefault(stage, []).append(record['Wall'])
+
+    # Tracing slows the reduction down, so memory is measured in its own run
+    ndp = new_ndp(channels, cached)
+    profiler = stageProfiler(memory=True)
+    ndp.add_hook(profiler)
+    tracemalloc.start()
+    try:
+        ndp.runschema(schema, incremental=False)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    stages = profiler.report()['Stages']
+
+    result = {
+        'Total' : totals,
+        'Median' : statistics.median(totals),
+        'Peak Memory' : peak,
+        'Stages' : {},
+    }
+    for stage in STAGES + ['Read']:
+        if stage in times:
+            result['Stages'][stage] = {
+                'Time' : times[stage],
+                'Median' : statistics.median(times[stage]),
+                'Bytes' : stages[stage]['Bytes'],
+            }
+            # File reads are threaded and have no peak of their own
+            if 'Peak Memory' in stages[stage]:
+                result['Stages'][stage]['Peak Memory'] = stages[stage]['Peak Memory']
+    return result
+
+
+def bench_batch(schemas, channels, workers=1, repeat=1, cached=False):
+    """
+    Time the reduction of a batch of samples with ndpBatch
+    """
+
+    # The worker processes read the setting from the environment
+    setting = os.environ.get('NDP_CACHE')
+    os.environ['NDP_CACHE'] = '1' if cached else '0'
+    totals = []
+    try:
+        for i in range(repeat):
+            batch = ndpBatch(workers=workers)
+            batch.instrument = synthetic.instrument(channels)
+            for schema in schemas:
+                batch.add_schema(schema)
+            t0 = time.perf_counter()
+            batch.run()
+            totals.append(time.perf_counter() - t0)
+    finally:
+        if setting is None:
+            os.environ.pop('NDP_CACHE', None)
+        else:
+            os.environ['NDP_CACHE'] = setting
+
+    result = {
+        'Samples' : len(schemas),
+        'Workers' : workers,
+        'Total' : totals,
+        'Median' : statistics.median(totals),
+        'Per Sample' : statistics.median(totals)/len(schemas),
+    }
+    return result
+
+
+def run_benchmark(size='small', repeat=3, workers=1, cached=False, path=None,
+                  output=None, **overrides):
+    """
+    Generate synthetic inputs and benchmark the reduction
+
+    Parameters
+    ----------
+    size : string
+        Key of SIZES giving the default input sizes
+    repeat : int
+        Number of timed runs of runschema
+    workers : int
+        Number of processes of the batch reduction
+    cached : bool
+        Use the spectrum and TRIM caches. The default times cold reductions.
+    path : string
+        Directory for the synthetic inputs, a temporary directory if None
+    output : string
+        JSON file to write the results to
+    overrides : int
+        Any of files, channels, trim_files, trim_rows or samples, replacing
+        the value of size
+
+    Returns
+    -------
+    Dictionary of results
+
+    """
+
+    config = dict(SIZES[size])
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    samples = config.pop('samples')
+
+    with tempfile.TemporaryDirectory(dir=path) as tmp:
+        schemas = synthetic.make_batch(tmp, samples=max(samples, 1), **config)
+        results = {
+            'Date' : datetime.now().isoformat(timespec='seconds'),
+            'Python' : platform.python_version(),
+            'Numpy' : np.__version__,
+            'Platform' : platform.platform(),
+            'CPUs' : os.cpu_count(),
+            'Size' : dict(config, samples=samples, size=size, repeat=repeat, cached=cached),
+            'Runschema' : bench_runschema(schemas[0], config['channels'], repeat, cached),
+        }
+        if samples > 0:
+            results['Batch'] = bench_batch(schemas, config['channels'], workers, 1, cached)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m ndp.benchmark',
+                                     description='Benchmark the NDP reduction on synthetic data')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cached', action='store_true', help='use the spectrum and TRIM caches')
+    parser.add_argument('--files', type=int, help='spectrum files per dataset')
+    parser.add_argument('--channels', type=int, help='channels per spectrum')
+    parser.add_argument('--trim-files', type=int, help='TRIM files in the layer stack')
+    parser.add_argument('--trim-rows', type=int, help='ion records per TRIM file')
+    parser.add_argument('--samples', type=int, help='samples in the batch, 0 to skip it')
+    parser.add_argument('--path', help='directory for the synthetic inputs')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.size, args.repeat, args.workers, args.cached, args.path,
+                            args.output, files=args.files, channels=args.channels,
+                            trim_files=args.trim_files, trim_rows=args.trim_rows,
+                            samples=args.samples)
+
+    run = results['Runschema']
+    print('runschema  %8.4f s  peak %8.1f MB' % (run['Median'], run['Peak Memory']/1e6))
+    for stage, record in run['Stages'].items():
+        if 'Peak Memory' in record:
+            print('  %-8s %8.4f s  peak %8.1f MB' % (stage, record['Median'], record['Peak Memory']/1e6))
+        else:
+            print('  %-8s %8.4f s' % (stage, record['Median']))
+    if 'Batch' in results:
+        batch = results['Batch']
+        print('batch      %8.4f s  %d samples, %d workers' % (batch['Median'], batch['Samples'], batch['Workers']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Channel binning for NDP spectra
+
+Bins are given by an array of channel edges. Bin i holds the channels
+edges[i] <= channel < edges[i+1]. All of the reductions work along the last
+axis, so a stack of spectra (files x channels) is binned in one call.
+"""
+
+import numpy as np
+
+
+def fixed_edges(num_channels, bin_size):
+    """
+    Edges of bins that are bin_size channels wide
+
+    Channels past the last whole bin are not binned, which is the layout
+    ndpData.bin_channels has always used for an integer bin size.
+    """
+
+    num_bins = int(num_channels/bin_size)
+    return np.arange(num_bins+1)*bin_size
+
+
+def depth_edges(depth, width):
+    """
+    Edges of bins that each span width (in the units of depth) of a depth scale
+
+    Parameters
+    ----------
+    depth : 1-D numpy array
+        Depth of each channel, for example ndp.detector['Corr Depth']
+    width : float
+        Depth covered by each bin
+
+    Returns
+    -------
+    1-D integer array of channel edges
+    """
+
+    layer = np.floor(np.asarray(depth)/width)
+    inner = np.flatnonzero(np.diff(layer)) + 1
+    return np.concatenate(([0], inner, [len(layer)]))
+
+
+def log_edges(num_channels, num_bins):
+    """
+    Edges of bins with widths that grow geometrically with channel number.
+    Rounding to whole channels can merge narrow bins, so fewer than num_bins
+    bins may be returned.
+    """
+
+    edges = np.geomspace(1, num_channels+1, num_bins+1) - 1
+    return np.unique(np.rint(edges).astype(int))
+
+
+def check_edges(edges, num_channels):
+    """
+    Return edges as an integer array after checking they are usable
+    """
+
+    edges = np.asarray(edges, dtype=int)
+    if edges.ndim != 1 or edges.size < 2:
+        raise ValueError('Bin edges must be a list of at least two channels')
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError('Bin edges must be strictly increasing')
+    if edges[0] < 0 or edges[-1] > num_channels:
+        raise ValueError('Bin edges must be within 0 and %d' % num_channels)
+    return edges
+
+
+def bin_groups(edges):
+    """
+    Group bins of equal width
+
+    Returns
+    -------
+    List of (bins, index) pairs. bins holds the positions of the bins of one
+    width and index is a (len(bins), width) array of their channels.
+    """
+
+    widths = np.diff(edges)
+    groups = []
+    for width in np.unique(widths):
+        bins = np.flatnonzero(widths == width)
+        index = edges[bins][:, None] + np.arange(width)
+        groups.append((bins, index))
+    return groups
+
+
+def bin_reduce(x, groups, num_bins, how):
+    """
+    Reduce the channels of each bin along the last axis of x
+
+    how is one of 'median', 'mean' or 'quadrature'. Quadrature is the root
+    of the sum of squares divided by the number of channels, the uncertainty
+    of a mean of independent channels.
+    """
+
+    x = np.asarray(x)
+    out = np.zeros(x.shape[:-1] + (num_bins,))
+    for bins, index in groups:
+        block = x[..., index]
+        if how == 'median':
+            out[..., bins] = np.median(block, axis=-1)
+        elif how == 'mean':
+            out[..., bins] = np.mean(block, axis=-1)
+        elif how == 'quadrature':
+            out[..., bins] = np.sqrt(np.sum(np.power(block, 2), axis=-1))/index.shape[1]
+        else:
+            raise ValueError('Unknown bin reduction ' + how)
+    return out
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk caches for parsed NDP input files
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+from ndp.compressed import open_file, file_stat
+
+
+def cache_dir():
+    """
+    Directory that holds the ndp caches
+
+    Set by the NDP_CACHE_DIR environment variable, otherwise a directory
+    named ndp in the user cache directory.
+    """
+
+    if os.environ.get('NDP_CACHE_DIR'):
+        return os.environ['NDP_CACHE_DIR']
+    if os.environ.get('XDG_CACHE_HOME'):
+        return os.path.join(os.environ['XDG_CACHE_HOME'], 'ndp')
+    if os.environ.get('LOCALAPPDATA'):
+        return os.path.join(os.environ['LOCALAPPDATA'], 'ndp', 'Cache')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'ndp')
+
+
+def cache_enabled():
+    """
+    True if the NDP_CACHE environment variable turns the caches on. The
+    caches are off by default.
+    """
+
+    return os.environ.get('NDP_CACHE', '').lower() in ('1', 'on', 'true', 'yes', 'strict')
+
+
+def cache_strict():
+    """
+    True if NDP_CACHE is 'strict', so that cache keys also hold a hash of
+    the contents of each file
+    """
+
+    return os.environ.get('NDP_CACHE', '').lower() == 'strict'
+
+
+def file_hash(filename):
+    """
+    SHA-1 digest of the contents of a file
+    """
+
+    h = hashlib.sha1()
+    with open_file(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def temp_name(filename):
+    """
+    Name of a temporary file to write before it replaces filename, unique to
+    the process and thread so concurrent writers do not collide
+    """
+
+    return '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+
+
+@contextmanager
+def file_lock(filename, timeout=10.0):
+    """
+    Hold an exclusive lock on filename between processes, by creating
+    filename + '.lock'. A lock older than timeout seconds was left by a
+    process that died and is taken over.
+    """
+
+    lock_file = filename + '.lock'
+    while True:
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > timeout:
+                    os.remove(lock_file)
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.005)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_file)
+        except OSError:
+            pass
+
+
+def file_identity(filename, content=True):
+    """
+    Identify a file by absolute path, size, modification time and optionally
+    a hash of its contents
+
+    Returns
+    -------
+    List of [path, size, mtime in ns, hash]. The hash is an empty string
+    when content is False.
+    """
+
+    size, mtime_ns = file_stat(filename)
+    digest = file_hash(filename) if content else ''
+    return [os.path.abspath(filename), size, mtime_ns, digest]
+
+
+class spectrumCache():
+    """
+    Persistent cache of parsed spectrum files.
+
+    Each entry holds the header fields of one file in a JSON index and the
+    counts in a .npy file that is memory mapped when read back. Entries are
+    keyed by the file path, size and modification time (in ns), and in
+    strict mode by a hash of the contents too. Without it, a file rewritten
+    with the same size and time stamp is taken for the cached one; with it,
+    every file is read in full to be hashed. When the cache grows past
+    max_bytes the least recently used entries are removed.
+
+    strict = hash the contents of files, cache_strict() by default
+    """
+
+    def __init__(self, path=None, max_bytes=256*2**20, strict=None):
+
+        if path is None:
+            path = os.path.join(cache_dir(), 'spectra')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.strict = cache_strict() if strict is None else strict
+        self.index = self.read_index()
+        self.removed = set()
+        self.modified = False
+        self.lock = threading.RLock()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+
+    def read_index(self):
+        """
+        Read the index of cache entries from disk
+        """
+
+        index_file = os.path.join(self.path, 'index.json')
+        try:
+            with open(index_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+    def key(self, filename, numchannels):
+        """
+        Cache key of a spectrum file read with numchannels channels
+        """
+
+        identity = file_identity(filename, content=self.strict) + [numchannels]
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()
+
+
+    def get(self, key):
+        """
+        Return the cached spectrum with a given key, or None if it is not in the cache
+        """
+
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            try:
+                counts = np.load(os.path.join(self.path, key + '.npy'), mmap_mode='r')
+            except (OSError, ValueError):
+                del self.index[key]
+                self.removed.add(key)
+                self.modified = True
+                return None
+
+            entry['Access'] = time.time()
+            self.modified = True
+            spectrum = dict(entry['Header'])
+
+        spectrum['Counts'] = counts
+        return spectrum
+
+
+    def put(self, key, filename, spectrum):
+        """
+        Add the parsed spectrum of filename to the cache under key
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        counts_file = os.path.join(self.path, key + '.npy')
+        temp_file = temp_name(counts_file)
+        with open(temp_file, 'wb') as f:
+            np.save(f, np.asarray(spectrum['Counts'], dtype=np.float64))
+        os.replace(temp_file, counts_file)
+
+        header = {k: v for k, v in spectrum.items() if k != 'Counts'}
+        with self.lock:
+            self.index[key] = {
+                'File': os.path.abspath(filename),
+                'Header': header,
+                'Bytes': os.path.getsize(counts_file),
+                'Access': time.time(),
+            }
+            self.removed.discard(key)
+            self.modified = True
+            self.evict()
+
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes
+        """
+
+        with self.lock:
+            total = sum(entry['Bytes'] for entry in self.index.values())
+            if total <= self.max_bytes:
+                return
+
+            for key in sorted(self.index, key=lambda k: self.index[k]['Access']):
+                if total <= self.max_bytes:
+                    break
+                total -= self.index[key]['Bytes']
+                del self.index[key]
+                self.removed.add(key)
+                try:
+                    os.remove(os.path.join(self.path, key + '.npy'))
+                except OSError:
+                    pass
+            self.modified = True
+
+
+    def flush(self):
+        """
+        Write the index to disk if it has changed. Entries added to the index
+        on disk by other processes since it was read are kept, and the index
+        is locked while it is merged and written.
+        """
+
+        with self.lock:
+            if not self.modified:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            index_file = os.path.join(self.path, 'index.json')
+            # Other processes must not write the index between the read and
+            # the write, or their entries are lost
+            with file_lock(index_file):
+                index = self.read_index()
+                index.update(self.index)
+                for key in self.removed:
+                    index.pop(key, None)
+                self.index = index
+
+                temp_file = temp_name(index_file)
+                with open(temp_file, 'w') as f:
+                    json.dump(self.index, f)
+                os.replace(temp_file, index_file)
+            self.removed = set()
+            self.modified = False
+
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        """
+
+        with self.lock:
+            for key in list(self.index):
+                try:
+                    os.remove(os.path.join(self.path, key + '.npy'))
+                except OSError:
+                    pass
+            self.removed.update(self.index)
+            self.index = {}
+            self.modified = True
+            self.flush()
+
+
+# TRIM results of this session, shared by every trimCache
+trim_memory = {}
+
+
+class trimCache():
+    """
+    Cache of evaluated TRIM layer stacks.
+
+    Holds the energy, thickness and material of each TRIM file along with the
+    fit_TRIM coefficients, both in memory and in .npz files on disk. Entries
+    are keyed by the ordered list of layer files, their size and modification
+    time (and in strict mode a hash of their contents), and the beam energy.
+    Storing a new result for a layer stack replaces the result for older
+    versions of its files.
+
+    strict = hash the contents of files, cache_strict() by default
+    """
+
+    def __init__(self, path=None, strict=None):
+
+        if path is None:
+            path = os.path.join(cache_dir(), 'trim')
+        self.path = path
+        self.strict = cache_strict() if strict is None else strict
+
+
+    def key(self, trim_list, beam_energy):
+        """
+        Cache key of a TRIM layer list evaluated at beam_energy
+
+        Returns
+        -------
+        (stack, key) pair of strings. stack names the layer files in order and
+        key adds the file identities and beam energy.
+        """
+
+        files = [[layer['Path'] + filename for filename in layer['Files']] for layer in trim_list]
+        stack = hashlib.sha1(json.dumps(files).encode()).hexdigest()
+        identity = [[file_identity(filename, content=self.strict) for filename in layer] for layer in files]
+        key = hashlib.sha1(json.dumps([identity, beam_energy]).encode()).hexdigest()
+        return stack, key
+
+
+    def filename(self, stack, key):
+        return os.path.join(self.path, stack + '_' + key + '.npz')
+
+
+    def get(self, stack, key):
+        """
+        Return a copy of the cached result, or None if it is not in the cache
+
+        The result is a dictionary with keys <Energy>, <Depth>, <Material> and
+        <Coeffs>.
+        """
+
+        if stack in trim_memory and trim_memory[stack][0] == key:
+            result = trim_memory[stack][1]
+        else:
+            try:
+                with np.load(self.filename(stack, key)) as f:
+                    result = {
+                        'Energy': f['Energy'],
+                        'Depth': f['Depth'],
+                        'Material': [str(x) for x in f['Material']],
+                        'Coeffs': f['Coeffs'],
+                    }
+            except (OSError, ValueError, KeyError):
+                return None
+            trim_memory[stack] = (key, result)
+
+        return {k: (list(v) if k == 'Material' else v.copy()) for k, v in result.items()}
+
+
+    def put(self, stack, key, result):
+        """
+        Store a result, replacing older entries for the same layer stack
+        """
+
+        result = {k: (list(v) if k == 'Material' else np.array(v)) for k, v in result.items()}
+        trim_memory[stack] = (key, result)
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            for name in os.listdir(self.path):
+                if name.startswith(stack + '_') and name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, name))
+            filename = self.filename(stack, key)
+            temp_file = temp_name(filename)
+            with open(temp_file, 'wb') as f:
+                np.savez(f, Energy=result['Energy'], Depth=result['Depth'],
+                         Material=np.array(result['Material'], dtype=str),
+                         Coeffs=result['Coeffs'])
+            os.replace(temp_file, filename)
+        except OSError:
+            pass
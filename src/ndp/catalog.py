@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog of the spectrum files in a data directory
+
+The catalog holds the header fields of every spectrum file in a directory so
+files can be selected by detector, label, start time or live time without
+opening them. Only the 8 header lines are read, at most HEADER_BYTES of each
+file, and only for files that are new or have changed size or modification
+time since the catalog was last updated. The directory may be compressed or
+inside a zip archive, as for ndp.compressed. Catalogs are kept as JSON files
+in the ndp cache directory.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from ndp.cache import cache_dir, temp_name
+from ndp.compressed import open_file, listdir, file_stat
+from ndp.spectrum import HEADER_LINES, parse_header
+
+
+# Catalogs opened in this session, by directory
+CATALOGS = {}
+
+# Most bytes read from a file for its header, so a file without line breaks
+# is not read whole
+HEADER_BYTES = 4096
+
+
+def parse_start(line):
+    """
+    Start time of a spectrum from its header line, such as
+    'Start Time: Thu Jul 18 10:15:00 EDT 2019', as an ISO 8601 string.
+    The time zone is ignored. Returns an empty string if the line can not
+    be parsed.
+    """
+
+    fields = line[12:].split()
+    if len(fields) < 5:
+        return ''
+    try:
+        start = datetime.strptime(' '.join(fields[:4] + fields[-1:]), '%a %b %d %H:%M:%S %Y')
+    except ValueError:
+        return ''
+    return start.isoformat()
+
+
+def read_entry(filename):
+    """
+    Catalog entry of a spectrum file from its header
+
+    Returns
+    -------
+    Dictionary with keys <Detector>, <Label>, <Datetime>, <Start>, <Live Time>
+    and <Real Time>, or with the key <Error> if the header can not be read
+    """
+
+    try:
+        with open_file(filename, 'rb') as f:
+            head = f.read(HEADER_BYTES)
+        end = -1
+        for i in range(HEADER_LINES):
+            end = head.find(b'\n', end+1)
+            if end < 0:
+                raise ValueError('No spectrum header in the first %d bytes' % HEADER_BYTES)
+        header = [line + '\n' for line in head[:end].decode().splitlines()]
+        entry = parse_header(header)
+        entry['Start'] = parse_start(header[2])
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+        entry = {'Error': repr(e)}
+    return entry
+
+
+def as_iso(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class spectrumCatalog():
+    """
+    Header catalog of the spectrum files of one directory.
+
+    directory = directory of spectrum files
+    path = JSON file of the catalog. By default a file in the catalogs
+           directory of the ndp cache, named by a hash of the directory.
+    """
+
+    def __init__(self, directory, path=None):
+
+        self.directory = directory
+        if path is None:
+            name = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()
+            path = os.path.join(cache_dir(), 'catalogs', name + '.json')
+        self.path = path
+        self.entries = self.read()
+        self.modified = False
+
+
+    def read(self):
+        """
+        Read the catalog from disk
+        """
+
+        try:
+            with open(self.path) as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if catalog.get('Directory') != os.path.abspath(self.directory):
+            return {}
+        return catalog.get('Entries', {})
+
+
+    def update(self):
+        """
+        Read the headers of new and changed files, drop the files that were
+        removed, and save the catalog if anything changed
+
+        Returns
+        -------
+        Number of headers read
+        """
+
+        found = {}
+        numread = 0
+        for name in listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            if name.startswith('.') or os.path.isdir(filename):
+                continue
+            try:
+                size, mtime = file_stat(filename)
+            except OSError:
+                # A directory inside a zip archive
+                continue
+            old = self.entries.get(name)
+            if old is not None and old['Size'] == size and old['Mtime'] == mtime:
+                found[name] = old
+                continue
+            entry = read_entry(filename)
+            entry['Size'] = size
+            entry['Mtime'] = mtime
+            found[name] = entry
+            numread += 1
+
+        if numread or len(found) != len(self.entries):
+            self.entries = found
+            self.modified = True
+        self.save()
+
+        return numread
+
+
+    def save(self):
+        """
+        Write the catalog to disk if it has changed
+        """
+
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_file = temp_name(self.path)
+        with open(temp_file, 'w') as f:
+            json.dump({'Directory': os.path.abspath(self.directory),
+                       'Entries': self.entries}, f)
+        os.replace(temp_file, self.path)
+        self.modified = False
+        return
+
+
+    def query(self, pattern='*', tag='', detector=None, label=None, start=None,
+              end=None, min_live=None, max_live=None):
+        """
+        Names of the spectrum files that match every given condition
+
+        Parameters
+        ----------
+        pattern : string
+            Shell style filename pattern, such as '*.spe'
+        tag : string
+            Text the filename must contain, as in schema.get_filelist
+        detector, label : string
+            Exact Detector or Label of the header
+        start, end : datetime or ISO 8601 string
+            First and last allowed start time of the measurement
+        min_live, max_live : float
+            Smallest and largest allowed live time in seconds
+
+        Returns
+        -------
+        Sorted list of filenames
+
+        """
+
+        start = as_iso(start)
+        end = as_iso(end)
+        files = []
+        for name, entry in self.entries.items():
+            if 'Error' in entry or tag not in name:
+                continue
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            if detector is not None and entry['Detector'] != detector:
+                continue
+            if label is not None and entry['Label'] != label:
+                continue
+            if start is not None and not (entry['Start'] and entry['Start'] >= start):
+                continue
+            if end is not None and not (entry['Start'] and entry['Start'] <= end):
+                continue
+            if min_live is not None and entry['Live Time'] < min_live:
+                continue
+            if max_live is not None and entry['Live Time'] > max_live:
+                continue
+            files.append(name)
+
+        return sorted(files)
+
+
+def get_catalog(directory, refresh=True):
+    """
+    Catalog of a directory, kept open for the rest of the session and
+    updated from disk unless refresh is False
+    """
+
+    key = os.path.abspath(directory)
+    if key not in CATALOGS:
+        CATALOGS[key] = spectrumCatalog(directory)
+        refresh = True
+    if refresh:
+        CATALOGS[key].update()
+    return CATALOGS[key]
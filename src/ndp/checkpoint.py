@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of the products of ndpData stages
+
+A checkpoint is a NumPy .npz archive holding one or more datasets (such as
+a normalized background, or an integrated reference), or a depth
+calibration (TRIM and detector). Arrays are stored as members named
+'<product>/<key>'. Every other value, with the format version, the kind of
+checkpoint and the inputs the products were derived from, is stored as JSON
+in the 'metadata' member.
+"""
+
+import json
+import os
+from datetime import datetime
+import numpy as np
+
+from ndp.cache import temp_name
+
+
+CHECKPOINT_VERSION = 1
+
+# Kinds of checkpoint and the products each holds. The products are the
+# names used by ndpData.shared.
+CHECKPOINT_PRODUCTS = {
+    'Bgd' : ['Bgd Dat', 'Bgd Mon'],
+    'Ref' : ['Ref Dat', 'Ref Mon'],
+    'TRIM' : ['TRIM', 'Detector'],
+}
+
+# Instrument values the products of each kind of checkpoint were derived from
+CHECKPOINT_INSTRUMENT = {
+    'Bgd' : ['Num Channels', 'Mon Peak Channels'],
+    'Ref' : ['Num Channels', 'Mon Peak Channels', 'Ref Peak Channels'],
+    'TRIM' : ['Beam Energy', 'Num Channels', 'Zero Channel', 'Calib Coeffs'],
+}
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return {'Datetime': value.isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict) and list(value) == ['Datetime']:
+        return datetime.fromisoformat(value['Datetime'])
+    return value
+
+
+def save_checkpoint(filename, kind, products, inputs):
+    """
+    Write a checkpoint
+
+    Parameters
+    ----------
+    filename : string
+        File to write, normally ending in .npz
+    kind : string
+        Key of CHECKPOINT_PRODUCTS
+    products : dictionary
+        Product name to dataset dictionary
+    inputs : dictionary
+        Description of the inputs the products were derived from
+
+    """
+
+    arrays = {}
+    fields = {}
+    for name, dataset in products.items():
+        fields[name] = {}
+        for key, value in dataset.items():
+            if isinstance(value, np.ndarray):
+                arrays[name + '/' + key] = value
+            else:
+                fields[name][key] = encode(value)
+
+    meta = {
+        'Version' : CHECKPOINT_VERSION,
+        'Kind' : kind,
+        'Created' : datetime.now().isoformat(timespec='seconds'),
+        'Inputs' : inputs,
+        'Fields' : fields,
+    }
+    arrays['metadata'] = np.array(json.dumps(meta, default=str))
+
+    temp_file = temp_name(filename)
+    with open(temp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_file, filename)
+    return
+
+
+def load_checkpoint(filename):
+    """
+    Read a checkpoint
+
+    Returns
+    -------
+    products : dictionary of product name to dataset dictionary
+    meta : dictionary with the Version, Kind, Created time and Inputs
+
+    """
+
+    with np.load(filename, allow_pickle=False) as f:
+        meta = json.loads(str(f['metadata']))
+        if meta.get('Version') != CHECKPOINT_VERSION:
+            raise ValueError('%s is a version %s checkpoint, version %d is supported'
+                             % (filename, meta.get('Version'), CHECKPOINT_VERSION))
+        products = {}
+        for name, fields in meta['Fields'].items():
+            products[name] = {key: decode(value) for key, value in fields.items()}
+        for member in f.files:
+            if member != 'metadata':
+                name, key = member.split('/', 1)
+                products[name][key] = f[member]
+
+    del meta['Fields']
+    return products, meta
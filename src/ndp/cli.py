@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Command line reduction of NDP schema files
+
+    python -m ndp schema1.json schema2.json -j 4 -o results/
+    ndp runs/*.json --instrument instrument.dat --format npz
+
+Schemas that share background, reference or TRIM inputs are reduced
+together with ndpBatch, so the shared products are computed once. The
+reduction modules are imported after the arguments are parsed, so --help and
+argument errors return at once.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(prog='ndp', description='Reduce neutron depth profiling measurements described by schema files')
+    parser.add_argument('schemas', nargs='*', help='schema JSON files, or glob patterns of them')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('-o', '--output', help='directory for the saved profiles, in place of each Save Path')
+    parser.add_argument('-i', '--instrument', help='instrument configuration file')
+    parser.add_argument('-f', '--format', help='output format: csv, fastcsv, npz, hdf5 or parquet')
+    parser.add_argument('--cache', action='store_true', help='keep parsed spectra and TRIM stacks in the ndp cache directory')
+    parser.add_argument('--strict-cache', action='store_true', help='as --cache, and also check the contents of files against the cache')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the spectrum and TRIM caches (the default)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not list the saved files')
+    parser.add_argument('--version', action='store_true', help='print the version and exit')
+    args = parser.parse_args(argv)
+    if not args.schemas and not args.version:
+        parser.error('at least one schema file is required')
+    return args
+
+
+def find_schemas(patterns):
+    """
+    Schema files named by the arguments, expanding glob patterns that the
+    shell did not expand
+    """
+
+    filenames = []
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            filenames.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError('No schema file ' + pattern)
+        filenames.extend(matches)
+    return filenames
+
+
+def main(argv=None):
+    """
+    Reduce the schema files given on the command line
+
+    Returns
+    -------
+    Exit status: 0 on success, 1 if the reduction failed
+
+    """
+
+    args = parse_args(argv)
+    if args.version:
+        from importlib.metadata import version
+        print('ndp', version('ndp'))
+        return 0
+    if args.cache:
+        os.environ['NDP_CACHE'] = '1'
+    if args.strict_cache:
+        os.environ['NDP_CACHE'] = 'strict'
+    if args.no_cache:
+        os.environ['NDP_CACHE'] = '0'
+
+    try:
+        filenames = find_schemas(args.schemas)
+        schemas = []
+        for filename in filenames:
+            with open(filename) as f:
+                schema = json.load(f)
+            if args.output is not None:
+                schema['Save']['Path'] = os.path.join(args.output, '')
+            if args.format is not None:
+                schema['Save']['Format'] = args.format
+            schemas.append(schema)
+        if args.output is not None:
+            os.makedirs(args.output, exist_ok=True)
+
+        from ndp.batch import ndpBatch
+        batch = ndpBatch(workers=args.workers)
+        if args.instrument is not None:
+            batch.readconfig(args.instrument)
+        for schema in schemas:
+            batch.add_schema(schema)
+
+        t0 = time.perf_counter()
+        batch.run()
+        elapsed = time.perf_counter() - t0
+    except Exception as e:
+        print('ndp: error: %s' % e, file=sys.stderr)
+        return 1
+
+    if not args.quiet:
+        for filename, schema in zip(filenames, schemas):
+            if any(['Save' in op for op in schema['Operations']]):
+                print('%s -> %s' % (filename, schema['Save']['Path'] + schema['Save']['Filename']))
+            else:
+                print('%s reduced, nothing saved' % filename)
+        print('%d schemas reduced in %.2f s' % (len(schemas), elapsed))
+
+    return 0
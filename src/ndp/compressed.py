@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Reading spectrum and TRIM files from compressed files and zip archives
+
+Files ending in .gz, .xz or .bz2 are decompressed as they are read. A member
+of a zip archive is named by continuing the path of the archive, so a schema
+with Path 'runs/2019.zip/' and Files ['sam_001.spe'] reads the member
+sam_001.spe of runs/2019.zip. Members may themselves be compressed. Nothing
+is written to disk, the parsers read straight from the decompressing stream.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zipfile
+from contextlib import ExitStack
+
+
+# Extension of each compression format and the function that opens it
+COMPRESSORS = {
+    '.gz' : gzip.open,
+    '.xz' : lzma.open,
+    '.bz2' : bz2.open,
+}
+
+
+def compression(filename):
+    """
+    Extension of the compression format of filename, or an empty string
+    """
+
+    ext = os.path.splitext(os.fspath(filename))[1].lower()
+    return ext if ext in COMPRESSORS else ''
+
+
+def split_archive(filename):
+    """
+    Split a path that runs through a zip archive
+
+    Returns
+    -------
+    (archive, member) where member is the path inside the archive, empty
+    for the archive itself, or None if no part of the path is a zip archive
+    """
+
+    filename = os.fspath(filename)
+    if '.zip' not in filename.lower():
+        return None
+    parts = filename.replace('\\', '/').split('/')
+    for i in range(1, len(parts)+1):
+        archive = '/'.join(parts[:i])
+        if archive.lower().endswith('.zip') and os.path.isfile(archive):
+            return archive, '/'.join(parts[i:])
+    return None
+
+
+def open_file(filename, mode='r'):
+    """
+    Open a plain file, a compressed file or a member of a zip archive for
+    reading, in text (mode='r') or binary (mode='rb') mode
+    """
+
+    split = split_archive(filename)
+    if split is not None:
+        archive, member = split
+        with ExitStack() as stack:
+            with zipfile.ZipFile(archive) as zf:
+                # The member stays readable after the archive object is closed
+                f = stack.enter_context(zf.open(member))
+            ext = compression(member)
+            if ext:
+                # The decompressor does not close the member it reads from
+                f = stack.enter_context(COMPRESSORS[ext](f, 'rb'))
+                f = streamStack(f, stack.pop_all())
+            else:
+                stack.pop_all()
+        return f if mode == 'rb' else io.TextIOWrapper(f)
+
+    ext = compression(filename)
+    if ext:
+        return COMPRESSORS[ext](filename, 'rt' if mode == 'r' else 'rb')
+    return open(filename, mode)
+
+
+class streamStack(io.BufferedIOBase):
+    """
+    Binary stream read from stream, that closes every context of stack,
+    stream included, when it is closed
+    """
+
+    def __init__(self, stream, stack):
+        self.stream = stream
+        self.stack = stack
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def read1(self, size=-1):
+        return self.stream.read1(size)
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.stack.close()
+            finally:
+                super().close()
+
+
+def listdir(path):
+    """
+    Names in a directory, or in a directory of a zip archive
+    """
+
+    split = split_archive(path)
+    if split is None:
+        return os.listdir(path)
+
+    archive, member = split
+    prefix = member.strip('/')
+    prefix = prefix + '/' if prefix else ''
+    names = []
+    with zipfile.ZipFile(archive) as zf:
+        for name in zf.namelist():
+            if name.startswith(prefix) and name != prefix:
+                entry = name[len(prefix):].split('/')[0]
+                if entry not in names:
+                    names.append(entry)
+    return names
+
+
+def file_stat(filename):
+    """
+    Size and modification time (ns) of a file. For a member of a zip
+    archive these are the uncompressed size of the member and the time of
+    the archive.
+    """
+
+    split = split_archive(filename)
+    if split is None:
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime_ns
+    archive, member = split
+    st = os.stat(archive)
+    with zipfile.ZipFile(archive) as zf:
+        try:
+            info = zf.getinfo(member)
+        except KeyError:
+            raise FileNotFoundError('No member ' + member + ' in ' + archive)
+    return info.file_size, st.st_mtime_ns
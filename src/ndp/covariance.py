@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Covariance of the depth profiles of a reduced sample
+
+The uncertainties of ndpData treat channels as independent, but every
+channel of Atoms/cm2 shares the monitor sums of normalize, the alpha*
+integral of the reference and the reference concentration, and every
+channel of Atoms/cm3 also shares the scale of Del Depth. The covariance of
+a profile is therefore a diagonal (the counts of each channel) plus a few
+terms that span all channels:
+
+    cov = diag(variance) + factors @ coupling @ factors.T
+
+with factors a (channels x sources) array, one column per shared source, and
+coupling a small symmetric (sources x sources) array. lowRankCovariance
+holds the three arrays, so a 4096 x 4096 matrix is never made. Sums over
+windows of channels, such as bins or depth ranges, are projected with the
+prefix sums of ndp.integrate, at the cost of one pass over the channels.
+
+The covariance is the first order propagation of the counting statistics of
+the Sam, Bgd and Ref datasets, their monitors and Ref Conc Uncert through
+normalize, correct, ref_integrate and scale2ref. For a time resolved stack
+it is the covariance of each file, and files are not correlated in it.
+"""
+
+import numpy as np
+
+from ndp.integrate import prefix_sum, check_windows
+from ndp.reduce import per_file
+
+
+class lowRankCovariance():
+    """
+    Covariance diag(variance) + factors @ coupling @ factors.T of a profile
+    along its last axis, see the module description
+
+    variance = (..., channels) independent variance of each channel
+    factors = (..., channels, sources) response of each channel to each source
+    coupling = (sources, sources) covariance of the sources, identity by default
+    sources = names of the sources
+    """
+
+    def __init__(self, variance, factors, coupling=None, sources=None):
+
+        self.variance = np.asarray(variance, dtype=np.float64)
+        self.factors = np.asarray(factors, dtype=np.float64)
+        num = self.factors.shape[-1]
+        self.coupling = np.eye(num) if coupling is None else np.asarray(coupling, dtype=np.float64)
+        self.sources = list(sources) if sources is not None else ['Source %d' % i for i in range(num)]
+
+
+    def diagonal(self):
+        """
+        Variance of each channel
+        """
+
+        shared = np.einsum('...nk,kl,...nl->...n', self.factors, self.coupling, self.factors)
+        return self.variance + shared
+
+
+    def uncert(self):
+        """
+        Uncertainty of each channel, the root of the diagonal
+        """
+
+        return np.sqrt(np.maximum(self.diagonal(), 0.0))
+
+
+    def windows(self, windows, weights=None):
+        """
+        Covariance of weighted sums of the channels over windows
+
+        Parameters
+        ----------
+        windows : list of [low, high] pairs
+            Channels low to high-1 of each sum. Windows may overlap.
+        weights : array
+            Weight of the channels of each window, 1 by default
+
+        Returns
+        -------
+        (..., windows, windows) covariance array
+
+        """
+
+        num_channels = self.variance.shape[-1]
+        windows = check_windows(windows, num_channels)
+        low, high = windows[:, 0], windows[:, 1]
+        weights = np.ones(len(windows)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        # Independent part, from the channels common to each pair of windows
+        sums = prefix_sum(self.variance)
+        first = np.maximum.outer(low, low)
+        last = np.maximum(np.minimum.outer(high, high), first)
+        common = (sums[..., last] - sums[..., first]).astype(np.float64)
+        cov = common * np.multiply.outer(weights, weights)
+
+        # Shared part, from the sums of the factors over each window
+        sums = prefix_sum(np.swapaxes(self.factors, -1, -2))
+        projected = (sums[..., high] - sums[..., low]).astype(np.float64) * weights
+        cov += np.einsum('...km,kl,...lp->...mp', projected, self.coupling, projected)
+        return cov
+
+
+    def bins(self, edges):
+        """
+        Covariance of the means of the channels of bins with the given
+        channel edges, the way ndpData.bin_channels bins profiles
+        """
+
+        edges = np.asarray(edges, dtype=int)
+        windows = np.column_stack((edges[:-1], edges[1:]))
+        return self.windows(windows, 1.0/np.diff(edges))
+
+
+    def correlation(self, cov):
+        """
+        Correlation matrix of a covariance array from windows or bins
+        """
+
+        scale = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+        with np.errstate(all='ignore'):
+            return np.nan_to_num(cov / (scale[..., :, None]*scale[..., None, :]))
+
+
+def depth_windows(corr_depth, zero_channel, ranges):
+    """
+    Windows of channels covering ranges of depth below the surface
+
+    Parameters
+    ----------
+    corr_depth : 1-D array
+        Depth (nm) of each channel from the surface, ndp.detector['Corr Depth']
+    zero_channel : int
+        Channel of the surface, instrument['Zero Channel']
+    ranges : list of [top, bottom] pairs
+        Depths (nm), top included and bottom excluded
+
+    Returns
+    -------
+    (ranges, 2) integer array of [low, high] channels
+
+    """
+
+    ranges = np.asarray(ranges, dtype=np.float64).reshape(-1, 2)
+    # Depth grows from the surface channel down to channel 0. Any wiggle of
+    # the depth scale is flattened so that each range is one window.
+    below = np.maximum.accumulate(np.asarray(corr_depth)[zero_channel::-1])
+    end = zero_channel + 1
+    low = end - np.searchsorted(below, ranges[:, 1], side='left')
+    high = end - np.searchsorted(below, ranges[:, 0], side='left')
+    return np.column_stack((low, high))
+
+
+def profile_covariance(ndp, key='Atoms/cm2', shared_depth=True):
+    """
+    Covariance of a channel profile of a reduced sample
+
+    Parameters
+    ----------
+    ndp : ndpData
+        Data after the Absolute stage
+    key : string
+        'Atoms/cm2' or 'Atoms/cm3'
+    shared_depth : bool
+        For Atoms/cm3, treat Del Depth Uncert as an uncertainty of the scale
+        shared by every channel, rather than independent for each channel
+
+    Returns
+    -------
+    lowRankCovariance
+
+    """
+
+    if key not in ('Atoms/cm2', 'Atoms/cm3'):
+        raise ValueError('No covariance for ' + key)
+
+    schema = getattr(ndp, 'schema', {})
+    norm = schema.get('Norm', [])
+    corr = schema.get('Corr', [])
+    sam = ndp.data['Sam Dat']
+    ref = ndp.data['Ref Dat']
+    atoms = np.asarray(sam['Atoms/cm2'])
+
+    def normalized(prefix):
+        """
+        Normalized counts of a dataset, their independent uncertainty, and
+        the relative uncertainty of the monitor (0 when not normalized)
+        """
+        data = ndp.data[prefix + ' Dat']
+        if prefix in norm:
+            monitor = per_file(data['Monitor'])
+            rel = per_file(data['Monitor Uncert'])/monitor
+            return data['Norm Cts'], data['Counts/Dt Uncert']/monitor, rel
+        return data['Counts/Dt'], data['Counts/Dt Uncert'], 0.0
+
+    low, high = ndp.ref_windows()['alpha*']
+    alpha = ref['alpha*']
+    gain = (ref['Conc'] * ref['Cross Sec']) / (alpha * sam['Cross Sec'] * sam['Branch Frac'] * sam['Abundance'])
+    # Response of each channel to a change of the alpha* integral
+    to_alpha = -atoms/alpha
+
+    with np.errstate(all='ignore'):
+        sam_cts, sam_uncert, sam_mon = normalized('Sam')
+        ref_cts, ref_uncert, ref_mon = normalized('Ref')
+
+        variance = np.power(gain*sam_uncert, 2)
+        columns = {
+            'Sam Mon' : -gain*sam_cts*sam_mon,
+            'Ref Mon' : -to_alpha*ref_mon*np.sum(ref_cts[..., low:high], axis=-1),
+            'Ref Counts' : to_alpha*np.sqrt(np.sum(np.power(ref_uncert[..., low:high], 2), axis=-1)),
+            'Ref Conc' : atoms*ref['Conc Uncert']/ref['Conc'],
+            }
+        coupling = [1.0, 1.0, 1.0, 1.0]
+
+        use_sam = 'Sam' in corr
+        use_ref = 'Ref' in corr
+        if (use_sam or use_ref) and 'Counts/Dt' in ndp.data['Bgd Dat']:
+            bgd_cts, bgd_uncert, bgd_mon = normalized('Bgd')
+            columns['Bgd Mon'] = (gain*use_sam*bgd_cts*bgd_mon
+                                  + to_alpha*use_ref*bgd_mon*np.sum(bgd_cts[..., low:high], axis=-1))
+            coupling.append(1.0)
+            variance = variance + use_sam*np.power(gain*bgd_uncert, 2)
+            if use_ref:
+                # Background counts of the alpha* window lower their own
+                # channel and the alpha* integral, which raises every channel
+                window = np.zeros(np.shape(bgd_uncert))
+                window[..., low:high] = np.power(bgd_uncert[..., low:high], 2)
+                columns['Bgd Counts alpha*'] = to_alpha
+                columns['Bgd Counts'] = gain*window
+                coupling.append(np.sum(window, axis=-1))
+                coupling.append(0.0)
+
+    names = list(columns)
+    factors = np.stack([np.broadcast_to(columns[name], atoms.shape) for name in names], axis=-1)
+    coupling = np.diag(np.asarray(coupling, dtype=np.float64))
+    if 'Bgd Counts' in columns:
+        pair = [names.index('Bgd Counts alpha*'), names.index('Bgd Counts')]
+        coupling[pair[0], pair[1]] = coupling[pair[1], pair[0]] = float(use_sam)
+    variance = np.broadcast_to(np.nan_to_num(variance), atoms.shape)
+    factors = np.nan_to_num(factors)
+
+    if key == 'Atoms/cm3':
+        width = np.asarray(ndp.detector['Del Depth'])
+        with np.errstate(all='ignore'):
+            inverse = np.nan_to_num(1.0/width, posinf=0.0, neginf=0.0)
+            depth = np.nan_to_num(np.asarray(sam['Atoms/cm3'])*ndp.detector['Del Depth Uncert']/width)
+        variance = variance*np.power(inverse, 2)
+        factors = factors*inverse[..., None]
+        if shared_depth:
+            names.append('Del Depth')
+            factors = np.concatenate((factors, -depth[..., None]), axis=-1)
+            coupling = np.pad(coupling, ((0, 1), (0, 1)))
+            coupling[-1, -1] = 1.0
+        else:
+            variance = variance + np.power(depth, 2)
+
+    return lowRankCovariance(variance, factors, coupling, names)
+
+
+def binned_covariance(ndp, key='Atoms/cm2', shared_depth=True):
+    """
+    Covariance of the binned profile <key> Binned of a reduced sample, with
+    the rows and columns of the empty bin at the end of fixed width bins
+    left at zero
+
+    Returns
+    -------
+    (..., bins, bins) covariance array
+
+    """
+
+    edges = np.asarray(ndp.detector['Bin Edges'])
+    cov = profile_covariance(ndp, key, shared_depth).bins(edges)
+    pad = len(ndp.detector['Channels Binned']) - (len(edges) - 1)
+    if pad:
+        cov = np.pad(cov, [(0, 0)]*(cov.ndim - 2) + [(0, pad), (0, pad)])
+    return cov
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage for the datasets of ndpData
+"""
+
+from collections.abc import MutableMapping
+import numpy as np
+
+
+# Arrays that are only needed while a sample is being reduced, and the
+# stage of ndpData.runschema that makes each
+INTERMEDIATES = {
+    'Counts/Dt' : 'Load',
+    'Counts/Dt Uncert' : 'Load',
+    'Norm Cts' : 'Norm',
+    'Norm Cts Uncert' : 'Norm',
+    'Corr Cts' : 'Corr',
+    'Corr Cts Uncert' : 'Corr',
+}
+
+
+class ndpDataset(MutableMapping):
+    """
+    Dictionary-like dataset that keeps its per-channel arrays as the rows
+    of one contiguous 2-D array.
+
+    Floating point arrays with one value per channel are stored as rows of
+    the block in the chosen dtype, and indexing returns a view of the row.
+    Every other value (file lists, times, binned arrays, ...) is kept as is.
+    A dataset can be used anywhere ndpData uses a dictionary. A view taken
+    before a new column is added may refer to the previous block.
+
+    items = dictionary or dataset to copy
+    dtype = numpy dtype of the block, float32 or float64
+    length = number of channels, taken from the first array if not given
+    """
+
+    __slots__ = ('names', 'block', 'fields', 'dtype', 'length')
+
+    def __init__(self, items=None, dtype=np.float64, length=None):
+
+        self.names = {}
+        self.block = None
+        self.fields = {}
+        self.dtype = np.dtype(dtype)
+        self.length = length
+        if items is not None:
+            for key, value in items.items():
+                self[key] = value
+
+
+    def is_column(self, value):
+        if not isinstance(value, np.ndarray) or value.ndim != 1:
+            return False
+        if not np.issubdtype(value.dtype, np.floating):
+            return False
+        if self.length is None:
+            self.length = value.size
+        return value.size == self.length
+
+
+    def __getitem__(self, key):
+        if key in self.names:
+            return self.block[self.names[key]]
+        return self.fields[key]
+
+
+    def __setitem__(self, key, value):
+        if not self.is_column(value):
+            if key in self.names:
+                del self[key]
+            if isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.floating):
+                value = self.narrow(value)
+            self.fields[key] = value
+            return
+
+        self.fields.pop(key, None)
+        if key not in self.names:
+            rows = len(self.names)
+            if self.block is None:
+                self.block = np.zeros((4, self.length), dtype=self.dtype)
+            elif rows == self.block.shape[0]:
+                # Grow by doubling so adding columns stays cheap
+                block = np.zeros((max(4, 2*rows), self.length), dtype=self.dtype)
+                block[:rows] = self.block
+                self.block = block
+            self.names[key] = rows
+        self.block[self.names[key]] = self.narrow(value)
+
+
+    def __delitem__(self, key):
+        if key not in self.names:
+            del self.fields[key]
+            return
+        row = self.names.pop(key)
+        rows = len(self.names)
+        self.block[row:rows] = self.block[row+1:rows+1].copy()
+        for name in self.names:
+            if self.names[name] > row:
+                self.names[name] -= 1
+
+
+    def __iter__(self):
+        yield from self.names
+        yield from self.fields
+
+
+    def __len__(self):
+        return len(self.names) + len(self.fields)
+
+
+    def narrow(self, value):
+        """
+        Cast a floating point array to the dtype of the block. Finite values
+        past the range of the dtype, such as the nan_to_num sentinels of
+        ndpData in a float32 block, become its largest value instead of inf.
+        """
+
+        limit = np.finfo(self.dtype).max
+        if np.finfo(value.dtype).max > limit:
+            value = np.where(np.isfinite(value), np.clip(value, -limit, limit), value)
+        return value.astype(self.dtype, copy=False)
+
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+    def trim(self):
+        """
+        Release the unused rows of the block
+        """
+
+        if self.block is not None:
+            self.block = self.block[:len(self.names)].copy()
+        return
+
+
+    def nbytes(self):
+        """
+        Bytes held by the block and the array fields
+        """
+
+        total = 0 if self.block is None else self.block.nbytes
+        for value in self.fields.values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+        return total
+
+
+def compact(items, dtype=np.float32, drop_intermediates=False, length=None):
+    """
+    Return a compact ndpDataset holding the contents of a dataset dictionary
+
+    Parameters
+    ----------
+    items : dictionary or ndpDataset
+        Dataset to convert, such as ndp.data['Sam Dat']
+    dtype : numpy dtype
+        float32 halves the memory of float64 at the cost of precision
+    drop_intermediates : bool
+        Leave out the arrays listed in INTERMEDIATES
+    length : int
+        Number of channels. Taken from the first floating point array if None.
+
+    """
+
+    dataset = ndpDataset(dtype=dtype, length=length)
+    for key, value in items.items():
+        if drop_intermediates and key in INTERMEDIATES:
+            continue
+        dataset[key] = value
+    dataset.trim()
+
+    return dataset
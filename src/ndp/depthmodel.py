@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Models of the depth of origin of an ion as a function of its escape energy
+
+ndpData.evalTRIM gives the escape energy and depth of each sub-layer of a
+TRIM layer stack. A depth model is fitted to these points:
+
+Poly = the 2nd order polynomial of ndpData.fit_TRIM, the default
+Linear = straight lines between the points
+Spline = monotone piecewise cubic (PCHIP) through the points, which follows
+         the changes of slope at layer interfaces without overshooting
+
+Linear and Spline models are extended past the first and last point by
+straight lines with the slope at the end.
+
+Each model is evaluated once on a dense table of energies that also holds
+the energies of the points. The depth of any energy, and the energy (or
+channel) of any depth, are then interpolated from the table, so the depth
+scale of every channel is one vectorized lookup. The MAX_MODELS models used
+last are kept by get_model, so samples measured with the same layer stack
+share their tables.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# Number of energies in each lookup table
+TABLE_POINTS = 8193
+
+# Models made by get_model, least recently used first
+MODELS = OrderedDict()
+MODELS_LOCK = threading.Lock()
+
+# Most models kept by get_model. Each table is about 130 kB.
+MAX_MODELS = 32
+
+
+def sorted_points(energy, thick):
+    """
+    Energy and thickness points in order of increasing energy, with the
+    thicknesses of repeated energies averaged
+    """
+
+    energy = np.asarray(energy, dtype=np.float64)
+    thick = np.asarray(thick, dtype=np.float64)
+    x, inverse = np.unique(energy, return_inverse=True)
+    y = np.bincount(inverse, weights=thick) / np.bincount(inverse)
+    return x, y
+
+
+def pchip_slopes(x, y):
+    """
+    Slopes at the points of a monotone piecewise cubic (Fritsch and Carlson)
+    """
+
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    if len(x) == 2:
+        return np.array([delta[0], delta[0]])
+
+    slopes = np.zeros(len(x))
+    w1 = 2*h[1:] + h[:-1]
+    w2 = h[1:] + 2*h[:-1]
+    same = delta[:-1]*delta[1:] > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        harmonic = (w1 + w2) / (w1/delta[:-1] + w2/delta[1:])
+    slopes[1:-1] = np.where(same, harmonic, 0.0)
+
+    # Shape preserving three point slopes at the ends
+    for end, (h0, h1, d0, d1) in ((0, (h[0], h[1], delta[0], delta[1])),
+                                  (-1, (h[-1], h[-2], delta[-1], delta[-2]))):
+        slope = ((2*h0 + h1)*d0 - h0*d1) / (h0 + h1)
+        if np.sign(slope) != np.sign(d0):
+            slope = 0.0
+        elif np.sign(d0) != np.sign(d1) and abs(slope) > abs(3*d0):
+            slope = 3*d0
+        slopes[end] = slope
+    return slopes
+
+
+def extrapolate(x, xp, fp, left_slope, right_slope):
+    """
+    np.interp of x on the table (xp, fp), continued past the ends of the
+    table by straight lines of the given slopes
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    f = np.interp(x, xp, fp)
+    f = np.where(x < xp[0], fp[0] + left_slope*(x - xp[0]), f)
+    f = np.where(x > xp[-1], fp[-1] + right_slope*(x - xp[-1]), f)
+    return f
+
+
+def lookup(x, xp, fp):
+    """
+    Interpolate x on the table (xp, fp), with xp increasing, continuing
+    the first and last steps of the table past its ends
+    """
+
+    return extrapolate(x, xp, fp, (fp[1] - fp[0])/(xp[1] - xp[0]),
+                       (fp[-1] - fp[-2])/(xp[-1] - xp[-2]))
+
+
+def energy_to_depth(energy, energies, depths):
+    """
+    Depth (nm) of each energy (keV) from the lookup table (energies, depths),
+    as stored in ndp.TRIM['Table Energy'] and ndp.TRIM['Table Depth']
+    """
+
+    return lookup(energy, energies, depths)
+
+
+def falling_run(depths, near=None):
+    """
+    First and last index of the run of a table over which depth falls
+    steadily with energy. The run holds index near, or is the longest one.
+    """
+
+    falling = np.diff(depths) < 0
+    # Each run of falling steps gets its own label
+    starts = np.flatnonzero(np.diff(np.concatenate(([0], falling.astype(int)))) == 1)
+    ends = np.flatnonzero(np.diff(np.concatenate((falling.astype(int), [0]))) == -1) + 1
+    if len(starts) == 0:
+        raise ValueError('The depth of the lookup table never falls with energy')
+    if near is None:
+        run = np.argmax(ends - starts)
+    else:
+        run = np.flatnonzero((starts <= near) & (ends >= near))
+        if len(run) == 0:
+            raise ValueError('The depth of the lookup table does not fall with energy '
+                             'at entry %d' % near)
+        run = run[0]
+    return starts[run], ends[run]
+
+
+def depth_to_energy(depth, energies, depths, near=None):
+    """
+    Energy (keV) of each depth (nm) from a lookup table. Only the part of
+    the table over which depth falls steadily with energy is used, the one
+    holding the energy near, or the longest one.
+    """
+
+    index = None if near is None else int(np.clip(np.searchsorted(energies, near), 0, len(energies)-1))
+    first, last = falling_run(depths, index)
+    energies = energies[first:last+1]
+    depths = depths[first:last+1]
+    return lookup(depth, depths[::-1], energies[::-1])
+
+
+def depth_to_channel(corr_depth, energies, depths, calib_coeffs, zero_channel):
+    """
+    Fractional detector channel of each depth below the surface, from a
+    lookup table, see depthModel.channel
+    """
+
+    m, b = calib_coeffs
+    surface_energy = m*zero_channel + b
+    surface = lookup(surface_energy, energies, depths)
+    energy = depth_to_energy(np.asarray(corr_depth) + surface, energies, depths, surface_energy)
+    return (energy - b)/m
+
+
+def depth_function(trim):
+    """
+    Function giving the depth of an array of energies from the lookup table
+    of ndp.TRIM, or None for the Poly model, which is evaluated directly
+    from its coefficients
+    """
+
+    if trim.get('Model', 'Poly') == 'Poly' or 'Table Energy' not in trim:
+        return None
+    energies = np.asarray(trim['Table Energy'])
+    depths = np.asarray(trim['Table Depth'])
+    return lambda energy: energy_to_depth(energy, energies, depths)
+
+
+class depthModel():
+    """
+    Base class of depth models
+
+    energy, thick = escape energy (keV) and depth (nm) of each sub-layer,
+                    as from ndpData.evalTRIM
+    energy_range = (low, high) energies of the lookup table. The table always
+                   covers the points.
+    """
+
+    name = ''
+
+    def __init__(self, energy, thick, energy_range=None, points=TABLE_POINTS):
+
+        self.energy, self.thick = sorted_points(energy, thick)
+        if len(self.energy) < 2:
+            raise ValueError('A depth model needs at least two TRIM points')
+        self.fit()
+
+        low, high = self.energy[0], self.energy[-1]
+        if energy_range is not None:
+            low = min(low, energy_range[0])
+            high = max(high, energy_range[1])
+        # The points are in the table, so the slope changes at layer
+        # interfaces are not smoothed over
+        self.table_energy = np.union1d(np.linspace(low, high, points), self.energy)
+        self.table_depth = self.evaluate(self.table_energy)
+
+
+    def fit(self):
+        return
+
+
+    def evaluate(self, energy):
+        """
+        Depth of each energy from the model itself, used to fill the table
+        """
+
+        raise NotImplementedError
+
+
+    def depth(self, energy):
+        """
+        Depth (nm) of each energy (keV), interpolated from the table
+        """
+
+        return energy_to_depth(energy, self.table_energy, self.table_depth)
+
+
+    def inverse(self, depth):
+        """
+        Energy (keV) of each depth (nm), interpolated from the longest part
+        of the table over which depth falls with energy
+        """
+
+        return depth_to_energy(depth, self.table_energy, self.table_depth)
+
+
+    def channel(self, corr_depth, calib_coeffs, zero_channel):
+        """
+        Fractional detector channel of each depth below the surface
+
+        Parameters
+        ----------
+        corr_depth : array
+            Depth (nm) measured from the surface, as in ndp.detector['Corr Depth']
+        calib_coeffs : [slope, offset]
+            Energy calibration of the channels, instrument['Calib Coeffs']
+        zero_channel : int
+            Channel of the surface, instrument['Zero Channel']
+
+        """
+
+        return depth_to_channel(corr_depth, self.table_energy, self.table_depth,
+                                calib_coeffs, zero_channel)
+
+
+class polyModel(depthModel):
+    """
+    2nd order polynomial fit, as ndpData.fit_TRIM
+    """
+
+    name = 'Poly'
+
+    def fit(self):
+        self.coeffs = np.polyfit(self.energy, self.thick, deg=2)
+
+    def evaluate(self, energy):
+        a, b, c = self.coeffs
+        return a*np.power(energy, 2) + b*energy + c
+
+
+class linearModel(depthModel):
+    """
+    Straight lines between the TRIM points
+    """
+
+    name = 'Linear'
+
+    def evaluate(self, energy):
+        x, y = self.energy, self.thick
+        return extrapolate(energy, x, y, (y[1] - y[0])/(x[1] - x[0]),
+                           (y[-1] - y[-2])/(x[-1] - x[-2]))
+
+
+class splineModel(depthModel):
+    """
+    Monotone piecewise cubic through the TRIM points
+    """
+
+    name = 'Spline'
+
+    def fit(self):
+        self.point_slopes = pchip_slopes(self.energy, self.thick)
+
+    def evaluate(self, energy):
+        x, y, d = self.energy, self.thick, self.point_slopes
+        energy = np.asarray(energy, dtype=np.float64)
+        k = np.clip(np.searchsorted(x, energy) - 1, 0, len(x) - 2)
+        h = x[k+1] - x[k]
+        t = (energy - x[k]) / h
+        cubic = ((2*t**3 - 3*t**2 + 1)*y[k] + (t**3 - 2*t**2 + t)*h*d[k]
+                 + (-2*t**3 + 3*t**2)*y[k+1] + (t**3 - t**2)*h*d[k+1])
+        cubic = np.where(energy < x[0], y[0] + d[0]*(energy - x[0]), cubic)
+        return np.where(energy > x[-1], y[-1] + d[-1]*(energy - x[-1]), cubic)
+
+
+DEPTH_MODELS = {
+    'Poly' : polyModel,
+    'Linear' : linearModel,
+    'Spline' : splineModel,
+}
+
+
+def get_model(name, energy, thick, energy_range=None, points=TABLE_POINTS):
+    """
+    Depth model of DEPTH_MODELS for a set of TRIM points, made once and kept
+    until MAX_MODELS models used more recently have been made
+    """
+
+    if name not in DEPTH_MODELS:
+        raise ValueError('Unknown depth model ' + str(name))
+    energy = np.asarray(energy, dtype=np.float64)
+    thick = np.asarray(thick, dtype=np.float64)
+    key = (name, energy.tobytes(), thick.tobytes(),
+           None if energy_range is None else tuple(float(e) for e in energy_range), points)
+    with MODELS_LOCK:
+        model = MODELS.get(key)
+        if model is not None:
+            MODELS.move_to_end(key)
+            return model
+
+    model = DEPTH_MODELS[name](energy, thick, energy_range, points)
+    with MODELS_LOCK:
+        MODELS[key] = model
+        while len(MODELS) > MAX_MODELS:
+            MODELS.popitem(last=False)
+    return model
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Readers for list-mode (event) files
+
+A list-mode file is a flat sequence of binary event records, each holding
+the timestamp of the event in clock ticks and the channel it was recorded
+in (EVENT_DTYPE). Timestamps count from the start of the acquisition and
+must not decrease. The file is read in chunks of CHUNK_EVENTS records, so
+memory does not grow with the size of the file, and each chunk is
+histogrammed with one numpy.bincount. Files may be compressed or members of
+a zip archive, see ndp.compressed.
+
+Events can be gated by a time window, and rejected when they fall within the
+dead time after the previous event, or within the pile-up window of either
+neighbour. The Live Time of a spectrum is its Real Time scaled by the
+fraction of recorded events that were kept, so the deadtime correction of
+ndpData restores the number of recorded events.
+
+A dataset of a schema is read as list-mode when it has a 'List Mode' entry
+with the options of LISTMODE_OPTIONS, for example
+
+    'Sam Dat' : {
+        'Path' : 'events/',
+        'Files' : ['sam_001.evt'],
+        'List Mode' : {'Tick' : 1e-8, 'Dead Time' : 2e-6, 'Slice' : 600}
+    }
+
+With a Slice width, each file gives one spectrum per slice of time, which are
+summed or, in time resolved mode, kept as a stack.
+"""
+
+import os
+from datetime import datetime, timedelta
+import numpy as np
+
+from ndp.compressed import open_file, file_stat
+
+
+# Record of one event: timestamp in clock ticks, and channel
+EVENT_DTYPE = np.dtype([('Time', '<u8'), ('Channel', '<u2')])
+
+# Number of events histogrammed at a time
+CHUNK_EVENTS = 1 << 20
+
+# Options of a 'List Mode' schema entry and their defaults
+LISTMODE_OPTIONS = {
+    'Tick' : 1e-8,          # seconds per timestamp tick
+    'Start' : 0.0,          # seconds from the start of acquisition to the first event kept
+    'Stop' : None,          # seconds to the end of the window, or the last event
+    'Dead Time' : 0.0,      # seconds after each event in which the next event is rejected
+    'Pile Up' : 0.0,        # events closer than this to a neighbour are both rejected
+    'Slice' : None,         # seconds of each time slice, or one spectrum per file
+    'Detector' : '',
+    'Label' : '',
+    'Datetime' : None,      # ISO 8601 start of acquisition, or a dictionary of
+                            # filename to start, or the file modification time
+}
+
+
+def iter_events(filename, dtype=EVENT_DTYPE, chunk_events=CHUNK_EVENTS):
+    """
+    Read the event records of a file in chunks of at most chunk_events
+    records. A partial record at the end of the file is ignored.
+    """
+
+    nbytes = chunk_events * dtype.itemsize
+    remainder = b''
+    with open_file(filename, 'rb') as f:
+        while True:
+            block = f.read(nbytes)
+            if not block:
+                break
+            block = remainder + block
+            end = len(block) - len(block) % dtype.itemsize
+            remainder = block[end:]
+            if end:
+                yield np.frombuffer(block, dtype=dtype, count=end // dtype.itemsize)
+    return
+
+
+def histogram_events(filename, numchannels, tick=1e-8, start=0.0, stop=None,
+                     dead_time=0.0, pile_up=0.0, slice_width=None,
+                     dtype=EVENT_DTYPE, chunk_events=CHUNK_EVENTS):
+    """
+    Histogram the events of a list-mode file
+
+    Parameters
+    ----------
+    filename : string
+        List-mode file
+    numchannels : int
+        Number of channels. Events in higher channels are dropped.
+    tick : float
+        Seconds per timestamp tick
+    start, stop : float
+        Window of time, in seconds from the start of acquisition, of the
+        events kept. Without stop the window ends at the last event.
+    dead_time : float
+        Events less than dead_time seconds after the previous event are
+        rejected (an extending dead time)
+    pile_up : float
+        Events less than pile_up seconds from the previous or the next event
+        are rejected
+    slice_width : float
+        Seconds of each time slice, or None for a single spectrum
+
+    Times are rounded to whole ticks.
+
+    Returns
+    -------
+    Dictionary with keys <Counts> (channels, or slices x channels), <Real Time>,
+    <Live Time>, <Recorded> and <Kept> (events in the window, and events kept),
+    each a number or an array with a value per slice, and <Elapsed>, the
+    seconds from the start of acquisition to the start of each slice.
+
+    """
+
+    low = int(round(start / tick))
+    high = None if stop is None else int(round(stop / tick))
+    dead_ticks = int(round(dead_time / tick))
+    pile_ticks = int(round(pile_up / tick))
+    slice_ticks = None if slice_width is None else max(int(round(slice_width / tick)), 1)
+
+    numslices = 1
+    if slice_ticks is not None and high is not None:
+        numslices = max(-(-(high - low) // slice_ticks), 1)
+    counts = np.zeros(numslices * numchannels, dtype=np.int64)
+    recorded = np.zeros(numslices, dtype=np.int64)
+    last_time = None
+    end = low
+
+    def add(events, next_times):
+        nonlocal counts, recorded, numslices, last_time, end
+        times = events['Time'].astype(np.int64)
+        channels = events['Channel'].astype(np.int64)
+        prev_gap = np.diff(times, prepend=times[0] if last_time is None else last_time).astype(np.float64)
+        if last_time is None:
+            prev_gap[0] = np.inf
+        last_time = times[-1]
+
+        keep = prev_gap >= max(dead_ticks, pile_ticks)
+        if pile_ticks:
+            keep &= (next_times - times) >= pile_ticks
+        window = (times >= low) & (channels < numchannels)
+        if high is not None:
+            window &= times < high
+        if not np.any(window):
+            return
+        end = max(end, times[window][-1] + 1)
+
+        if slice_ticks is None:
+            slices = np.zeros(len(times), dtype=np.int64)
+        else:
+            slices = (times - low) // slice_ticks
+            needed = slices[window].max() + 1
+            if needed > numslices:
+                counts = np.concatenate((counts, np.zeros((needed - numslices)*numchannels, dtype=np.int64)))
+                recorded = np.concatenate((recorded, np.zeros(needed - numslices, dtype=np.int64)))
+                numslices = needed
+
+        keep &= window
+        counts += np.bincount(slices[keep]*numchannels + channels[keep], minlength=len(counts))
+        recorded += np.bincount(slices[window], minlength=numslices)
+        return
+
+    # With pile-up rejection the last event of a chunk needs the first event
+    # of the next chunk, so it is held back
+    pending = None
+    for events in iter_events(filename, dtype, chunk_events):
+        if pending is not None:
+            events = np.concatenate((pending, events))
+        if pile_ticks:
+            pending = events[-1:]
+            if len(events) > 1:
+                add(events[:-1], events['Time'][1:].astype(np.int64))
+        else:
+            add(events, None)
+    if pending is not None:
+        add(pending, np.array([np.iinfo(np.int64).max]))
+
+    counts = counts.reshape(numslices, numchannels)
+    kept = counts.sum(axis=1)
+    if high is not None:
+        end = high
+    if slice_ticks is None:
+        edges = np.array([low, end])
+    else:
+        edges = np.minimum(low + slice_ticks*np.arange(numslices+1), end)
+    real = np.diff(edges) * tick
+    with np.errstate(all='ignore'):
+        live = np.where(recorded > 0, real * kept / recorded, real)
+
+    histogram = {
+        'Counts' : counts,
+        'Real Time' : real,
+        'Live Time' : live,
+        'Recorded' : recorded,
+        'Kept' : kept,
+        'Elapsed' : edges[:-1] * tick,
+        }
+    if slice_ticks is None:
+        for key in histogram:
+            histogram[key] = histogram[key][0]
+    return histogram
+
+
+def read_listmode(filename, numchannels, options=None):
+    """
+    Read a list-mode file as spectra in the form returned by
+    ndp.spectrum.read_spectrum
+
+    Parameters
+    ----------
+    filename : string
+        List-mode file
+    numchannels : int
+        Number of channels
+    options : dictionary
+        'List Mode' options of the dataset, see LISTMODE_OPTIONS
+
+    Returns
+    -------
+    List of spectrum dictionaries, one for the file or one for each time
+    slice, with the keys of read_spectrum and <Start>, the datetime the
+    spectrum starts at
+
+    """
+
+    options = dict(LISTMODE_OPTIONS, **(options or {}))
+    histogram = histogram_events(filename, numchannels, tick=options['Tick'],
+                                 start=options['Start'], stop=options['Stop'],
+                                 dead_time=options['Dead Time'], pile_up=options['Pile Up'],
+                                 slice_width=options['Slice'])
+
+    started = options['Datetime']
+    if isinstance(started, dict):
+        started = started.get(os.path.basename(os.fspath(filename)))
+    if started is None:
+        started = datetime.fromtimestamp(file_stat(filename)[1] / 1e9)
+    else:
+        started = datetime.fromisoformat(started)
+
+    counts = np.atleast_2d(histogram['Counts'])
+    elapsed = np.atleast_1d(histogram['Elapsed'])
+    live = np.atleast_1d(histogram['Live Time'])
+    real = np.atleast_1d(histogram['Real Time'])
+
+    spectra = []
+    for i in range(len(counts)):
+        start = started + timedelta(seconds=float(elapsed[i]))
+        spectra.append({
+            "Detector": options['Detector'],
+            "Label": options['Label'],
+            "Datetime": start.strftime('%a %b %d %H:%M:%S'),
+            "Live Time": float(live[i]),
+            "Real Time": float(real[i]),
+            "Counts": counts[i].astype(np.float64),
+            "Start": start,
+            })
+    return spectra
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Live reduction of NDP spectra while they are being acquired
+"""
+
+import time
+import numpy as np
+
+from ndp.reduce import ndpData, TIME_RESOLVED
+from ndp.compressed import listdir, file_stat
+
+
+# Datatypes that grow during a measurement
+LIVE_DATASETS = ['Sam Dat', 'Sam Mon']
+
+
+class ndpLive():
+    """
+    Follow the sample spectra of a running measurement.
+
+    After a full run of the schema, each call to update() looks for sample
+    data and monitor files that are new or have changed on disk. Only the
+    change in counts, live time and real time of those files is added to
+    the running totals in ndp.data, then the deadtime, normalize, correct,
+    scale2ref and binning steps of the sample are repeated. In time resolved
+    mode the row of each changed file is replaced, and a new file adds a row
+    at the end of the stack. The background
+    and reference results from the first run are kept. Files are listed and
+    read through the same layer as ndpData.loaddatasets, so compressed
+    files, zip archives and list-mode datasets are followed too.
+
+    ndp = ndpData object used for the reduction
+    tags = dictionary of datatype to filename tag. New files in the path of
+           that datatype whose name contains the tag are added to the sum.
+           Without a tag only the files listed in the schema are followed.
+    """
+
+    def __init__(self, ndp=None, tags=None):
+
+        self.ndp = ndp if ndp is not None else ndpData()
+        self.tags = tags if tags is not None else {}
+        self.files = {}
+
+
+    def start(self, schemafilename="schema.json"):
+        """
+        Run the full schema and record the state of the sample files, using
+        the spectra of the files read by the run
+        """
+
+        self.ndp.keep_spectra = True
+        self.ndp.runschema(schemafilename)
+        for dt in LIVE_DATASETS:
+            if dt not in self.ndp.schema['Load']:
+                continue
+            self.ndp.data[dt]["Files"] = list(self.ndp.data[dt]["Files"])
+            for filename in self.ndp.data[dt]["Files"]:
+                ndp_file = self.ndp.data[dt]["Path"] + filename
+                spectra = self.ndp.spectra[dt][filename]
+                self.files[(dt, filename)] = (self.identity(ndp_file),
+                                              spectra if isinstance(spectra, list) else [spectra])
+        return
+
+
+    def identity(self, ndp_file):
+        return file_stat(ndp_file)
+
+
+    def read(self, dt, ndp_file):
+        """
+        Read a file of a datatype the way ndpData.loaddatasets does
+
+        Returns
+        -------
+        List of spectra, one for a spectrum file or one for each time slice
+        of a list-mode file
+        """
+
+        data = self.ndp.data[dt]
+        if "List Mode" in data:
+            return self.ndp.readlistmode(ndp_file, data["List Mode"])
+        return [self.ndp.readfile(ndp_file)]
+
+
+    def candidates(self, dt):
+        """
+        Files of a datatype to check for changes
+        """
+
+        data = self.ndp.data[dt]
+        filelist = list(data["Files"])
+        if dt in self.tags:
+            for filename in sorted(listdir(data["Path"])):
+                if self.tags[dt] in filename and filename not in filelist:
+                    filelist.append(filename)
+        return filelist
+
+
+    def update(self):
+        """
+        Add the counts of new and changed sample files and reduce the sample again
+
+        Returns
+        -------
+        List of (datatype, filename) pairs of the files that changed. Files that
+        can not be parsed yet, for example while they are being written, are
+        tried again on the next update.
+        """
+
+        changed = []
+
+        for dt in LIVE_DATASETS:
+            if dt not in self.ndp.schema['Load']:
+                continue
+            data = self.ndp.data[dt]
+            stacked = self.ndp.time_resolved and dt in TIME_RESOLVED
+            for filename in self.candidates(dt):
+                ndp_file = data["Path"] + filename
+                try:
+                    identity = self.identity(ndp_file)
+                except OSError:
+                    continue
+                old = self.files.get((dt, filename))
+                if old is not None and old[0] == identity:
+                    continue
+                try:
+                    spectra = self.read(dt, ndp_file)
+                except (OSError, ValueError, IndexError):
+                    continue
+
+                if old is None:
+                    data["Files"].append(filename)
+                    if not stacked:
+                        data["Detector"].extend([spectrum["Detector"] for spectrum in spectra])
+                        data["Labels"].extend([spectrum["Label"] for spectrum in spectra])
+                    previous = []
+                else:
+                    previous = old[1]
+                if not stacked:
+                    for sign, listed in ((1, spectra), (-1, previous)):
+                        for spectrum in listed:
+                            data["Live Time"] += sign*spectrum["Live Time"]
+                            data["Real Time"] += sign*spectrum["Real Time"]
+                            data["Counts"] += sign*np.asarray(spectrum["Counts"])
+                self.files[(dt, filename)] = (identity, spectra)
+                changed.append((dt, filename))
+
+        if changed:
+            for dt in set([dt for dt, filename in changed]):
+                if self.ndp.time_resolved and dt in TIME_RESOLVED:
+                    # Each file has its own rows, so the stack is made again
+                    # from the spectra of every file
+                    self.ndp.stackfiles(dt, [spectrum for filename in self.ndp.data[dt]["Files"]
+                                             for spectrum in self.files[(dt, filename)][1]])
+                else:
+                    self.ndp.deadtime(dt)
+            self.reduce()
+            # The loaded data no longer matches the schema files
+            self.ndp.forget_stage('Load')
+
+        return changed
+
+
+    def reduce(self):
+        """
+        Repeat the sample steps of the schema that follow the deadtime correction
+        """
+
+        schema = self.ndp.schema
+        ops = schema['Operations']
+        if any(['Norm' in op for op in ops]) and 'Sam' in schema['Norm']:
+            self.ndp.normalize('Sam')
+        if any(['Corr' in op for op in ops]) and 'Sam' in schema['Corr']:
+            self.ndp.correct('Sam')
+        if any(['Absolute' in op for op in ops]):
+            self.ndp.scale2ref()
+        if any(['Bin' in op for op in ops]):
+            self.ndp.set_bins(schema['Bin'])
+        else:
+            self.ndp.bin_channels(1)
+        return
+
+
+    def watch(self, interval=5.0, timeout=None, callback=None):
+        """
+        Generator that yields the ndpData object each time the sample changes
+
+        Parameters
+        ----------
+        interval : float
+            Seconds to wait between checks for changed files
+        timeout : float
+            Stop after this many seconds without a change. None waits forever.
+        callback : function
+            Called as callback(ndp, changed) after each update, before yielding
+
+        """
+
+        last = time.time()
+        while True:
+            changed = self.update()
+            if changed:
+                last = time.time()
+                if callback is not None:
+                    callback(self.ndp, changed)
+                yield self.ndp
+            elif timeout is not None and time.time() - last > timeout:
+                return
+            else:
+                time.sleep(interval)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo propagation of uncertainties through the reduction
+
+The analytic uncertainties of ndpData are first order ratio formulas, which
+fail at low counts. monteCarlo instead draws replicas of the inputs of a
+reduced sample:
+
+- the counts of every loaded dataset, as Poisson draws of the measured counts
+- the reference concentration, as a Gaussian of Ref Conc and Ref Conc Uncert
+- optionally the energy calibration, as Gaussians of Calib Coeffs
+
+and pushes all of them through deadtime, normalize, correct, the reference
+integration, scale2ref and binning as (replicas x channels) arrays. The
+replicas are processed in chunks that keep each temporary array to about
+CHUNK_VALUES values, and only the running mean and spread of each result are
+kept between chunks. The percentile bands of the binned results come from at
+most QUANTILE_REPLICAS replicas.
+"""
+
+import numpy as np
+
+from ndp.binning import bin_groups, bin_reduce
+from ndp.depthmodel import depth_function
+from ndp.sweep import depth_scale
+
+
+# Largest number of values in each temporary array
+CHUNK_VALUES = 1 << 23
+
+# Most replicas of each binned result kept for the Low, Median and High
+# percentiles, unless every replica is kept
+QUANTILE_REPLICAS = 1000
+
+# Datasets whose counts are drawn, by the prefix used in schema['Norm'] and schema['Corr']
+PREFIXES = ['Sam', 'Bgd', 'Ref']
+
+# Channel and binned results, and how each is binned
+RESULTS = {
+    'Corr Cts' : None,
+    'Atoms/cm2' : None,
+    'Atoms/cm3' : None,
+    'Atoms/cm2 Binned' : ('Atoms/cm2', 'mean'),
+    'Atoms/cm3 Binned' : ('Atoms/cm3', 'mean'),
+    'Depth Binned' : ('Corr Depth', 'median'),
+}
+
+
+def add_moments(moments, x):
+    """
+    Add the finite values of a (replicas, ...) chunk to the count, mean and
+    sum of squared deviations (M2) of each element, merging the mean and M2
+    of the chunk with those of the earlier chunks (Chan et al.). Unlike sums
+    of x and x**2 this keeps its precision when the spread is small next to
+    the mean.
+
+    moments = [count, mean, M2], or None for the first chunk
+    """
+
+    finite = np.isfinite(x)
+    count = finite.sum(axis=0)
+    with np.errstate(all='ignore'):
+        mean = np.where(count > 0, np.where(finite, x, 0.0).sum(axis=0)/count, 0.0)
+    m2 = np.power(np.where(finite, x - mean, 0.0), 2).sum(axis=0)
+    if moments is None:
+        return [count, mean, m2]
+
+    old_count, old_mean, old_m2 = moments
+    total = old_count + count
+    share = np.where(total > 0, count/np.maximum(total, 1), 0.0)
+    delta = mean - old_mean
+    return [total, old_mean + delta*share, old_m2 + m2 + np.power(delta, 2)*old_count*share]
+
+
+class monteCarlo():
+    """
+    Monte Carlo uncertainty bands of a reduced sample
+
+    ndp = ndpData after runschema, with Absolute and Bin stages
+    seed = seed of the random draws
+    """
+
+    def __init__(self, ndp, seed=None):
+
+        self.ndp = ndp
+        self.rng = np.random.default_rng(seed)
+        schema = getattr(ndp, 'schema', {})
+        self.norm = schema.get('Norm', [])
+        self.corr = schema.get('Corr', [])
+
+
+    def draw_counts(self, dt, num):
+        """
+        Poisson replicas of the counts of a datatype, with deadtime
+        correction, as a (num, ...) array
+        """
+
+        data = self.ndp.data[dt]
+        counts = self.rng.poisson(np.asarray(data["Counts"]), size=(num,) + np.shape(data["Counts"]))
+        livetime = np.asarray(data["Live Time"], dtype=np.float64)
+        realtime = np.asarray(data["Real Time"], dtype=np.float64)
+        if livetime.ndim == 1:
+            livetime = livetime[:, None]
+            realtime = realtime[:, None]
+        return counts*realtime/livetime
+
+
+    def chain(self, num, calib_coeffs):
+        """
+        Reduce num replicas, with calib_coeffs holding one calibration for
+        each replica or a single one for all of them
+
+        Returns
+        -------
+        Dictionary of Corr Cts, Atoms/cm2, Atoms/cm3 and the Corr Depth of
+        each replica. Unlike scale2ref, channels of zero width give
+        non-finite Atoms/cm3, which the statistics skip.
+        """
+
+        ndp = self.ndp
+        lowchan, hichan = ndp.instrument["Mon Peak Channels"]
+        loaded = [dt for dt in ndp.data if "Counts" in ndp.data[dt]]
+
+        cts = {}
+        for prefix in PREFIXES:
+            dt_dat = prefix + ' Dat'
+            dt_mon = prefix + ' Mon'
+            if dt_dat not in loaded:
+                continue
+            values = self.draw_counts(dt_dat, num)
+            if prefix in self.norm:
+                monitor = self.draw_counts(dt_mon, num)[..., lowchan:hichan].sum(axis=-1, keepdims=True)
+                values = values/monitor
+            cts[prefix] = values
+
+        for prefix in PREFIXES:
+            if prefix in self.corr and prefix in cts:
+                cts[prefix] = cts[prefix] - cts['Bgd']
+
+        absolute = ndp.schema['Absolute']
+        low, high = ndp.ref_windows()['alpha*']
+        alpha_cts = cts['Ref'][..., low:high].sum(axis=-1)
+        ref_conc = self.rng.normal(absolute['Ref Conc'], absolute['Ref Conc Uncert'], num)
+
+        sam = ndp.data['Sam Dat']
+        scale_coeff = (ref_conc * ndp.data['Ref Dat']["Cross Sec"]) / (alpha_cts * sam["Cross Sec"])
+        scale_coeff = scale_coeff.reshape((num,) + (1,)*(cts['Sam'].ndim - 1))
+        atoms = scale_coeff * cts['Sam'] / (sam["Branch Frac"]*sam['Abundance'])
+
+        # One depth scale for every replica when the calibration is fixed
+        scale = depth_scale(ndp.detector["Channels"], calib_coeffs, ndp.instrument["Zero Channel"],
+                            ndp.TRIM["Coeffs"], depth_function(ndp.TRIM))
+        width = scale['Del Depth']
+        width = width.reshape(width.shape[:1] + (1,)*(atoms.ndim - 2) + width.shape[-1:])
+        volume = atoms/width
+
+        return {'Corr Cts': cts['Sam'], 'Atoms/cm2': atoms, 'Atoms/cm3': volume,
+                'Corr Depth': np.broadcast_to(scale['Corr Depth'], (num,) + scale['Corr Depth'].shape[1:])}
+
+
+    def run(self, replicas=1000, calib_uncert=None, level=0.6827, keep=False):
+        """
+        Draw and reduce the replicas
+
+        Parameters
+        ----------
+        replicas : int
+            Number of replicas
+        calib_uncert : [slope, offset]
+            Standard deviations of the Calib Coeffs, or None to keep the
+            calibration fixed
+        level : float
+            Probability covered by the Low and High limits of each band
+        keep : bool
+            Also return the replicas of the binned results. The percentiles
+            are then taken from every replica rather than the first
+            QUANTILE_REPLICAS.
+
+        Returns
+        -------
+        Dictionary of the names of RESULTS to dictionaries with the Mean and
+        Std of the replicas, and for binned results the Low, Median and High
+        percentiles. Statistics skip replicas that are not finite.
+
+        """
+
+        ndp = self.ndp
+        edges = np.asarray(ndp.detector['Bin Edges'])
+        num_bins = len(edges) - 1
+        pad = len(ndp.detector['Channels Binned']) - num_bins
+        groups = bin_groups(edges)
+
+        width = sum(np.size(ndp.data[prefix + ' Dat']['Counts']) for prefix in PREFIXES
+                    if "Counts" in ndp.data[prefix + ' Dat'])
+        chunk = max(int(CHUNK_VALUES // max(2*width, 1)), 1)
+
+        # Running moments for every result, and the replicas of the binned
+        # results that the percentiles are taken from
+        moments = {}
+        binned = {}
+        stored = 0
+        for start in range(0, replicas, chunk):
+            num = min(chunk, replicas - start)
+            calib = np.asarray(ndp.instrument["Calib Coeffs"], dtype=np.float64).reshape(1, 2)
+            if calib_uncert is not None:
+                calib = calib + self.rng.normal(0.0, 1.0, (num, 2))*np.asarray(calib_uncert)
+
+            with np.errstate(all='ignore'):
+                values = self.chain(num, calib)
+                store = num if keep else min(num, QUANTILE_REPLICAS - stored)
+                for name, how in RESULTS.items():
+                    if how is None:
+                        x = values[name]
+                    else:
+                        key, method = how
+                        x = bin_reduce(values[key], groups, num_bins, method)
+                        x = np.concatenate((x, np.zeros(x.shape[:-1] + (pad,))), axis=-1)
+                        if store > 0:
+                            binned.setdefault(name, []).append(x[:store])
+                    moments[name] = add_moments(moments.get(name), x)
+                stored += max(store, 0)
+
+        tail = 100*(1 - level)/2
+        results = {}
+        with np.errstate(all='ignore'):
+            for name, (count, mean, m2) in moments.items():
+                empty = count == 0
+                results[name] = {
+                    'Mean': np.where(empty, np.nan, mean),
+                    'Std': np.where(empty, np.nan, np.sqrt(m2/np.maximum(count - 1, 1))),
+                    }
+            for name, chunks in binned.items():
+                x = np.concatenate(chunks)
+                x = np.where(np.isfinite(x), x, np.nan)
+                low, median, high = np.nanpercentile(x, [tail, 50, 100 - tail], axis=0)
+                results[name].update({'Low': low, 'Median': median, 'High': high})
+                if keep:
+                    results[name]['Replicas'] = x
+
+        return results
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Hooks for instrumenting ndpData
+
+ndpData calls the before and after methods of each registered hook around
+every stage of runschema and around every file it reads. A hook receives an
+event dictionary:
+
+Kind = 'Stage' or 'File'
+Stage = Eval, Load, Norm, Corr, Absolute, Bin or Save for a stage, and
+        'Read' for a file
+File = path of the file, for file events
+Error = exception raised inside the event, set before after is called
+
+File events can be sent from the threads of ndpData.loaddatasets.
+"""
+
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+import numpy as np
+
+from ndp.compressed import file_stat
+
+
+# Returned by ndpData.stage when no hook is registered
+NO_HOOKS = nullcontext()
+
+
+class stageHook():
+    """
+    Base class of hooks. Override before and after, which receive the same
+    event dictionary for the start and end of an event.
+    """
+
+    def before(self, event):
+        return
+
+    def after(self, event):
+        return
+
+
+class stageEvent():
+    """
+    Context that sends one event to a list of hooks. after is called in
+    reverse order, and is called when the event raises an exception.
+    """
+
+    __slots__ = ('hooks', 'event')
+
+    def __init__(self, hooks, event):
+        self.hooks = list(hooks)
+        self.event = event
+
+    def __enter__(self):
+        for hook in self.hooks:
+            hook.before(self.event)
+        return self.event
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.event['Error'] = repr(exc)
+        for hook in reversed(self.hooks):
+            hook.after(self.event)
+        return False
+
+
+class stageProfiler(stageHook):
+    """
+    Hook that measures each event
+
+    For every event a record is kept with the wall time, CPU time (of the
+    process for stages and of the reading thread for files) and bytes of
+    the files read, as given by ndp.compressed.file_stat: the uncompressed
+    size of a zip member and the size on disk of any other file. With memory set, tracemalloc is started and the records
+    of stages also hold the peak traced memory, the change in traced memory
+    and the change in the number of live NumPy arrays. Tracing memory slows
+    the reduction down.
+
+    The peak of tracemalloc is that of the whole process, so files, which
+    can be read by several threads at once, get no memory of their own. The
+    reads of a stage count toward its peak.
+
+    memory = trace memory and array allocations
+    log = JSON-lines file that each record is appended to
+    """
+
+    def __init__(self, memory=False, log=None):
+
+        self.memory = memory
+        self.log = log
+        self.records = []
+        self.open = {}
+        self.lock = threading.Lock()
+        self.started = False
+
+
+    def before(self, event):
+
+        if event['Kind'] == 'File':
+            cpu = time.thread_time()
+        else:
+            cpu = time.process_time()
+        state = {'Wall': time.perf_counter(), 'CPU': cpu, 'Bytes': 0}
+
+        if self.memory and event['Kind'] == 'Stage':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started = True
+            current, peak = tracemalloc.get_traced_memory()
+            with self.lock:
+                # Nested stages share the peak, so keep it before it is reset
+                for other in self.open.values():
+                    if 'Peak' in other:
+                        other['Peak'] = max(other['Peak'], peak)
+            tracemalloc.reset_peak()
+            state['Memory'] = current
+            state['Peak'] = current
+            state['Arrays'] = count_arrays()
+
+        with self.lock:
+            self.open[id(event)] = state
+        return
+
+
+    def after(self, event):
+
+        with self.lock:
+            state = self.open.pop(id(event))
+        if event['Kind'] == 'File':
+            cpu = time.thread_time()
+        else:
+            cpu = time.process_time()
+
+        record = {
+            'Kind' : event['Kind'],
+            'Stage' : event['Stage'],
+            'Wall' : time.perf_counter() - state['Wall'],
+            'CPU' : cpu - state['CPU'],
+            'Bytes' : state['Bytes'],
+        }
+        if 'File' in event:
+            record['File'] = event['File']
+            try:
+                record['Bytes'] = file_stat(event['File'])[0]
+            except OSError:
+                pass
+        if 'Error' in event:
+            record['Error'] = event['Error']
+
+        if 'Memory' in state and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            record['Peak Memory'] = max(state['Peak'], peak) - state['Memory']
+            record['Allocated'] = current - state['Memory']
+            record['Arrays'] = count_arrays() - state['Arrays']
+
+        with self.lock:
+            # Bytes read by files count toward the stages that are open
+            for other in self.open.values():
+                other['Bytes'] += record['Bytes'] if record['Kind'] == 'File' else 0
+                if 'Peak' in other and 'Peak Memory' in record:
+                    other['Peak'] = max(other['Peak'], state['Memory'] + record['Peak Memory'])
+            self.records.append(record)
+            if self.log is not None:
+                with open(self.log, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        return
+
+
+    def report(self):
+        """
+        Summary of the records
+
+        Returns
+        -------
+        Dictionary with the list of Events, and for each stage and for file
+        reads the number of Calls and the totals of Wall, CPU and Bytes, and
+        for stages the largest Peak Memory
+
+        """
+
+        summary = {}
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            stage = summary.setdefault(record['Stage'], {'Calls': 0, 'Wall': 0.0, 'CPU': 0.0, 'Bytes': 0})
+            stage['Calls'] += 1
+            stage['Wall'] += record['Wall']
+            stage['CPU'] += record['CPU']
+            stage['Bytes'] += record['Bytes']
+            if 'Peak Memory' in record:
+                stage['Peak Memory'] = max(stage.get('Peak Memory', 0), record['Peak Memory'])
+            if 'Arrays' in record:
+                stage['Arrays'] = stage.get('Arrays', 0) + record['Arrays']
+
+        return {'Stages': summary, 'Events': records}
+
+
+    def clear(self):
+        """
+        Forget the records, and stop tracing memory if this profiler started it
+        """
+
+        with self.lock:
+            self.records = []
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+        return
+
+
+def count_arrays():
+    """
+    Number of live memory blocks allocated by NumPy, as traced by tracemalloc
+    """
+
+    snapshot = tracemalloc.take_snapshot()
+    snapshot = snapshot.filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+    return len(snapshot.traces)
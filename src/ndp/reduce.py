@@ -5,11 +5,74 @@ Neutron Depth Profiling Data Reduction
 
 import numpy as np
 import math
-import re
 import os
-import csv
 import json
+import warnings
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from ndp.spectrum import read_spectrum
+from ndp.listmode import read_listmode
+from ndp.trim import read_trim
+from ndp.compressed import file_stat
+from ndp.cache import spectrumCache, trimCache, cache_enabled
+from ndp.dataset import compact, INTERMEDIATES
+from ndp.writers import write_profile
+from ndp.profiling import stageEvent, NO_HOOKS
+from ndp.integrate import windowIntegrator, REF_PEAK_CHANNELS
+from ndp.sweep import depth_scale
+from ndp.depthmodel import get_model, depth_function, depth_to_channel
+from ndp.checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_PRODUCTS, CHECKPOINT_INSTRUMENT
+from ndp.binning import fixed_edges, depth_edges, log_edges, check_edges, bin_groups, bin_reduce
+
+
+# Stages of runschema whose results each stage uses
+STAGE_DEPENDS = {
+    'Eval' : [],
+    'Load' : [],
+    'Norm' : ['Load'],
+    'Corr' : ['Norm'],
+    'Absolute' : ['Corr', 'Eval'],
+    'Bin' : ['Absolute', 'Eval', 'Load'],
+    'Save' : ['Bin'],
+    }
+
+# Datatypes kept as a stack of spectra, one per file, in time resolved mode
+TIME_RESOLVED = ['Sam Dat', 'Sam Mon']
+
+
+def per_file(x):
+    """
+    Per file values (such as live times) as a column, so they broadcast
+    against a (files x channels) stack. Other values are returned as is.
+    """
+    
+    if np.ndim(x) == 1:
+        return np.asarray(x)[:, None]
+    return x
+
+
+def elapsed_times(spectra):
+    """
+    Seconds from the start of the first spectrum to the start of each one.
+    The header times have no year, so runs that cross a new year, or times
+    that can not be parsed, fall back to the sum of the real times.
+    """
+    
+    # Spectra of list-mode files carry their full start time
+    if all("Start" in spectrum for spectrum in spectra):
+        return np.array([(spectrum["Start"] - spectra[0]["Start"]).total_seconds() for spectrum in spectra])
+    try:
+        starts = [datetime.strptime(spectrum["Datetime"], '%a %b %d %H:%M:%S')
+                  for spectrum in spectra]
+        elapsed = np.array([(start - starts[0]).total_seconds() for start in starts])
+    except ValueError:
+        elapsed = None
+    if elapsed is None or np.any(elapsed < 0):
+        real = np.array([spectrum["Real Time"] for spectrum in spectra])
+        elapsed = np.concatenate(([0.0], np.cumsum(real)[:-1]))
+    return elapsed
 
 
 class ndpData():
@@ -34,6 +97,10 @@ class ndpData():
                 1900,
                 2901
             ],
+            "Ref Peak Channels": {
+                "alpha*": [1791, 2142],
+                "alpha": [2291, 2592]
+            },
             "Calib Coeffs": [
                 0.7144,
                 -12.45
@@ -107,6 +174,65 @@ class ndpData():
             },
         }
         
+        # Parsed spectrum files are kept on disk between runs when NDP_CACHE=1
+        # is set, or a spectrumCache is assigned. None reads the text files.
+        self.cache = spectrumCache() if cache_enabled() else None
+        
+        # Evaluated TRIM layer stacks are kept in memory and on disk when
+        # NDP_CACHE=1 is set. None evaluates the TRIM files on every run.
+        self.trim_cache = trimCache() if cache_enabled() else None
+        
+        # Number of threads used to read files. Reading is latency bound on
+        # network shares, so more workers than cores can help.
+        self.workers = 1
+        
+        # Keep the spectra read from each file in self.spectra, by datatype
+        # and filename, as ndpLive does to follow the files
+        self.keep_spectra = False
+        self.spectra = {}
+        
+        # Products supplied from outside of runschema, see ndpBatch
+        self.shared = []
+        
+        # Inputs of each stage in its last successful run of runschema, and
+        # of the stages that are running
+        self.stage_record = {}
+        self.stage_pending = {}
+        self.stages = {"Run" : [], "Skipped" : []}
+        
+        # Keep the sample spectra of each file instead of their sum, see stackfiles
+        self.time_resolved = False
+        
+        # Objects with before(event) and after(event) methods that are called
+        # around each stage of runschema and each file read, see ndp.profiling
+        self.hooks = []
+        
+    
+    def compact(self, dtype=np.float32, drop_intermediates=False):
+        """
+        Store each dataset of ndp.data, and ndp.detector, as an ndpDataset
+        that keeps its channel arrays in one contiguous block. Values read
+        the same way as before, so existing code and notebooks work unchanged.
+        Arrays added by later stages are stored in the same block.
+        
+        dtype = float32 or float64 storage of the floating point arrays
+        drop_intermediates = remove Counts/Dt, Norm Cts and Corr Cts and 
+                             their uncertainties, which are only needed 
+                             while reducing. The stages that made them, and
+                             the stages after those, run again on the next
+                             incremental runschema.
+        """
+        
+        numchannels = self.instrument["Num Channels"]
+        for dt in self.data:
+            if drop_intermediates:
+                for key in self.data[dt]:
+                    if key in INTERMEDIATES:
+                        self.forget_stage(INTERMEDIATES[key])
+            self.data[dt] = compact(self.data[dt], dtype, drop_intermediates, numchannels)
+        self.detector = compact(self.detector, dtype, False, numchannels)
+        
+        return
     
     def readconfig(self, config_filename="instrument.dat"):
         """
@@ -118,66 +244,446 @@ class ndpData():
         return
 
 
-    def runschema(self, schemafilename = "schema.json"):
+    def runschema(self, schemafilename = "schema.json", incremental=False):
         """
-        Run the operations listed in the schema file
+        Run the operations listed in the schema file. A schema that is
+        already loaded as a dictionary can be passed in place of the filename.
+        
+        Products listed in self.shared (any of 'TRIM', 'Bgd Dat', 'Bgd Mon',
+        'Ref Dat', 'Ref Mon') were computed elsewhere, for example by ndpBatch, 
+        and are not evaluated, loaded, normalized, corrected or integrated again.
+        The checkpoint files listed in schema['Checkpoints'] are loaded first
+        and their products are added to self.shared, see use_checkpoint.
+        
+        With incremental set, a stage is skipped when its inputs, and the inputs
+        of every stage it depends on, are the same as in the last successful
+        run of this object. The stages that ran and were skipped are listed in
+        self.stages.
         """
 
         bin_flag = True #Bin op must run, even if bin size is 1
-        self.readschema(schemafilename)
+        if isinstance(schemafilename, dict):
+            self.schema = schemafilename
+        else:
+            self.readschema(schemafilename)
         
         ops = self.schema['Operations']
+        self.stages = {"Run" : [], "Skipped" : []}
+        if 'Time Resolved' in self.schema:
+            self.time_resolved = self.schema['Time Resolved']
+        
+        for filename in self.schema.get('Checkpoints', []):
+            self.use_checkpoint(filename)
         
         for op in ops:
-            if 'Eval' in op:
-                kev, depth, mat = self.evalTRIM(self.schema['TRIM'], self.instrument['Beam Energy'])
-                self.TRIM['Layers'] = self.schema['TRIM']
-                self.TRIM['Coeffs'] = self.fit_TRIM(kev, depth)
-                self.TRIM['Energy'] = kev
-                self.TRIM['Depth'] = depth
-                self.TRIM['Material'] = mat
-                self.chan2depth()
+            if 'Eval' in op and 'TRIM' not in self.shared:
+                if self.checkstage('Eval', incremental):
+                    with self.stage('Eval'):
+                        self.set_TRIM()
+                    self.stage_done('Eval')
             if 'Load' in op:
-                for dt in self.schema['Load']:
-                    self.data[dt]["Path"] = self.schema[dt]['Path']
-                    self.data[dt]["Files"] = self.schema[dt]["Files"]
-                    self.loadfiles(dt)
+                if self.checkstage('Load', incremental):
+                    with self.stage('Load'):
+                        dts = [dt for dt in self.schema['Load'] if dt not in self.shared]
+                        for dt in dts:
+                            self.set_dataset(dt, self.schema[dt])
+                        self.loaddatasets(dts)
+                    self.stage_done('Load')
             if 'Norm' in op:
-                for dt in self.schema['Norm']:
-                    self.normalize(dt)
+                if self.checkstage('Norm', incremental):
+                    with self.stage('Norm'):
+                        for dt in self.schema['Norm']:
+                            if dt + ' Dat' not in self.shared:
+                                self.normalize(dt)
+                    self.stage_done('Norm')
             if 'Corr' in op:
-                for dt in self.schema['Corr']:
-                    self.correct(dt)
+                if self.checkstage('Corr', incremental):
+                    with self.stage('Corr'):
+                        for dt in self.schema['Corr']:
+                            if dt + ' Dat' not in self.shared:
+                                self.correct(dt)
+                    self.stage_done('Corr')
             if 'Absolute' in op:
-                self.data['Ref Dat']["Atom"] = self.schema['Absolute']['Ref Atom'] 
-                self.data['Ref Dat']["Cross Sec"] = self.schema['Absolute']['Ref Cross Sec'] 
-                self.data['Ref Dat']["Abundance"] = self.schema['Absolute']['Ref Abundance']
-                self.data['Ref Dat']["Conc"] = self.schema['Absolute']['Ref Conc'] 
-                self.data['Ref Dat']["Conc Uncert"] = self.schema['Absolute']['Ref Conc Uncert']
-                self.data['Sam Dat']["Atom"] = self.schema['Absolute']['Atom'] 
-                self.data['Sam Dat']["Cross Sec"] = self.schema['Absolute']['Cross Sec'] 
-                self.data['Sam Dat']["Abundance"] = self.schema['Absolute']['Abundance']
-                self.data['Sam Dat']["Branch Frac"] = self.schema['Absolute']['Branch Frac']                    
-                self.ref_integrate()
-                self.scale2ref()                    
+                if self.checkstage('Absolute', incremental):
+                    with self.stage('Absolute'):
+                        self.set_absolute()
+                        if 'Ref Dat' not in self.shared:
+                            self.ref_integrate()
+                        self.scale2ref()                    
+                    self.stage_done('Absolute')
             if 'Bin' in op:
-                bin_size = int(self.schema['Bin'])
-                self.bin_channels(bin_size)
+                if self.checkstage('Bin', incremental):
+                    with self.stage('Bin'):
+                        self.set_bins(self.schema['Bin'])
+                    self.stage_done('Bin')
                 bin_flag = False
             if 'Save' in op:
-                filename = self.schema['Save']['Filename']
-                path = self.schema['Save']['Path']
-                columns = self.schema['Save']['Columns']
-                self.saveAtoms(path, filename, columns)
+                if self.checkstage('Save', incremental):
+                    with self.stage('Save'):
+                        filename = self.schema['Save']['Filename']
+                        path = self.schema['Save']['Path']
+                        columns = self.schema['Save']['Columns']
+                        fmt = self.schema['Save'].get('Format', 'csv')
+                        self.saveAtoms(path, filename, columns, fmt)
+                    self.stage_done('Save')
         
         #If user did not bin, then run at the end to get data into binned arrays (binsize = 1)
         if bin_flag: 
-            bin_size = 1
-            self.bin_channels(bin_size)
+            if self.checkstage('Bin', incremental, bins=1):
+                with self.stage('Bin'):
+                    bin_size = 1
+                    self.bin_channels(bin_size)
+                self.stage_done('Bin')
             bin_flag = False
             
         return
 
+    def save_checkpoint(self, filename, kind):
+        """
+        Save the products of a kind of checkpoint, along with the schema
+        entries, instrument and identity of the files they were derived from
+        
+        kind = 'Bgd' for the background datasets, 'Ref' for the reference
+               datasets or 'TRIM' for the depth calibration
+        """
+        
+        if kind == 'TRIM':
+            products = {'TRIM' : self.TRIM, 'Detector' : self.detector}
+            layers = self.TRIM['Layers']
+            inputs = {
+                'TRIM' : layers,
+                'Model' : self.TRIM.get('Model', 'Poly'),
+                'Files' : [self.file_identity(layer['Path'] + filename)
+                           for layer in layers for filename in layer['Files']],
+                }
+        elif kind in CHECKPOINT_PRODUCTS:
+            dts = CHECKPOINT_PRODUCTS[kind]
+            products = {dt : self.data[dt] for dt in dts}
+            inputs = {
+                'Datasets' : {dt : {'Path' : self.data[dt]['Path'], 
+                                    'Files' : list(self.data[dt]['Files'])} for dt in dts},
+                'Files' : [self.file_identity(self.data[dt]['Path'] + filename)
+                           for dt in dts for filename in self.data[dt]['Files']],
+                }
+        else:
+            raise ValueError('Unknown checkpoint ' + str(kind))
+        if kind == 'Ref':
+            inputs['Ref Windows'] = self.ref_windows()
+        inputs['Instrument'] = self.instrument
+        
+        save_checkpoint(filename, kind, products, inputs)
+        return
+    
+    def load_checkpoint(self, filename):
+        """
+        Restore the products of a checkpoint and add them to self.shared
+        
+        Returns the checkpoint metadata: Version, Kind, Created and Inputs
+        """
+        
+        products, meta = load_checkpoint(filename)
+        self.restore_checkpoint(products, meta)
+        return meta
+    
+    def restore_checkpoint(self, products, meta):
+        """
+        Put the products read from a checkpoint into place
+        """
+        
+        if meta['Kind'] == 'TRIM':
+            self.TRIM = products['TRIM']
+            self.detector = products['Detector']
+            shared = ['TRIM']
+        else:
+            for dt in CHECKPOINT_PRODUCTS[meta['Kind']]:
+                self.data[dt] = products[dt]
+            shared = CHECKPOINT_PRODUCTS[meta['Kind']]
+        
+        self.shared = self.shared + [name for name in shared if name not in self.shared]
+        return
+    
+    def use_checkpoint(self, filename):
+        """
+        Load a checkpoint listed in the schema if it was made from the files
+        the schema lists, as they are now, and from the same instrument
+        values (and for TRIM the same depth model). A checkpoint made from
+        other inputs is not used, with a warning, and its products are
+        computed by runschema.
+        """
+        
+        products, meta = load_checkpoint(filename)
+        kind = meta['Kind']
+        schema = self.schema
+        if kind == 'TRIM':
+            layers = schema.get('TRIM', [])
+            current = {
+                'TRIM' : layers,
+                'Model' : self.depth_model(),
+                'Files' : [self.file_identity(layer['Path'] + filename)
+                           for layer in layers for filename in layer['Files']],
+                }
+        else:
+            dts = CHECKPOINT_PRODUCTS[kind]
+            missing = [dt for dt in dts if dt not in schema]
+            if missing:
+                warnings.warn('Checkpoint %s holds %s, which the schema does not list'
+                              % (filename, ', '.join(missing)))
+                return False
+            current = {
+                'Datasets' : {dt : {'Path' : schema[dt]['Path'], 
+                                    'Files' : list(schema[dt]['Files'])} for dt in dts},
+                'Files' : [self.file_identity(schema[dt]['Path'] + filename)
+                           for dt in dts for filename in schema[dt]['Files']],
+                }
+            if kind == 'Ref':
+                current['Ref Windows'] = self.ref_windows()
+        current['Instrument'] = {key : self.instrument.get(key) for key in CHECKPOINT_INSTRUMENT[kind]}
+        
+        inputs = dict(meta['Inputs'])
+        inputs['Instrument'] = {key : inputs.get('Instrument', {}).get(key) 
+                                for key in CHECKPOINT_INSTRUMENT[kind]}
+        changed = [key for key in current 
+                   if json.dumps(current[key], sort_keys=True, default=str) 
+                   != json.dumps(inputs.get(key), sort_keys=True, default=str)]
+        if changed:
+            warnings.warn('Checkpoint %s was made from other %s than the schema lists' 
+                          % (filename, ', '.join(changed)))
+            return False
+        self.restore_checkpoint(products, meta)
+        return True
+    
+    def add_hook(self, hook):
+        """
+        Register a hook, such as ndp.profiling.stageProfiler, that is called
+        before and after each stage of runschema and each file read
+        """
+        
+        self.hooks.append(hook)
+        return
+    
+    def remove_hook(self, hook):
+        """
+        Stop calling a hook registered with add_hook
+        """
+        
+        self.hooks.remove(hook)
+        return
+    
+    def stage(self, name, kind='Stage', **info):
+        """
+        Context in which the registered hooks see one event. Without hooks
+        this returns a shared empty context, so stages run at full speed.
+        """
+        
+        if not self.hooks:
+            return NO_HOOKS
+        info['Kind'] = kind
+        info['Stage'] = name
+        return stageEvent(self.hooks, info)
+
+    def stage_inputs(self, stage):
+        """
+        Return the schema and instrument values a stage of runschema reads,
+        along with the identity of the files it reads
+        """
+        
+        schema = self.schema
+        inputs = {
+            'Operations' : schema['Operations'],
+            'Shared' : self.shared,
+            'Checkpoints' : [self.file_identity(filename) for filename in schema.get('Checkpoints', [])],
+            }
+        
+        if stage == 'Eval':
+            inputs['TRIM'] = schema['TRIM']
+            inputs['Eval'] = schema.get('Eval')
+            inputs['Instrument'] = [self.instrument.get(key) for key in 
+                                    ['Beam Energy', 'Num Channels', 'Zero Channel', 'Calib Coeffs']]
+            inputs['Files'] = [self.file_identity(layer['Path'] + filename) 
+                               for layer in schema['TRIM'] for filename in layer['Files']]
+        if stage == 'Load':
+            inputs['Load'] = schema['Load']
+            inputs['Time Resolved'] = self.time_resolved
+            inputs['Instrument'] = self.instrument.get('Num Channels')
+            inputs['Datasets'] = [schema.get(dt) for dt in schema['Load']]
+            inputs['Files'] = [self.file_identity(schema[dt]['Path'] + filename) 
+                               for dt in schema['Load'] for filename in schema[dt]['Files']]
+        if stage == 'Norm':
+            inputs['Norm'] = schema['Norm']
+            inputs['Instrument'] = self.instrument.get('Mon Peak Channels')
+        if stage == 'Corr':
+            inputs['Corr'] = schema['Corr']
+        if stage == 'Absolute':
+            inputs['Absolute'] = schema['Absolute']
+            inputs['Instrument'] = self.instrument.get('Ref Peak Channels')
+        if stage == 'Bin':
+            inputs['Bin'] = schema.get('Bin')
+        if stage == 'Save':
+            inputs['Save'] = schema['Save']
+            inputs['Exists'] = os.path.exists(schema['Save']['Path'] + schema['Save']['Filename'])
+        
+        return inputs
+    
+    def file_identity(self, filename):
+        """
+        Size and modification time of a file, or None if it can not be found
+        """
+        
+        try:
+            size, mtime_ns = file_stat(filename)
+        except (OSError, ValueError):
+            return None
+        return [filename, size, mtime_ns]
+    
+    def checkstage(self, stage, incremental=True, **inputs):
+        """
+        Return True if a runschema stage has to run. A stage runs if its
+        inputs, or the inputs of an upstream stage in STAGE_DEPENDS, changed
+        since the last run of the stage that succeeded, see stage_done.
+        """
+        
+        inputs.update(self.stage_inputs(stage))
+        inputs['Upstream'] = [self.stage_record.get(dep) for dep in STAGE_DEPENDS[stage]]
+        record = json.dumps(inputs, sort_keys=True, default=str)
+        
+        run = (not incremental) or self.stage_record.get(stage) != record
+        if run:
+            # The record is kept by stage_done once the stage has succeeded
+            self.stage_record.pop(stage, None)
+            self.stage_pending[stage] = record
+            self.stages["Run"].append(stage)
+        else:
+            self.stages["Skipped"].append(stage)
+        
+        return run
+
+    def stage_done(self, stage):
+        """
+        Record the inputs of a stage that checkstage let run, once it has
+        succeeded. A stage that raised is not recorded and runs again.
+        """
+        
+        if stage in self.stage_pending:
+            self.stage_record[stage] = self.stage_pending.pop(stage)
+        return
+
+    def forget_stage(self, stage):
+        """
+        Forget the record of a stage and of every stage downstream of it in
+        STAGE_DEPENDS, so an incremental runschema runs them again. Used when
+        the results of a stage are changed or dropped outside of runschema.
+        """
+        
+        stale = [stage]
+        for name in stale:
+            self.stage_record.pop(name, None)
+            stale.extend([later for later, depends in STAGE_DEPENDS.items() 
+                          if name in depends and later not in stale])
+        return
+
+    def set_TRIM(self):
+        """
+        Evaluate the TRIM layers of the schema and calculate the depth scale
+        of the detector
+        """
+        
+        trim_list = self.schema['TRIM']
+        beam_energy = self.instrument['Beam Energy']
+        
+        result = None
+        if self.trim_cache is not None:
+            stack, key = self.trim_cache.key(trim_list, beam_energy)
+            result = self.trim_cache.get(stack, key)
+        
+        if result is None:
+            kev, depth, mat = self.evalTRIM(trim_list, beam_energy)
+            result = {
+                'Energy': kev,
+                'Depth': depth,
+                'Material': mat,
+                'Coeffs': self.fit_TRIM(kev, depth),
+                }
+            if self.trim_cache is not None:
+                self.trim_cache.put(stack, key, result)
+        
+        self.TRIM['Layers'] = trim_list
+        self.TRIM['Coeffs'] = result['Coeffs']
+        self.TRIM['Energy'] = result['Energy']
+        self.TRIM['Depth'] = result['Depth']
+        self.TRIM['Material'] = result['Material']
+        self.set_depth_model(self.depth_model())
+        self.chan2depth()
+        
+        return
+    
+    def depth_model(self):
+        """
+        Name of the depth model chosen by schema['Eval']['Model'], 'Poly' by
+        default. Eval may also be a list, such as ["TRIM"], with no model.
+        """
+        
+        evaluate = getattr(self, 'schema', {}).get('Eval')
+        if isinstance(evaluate, dict):
+            return evaluate.get('Model', 'Poly')
+        return 'Poly'
+    
+    def set_depth_model(self, name='Poly'):
+        """
+        Fit a depth model of ndp.depthmodel to the TRIM points and keep its
+        lookup table, covering the energies of every channel, in ndp.TRIM
+        """
+        
+        m, b = self.instrument["Calib Coeffs"]
+        numchannels = self.instrument["Num Channels"]
+        energy_range = sorted([b, m*(numchannels - 1) + b])
+        model = get_model(name, self.TRIM['Energy'], self.TRIM['Depth'], energy_range)
+        self.TRIM['Model'] = name
+        self.TRIM['Table Energy'] = model.table_energy
+        self.TRIM['Table Depth'] = model.table_depth
+        
+        return
+    
+    def depth2chan(self, corr_depth):
+        """
+        Fractional detector channel of each depth (nm) below the surface,
+        from the lookup table of the depth model
+        """
+        
+        return depth_to_channel(corr_depth, self.TRIM['Table Energy'], self.TRIM['Table Depth'],
+                                self.instrument["Calib Coeffs"], self.instrument["Zero Channel"])
+    
+    def set_absolute(self):
+        """
+        Copy the reference and sample constants of schema['Absolute'] into ndp.data
+        """
+        
+        self.data['Ref Dat']["Atom"] = self.schema['Absolute']['Ref Atom'] 
+        self.data['Ref Dat']["Cross Sec"] = self.schema['Absolute']['Ref Cross Sec'] 
+        self.data['Ref Dat']["Abundance"] = self.schema['Absolute']['Ref Abundance']
+        self.data['Ref Dat']["Conc"] = self.schema['Absolute']['Ref Conc'] 
+        self.data['Ref Dat']["Conc Uncert"] = self.schema['Absolute']['Ref Conc Uncert']
+        self.data['Sam Dat']["Atom"] = self.schema['Absolute']['Atom'] 
+        self.data['Sam Dat']["Cross Sec"] = self.schema['Absolute']['Cross Sec'] 
+        self.data['Sam Dat']["Abundance"] = self.schema['Absolute']['Abundance']
+        self.data['Sam Dat']["Branch Frac"] = self.schema['Absolute']['Branch Frac']                    
+        
+        return
+
+    def set_dataset(self, dt, entry):
+        """
+        Take the Path, Files and List Mode options of a datatype from its
+        schema entry
+        """
+        
+        self.data[dt]["Path"] = entry['Path']
+        self.data[dt]["Files"] = entry["Files"]
+        if 'List Mode' in entry:
+            self.data[dt]["List Mode"] = entry['List Mode']
+        else:
+            self.data[dt].pop("List Mode", None)
+        
+        return
+    
     def loadfiles(self, dt):
         """
         Function to load a list of NDP data files of a given datatype (Sam Dat, Sam Mon, etc),
@@ -185,36 +691,155 @@ class ndpData():
         
         """
     
-        path = self.data[dt]["Path"]
-        filelist = self.data[dt]["Files"]
-        numfiles = len(filelist)
+        self.loaddatasets([dt])
+        
+        return
+    
+    def loaddatasets(self, dts):
+        """
+        Load the files of several datatypes. When self.workers is more than one,
+        the files of all of the datatypes are read by a pool of threads. 
+        Spectra are summed in the order of the file lists, so the result does
+        not depend on which file finishes first.
+        
+        """
+        
+        filenames = {}
+        readers = {}
+        for dt in dts:
+            path = self.data[dt]["Path"]
+            filenames[dt] = [path + filename for filename in self.data[dt]["Files"]]
+            if "List Mode" in self.data[dt]:
+                readers[dt] = partial(self.readlistmode, options=self.data[dt]["List Mode"])
+            else:
+                readers[dt] = self.readfile
+        
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {dt: [pool.submit(readers[dt], ndp_file) for ndp_file in filenames[dt]]
+                           for dt in dts}
+                spectra = {dt: [future.result() for future in futures[dt]] for dt in dts}
+        else:
+            spectra = {dt: [readers[dt](ndp_file) for ndp_file in filenames[dt]] for dt in dts}
+        
+        if self.cache is not None:
+            self.cache.flush()
+        
+        if self.keep_spectra:
+            for dt in dts:
+                self.spectra[dt] = dict(zip(self.data[dt]["Files"], spectra[dt]))
+        
+        # A list-mode file gives a list of spectra, one for each time slice
+        for dt in dts:
+            if "List Mode" in self.data[dt]:
+                spectra[dt] = [spectrum for slices in spectra[dt] for spectrum in slices]
+        
+        for dt in dts:
+            if self.time_resolved and dt in TIME_RESOLVED:
+                self.stackfiles(dt, spectra[dt])
+            else:
+                self.sumfiles(dt, spectra[dt])
+        
+        return
+    
+    def sumfiles(self, dt, spectra):
+        """
+        Sum a list of spectra read by readfile into the datatype dt and 
+        apply the deadtime correction
+        
+        """
+        
         numchannels = self.instrument["Num Channels"]
         
         if("Channel Sum" not in self.data[dt]["Operations"]):
                 self.data[dt]["Operations"].append("Channel Sum")
         
-        for filenum in range(numfiles):
-            ndp_file = path + filelist[filenum]
-            with open(ndp_file) as f:
-                lines = f.readlines() #reads all of the file into a numbered list of strings
-                self.data[dt]["Detector"].append(lines[0][12:-1])
-                self.data[dt]["Labels"].append(lines[1][8:-1])
-                self.data[dt]["Live Time"] += float(lines[3][12:-1])
-                self.data[dt]["Real Time"] += float(lines[4][12:-1])
+        # Start from an empty sum when files are loaded again
+        self.data[dt]["Detector"] = []
+        self.data[dt]["Labels"] = []
+        self.data[dt]["Live Time"] = 0.0
+        self.data[dt]["Real Time"] = 0.0
+        
+        for filenum in range(len(spectra)):
+            spectrum = spectra[filenum]
+            self.data[dt]["Detector"].append(spectrum["Detector"])
+            self.data[dt]["Labels"].append(spectrum["Label"])
+            self.data[dt]["Live Time"] += spectrum["Live Time"]
+            self.data[dt]["Real Time"] += spectrum["Real Time"]
+        
+            if(filenum<1): 
+                self.data[dt]["Datetime"] = \
+                    datetime.strptime(spectrum["Datetime"],'%a %b %y %H:%M:%S')
+                self.data[dt]["Counts"] = np.zeros(numchannels)
             
-                if(filenum<1): 
-                    self.data[dt]["Datetime"] = \
-                        datetime.strptime(lines[2][12:-10],'%a %b %y %H:%M:%S')
-                    self.data[dt]["Counts"] = np.zeros(numchannels)
-                
-                for channel in range(numchannels):
-                    counts = lines[channel+8].split()
-                    self.data[dt]["Counts"][channel] += float(counts[1])
+            self.data[dt]["Counts"] += spectrum["Counts"]
+    
+        self.deadtime(dt)
+        
+        return
     
+    def stackfiles(self, dt, spectra):
+        """
+        Keep a list of spectra read by readfile as a (files x channels) stack
+        in the datatype dt and apply the deadtime correction
+        
+        Live Time and Real Time become arrays with a value per file, and 
+        Elapsed holds the seconds from the start of the first file to the 
+        start of each file. The later stages then reduce every file at once,
+        giving a depth-time map in Atoms/cm2, Atoms/cm3 and their binned arrays.
+        """
+        
+        numchannels = self.instrument["Num Channels"]
+        
+        if("Channel Stack" not in self.data[dt]["Operations"]):
+                self.data[dt]["Operations"].append("Channel Stack")
+        
+        self.data[dt]["Detector"] = [spectrum["Detector"] for spectrum in spectra]
+        self.data[dt]["Labels"] = [spectrum["Label"] for spectrum in spectra]
+        self.data[dt]["Live Time"] = np.array([spectrum["Live Time"] for spectrum in spectra])
+        self.data[dt]["Real Time"] = np.array([spectrum["Real Time"] for spectrum in spectra])
+        self.data[dt]["Datetime"] = \
+            datetime.strptime(spectra[0]["Datetime"],'%a %b %y %H:%M:%S')
+        self.data[dt]["Elapsed"] = elapsed_times(spectra)
+        
+        self.data[dt]["Counts"] = np.zeros((len(spectra), numchannels))
+        for filenum in range(len(spectra)):
+            self.data[dt]["Counts"][filenum] = spectra[filenum]["Counts"]
+        
         self.deadtime(dt)
         
         return
+    
+    def readfile(self, ndp_file):
+        """
+        Read one spectrum file, using the spectrum cache when it is enabled
+        """
+        
+        numchannels = self.instrument["Num Channels"]
+        with self.stage('Read', 'File', File=ndp_file):
+            if self.cache is None:
+                return read_spectrum(ndp_file, numchannels)
+            
+            key = self.cache.key(ndp_file, numchannels)
+            spectrum = self.cache.get(key)
+            if spectrum is None:
+                spectrum = read_spectrum(ndp_file, numchannels)
+                self.cache.put(key, ndp_file, spectrum)
+        
+        return spectrum
+        
+    def readlistmode(self, ndp_file, options):
+        """
+        Histogram one list-mode file into a list of spectra, one for each
+        time slice, with the 'List Mode' options of its datatype, see ndp.listmode
+        """
+        
+        numchannels = self.instrument["Num Channels"]
+        with self.stage('Read', 'File', File=ndp_file):
+            spectra = read_listmode(ndp_file, numchannels, options)
         
+        return spectra
+    
     def readschema(self, filename):
         """
         Read data schema file
@@ -245,49 +870,31 @@ class ndpData():
 
         """
 
-        # Regex to extract the material label from TRIM header (line 10)
-        p1 = re.compile(r'\>.*\)')    
-        # Regex to extract energy from the third or fourth column of the TRIM file
-        p2 = re.compile(r'\.[0-9]*E\+[0-9]*')
-        # Regex to extract depth from the fourth or fifth column of the TRIM file
-        p3 = re.compile(r'[0-9]*E-[0-9]*')
-        
-
         # TRIM calculations are done for each material layer, with multiple
         # files within a layer. TRIM provides the relative energy and depth to 
         # the top interface. Offset determines the energy and depth of the
         # top interface of the current layer.
         ev_offset = 0.0
         depth_offset = 0.0        
-        energy = np.array([beam_energy])
-        thick = np.array([0.0])
-        coeffs = np.zeros(3)
+        numfiles = sum([len(layer['Files']) for layer in trim_list])
+        energy = np.zeros(numfiles+1)
+        thick = np.zeros(numfiles+1)
+        energy[0] = beam_energy
         material = []
         
+        n = 1
         for layer in trim_list:
             for filename in layer['Files']:
                 trim_file = layer['Path'] + filename
-        
-                with open(trim_file) as f:
-                    lines = f.readlines()
-                    num_lines = len(lines)-12
-                    ev = np.zeros(num_lines)
-                    depth = np.zeros(num_lines)
-                    m = p1.search(lines[9])
-                    material.append(m.group()[1:])
-                    i=0
-                    for line in lines[12:]:        
-                        m = p2.search(line)
-                        ev[i] = float(m.group())/1000.0 - ev_offset
-                        m = p3.search(line)
-                        depth[i] = float(m.group())/10 + depth_offset
-                        i += 1
-                    
-                energy = np.append(energy, np.median(ev))
-                thick = np.append(thick, np.average(depth))
-
-            ev_offset = energy[0] - np.min(energy)
-            depth_offset = thick[0] + np.max(thick)
+                with self.stage('Read', 'File', File=trim_file):
+                    mat, ev, depth = read_trim(trim_file)
+                material.append(mat)
+                energy[n] = np.median(ev - ev_offset)
+                thick[n] = np.average(depth + depth_offset)
+                n += 1
+
+            ev_offset = energy[0] - np.min(energy[:n])
+            depth_offset = thick[0] + np.max(thick[:n])
                 
         return energy, thick, material
     
@@ -312,29 +919,26 @@ class ndpData():
         
 
     def chan2depth(self):
+        """
+        Depth scale of the detector channels from the energy calibration,
+        Zero Channel and TRIM coefficients, see ndp.sweep.depth_scale
+        """
 
+        # Detectors with other than the default 4096 channels
+        numchannels = self.instrument["Num Channels"]
+        if len(self.detector["Channels"]) != numchannels:
+            self.detector["Channels"] = np.arange(0, numchannels)
     
-        # These values change infrequently and are provided by the instrument scientist
-        m, b = self.instrument["Calib Coeffs"]
-        self.detector["Energy"] = (m*self.detector["Channels"]) + b
-    
-        # These values are derived from SRIM/TRIM, freeware used to calculate energy of generated ions in matter
-        # Depth is in nanometers
-        a, b, c = self.TRIM["Coeffs"]
-        self.detector["Depth"] = a*np.power(self.detector["Energy"],2) \
-            + b*self.detector["Energy"] + c
-        
-        # Zero channel is defined through the experimental setup
-        zerochan = self.instrument["Zero Channel"]
-        self.detector["Corr Depth"] = self.detector["Depth"] \
-            - self.detector["Depth"][zerochan]
-        
-        # Del Depth in centimeters
-        self.detector["Del Depth"] = np.zeros(len(self.detector["Corr Depth"]))
-        for x in range(len(self.detector["Corr Depth"])-1):
-            self.detector["Del Depth"][x] = 1e-7*(self.detector["Corr Depth"][x-1] - self.detector["Corr Depth"][x])
-    
-        self.detector["Del Depth Uncert"] = 0.05 * self.detector["Del Depth"]
+        # Calib Coeffs and Zero Channel change infrequently and are provided by
+        # the instrument scientist. The TRIM coefficients, or the lookup table
+        # of a depth model, are derived from SRIM/TRIM, freeware used to 
+        # calculate energy of generated ions in matter. Depth is in 
+        # nanometers, Del Depth in centimeters.
+        scale = depth_scale(self.detector["Channels"], self.instrument["Calib Coeffs"],
+                            self.instrument["Zero Channel"], self.TRIM["Coeffs"],
+                            depth_function(self.TRIM))
+        for key in ("Energy", "Depth", "Corr Depth", "Del Depth", "Del Depth Uncert"):
+            self.detector[key] = scale[key]
         
         return
     
@@ -356,6 +960,8 @@ class ndpData():
         livetime = self.data[dt]["Live Time"]
         realtime = self.data[dt]["Real Time"]
         self.data[dt]["Dt ratio"] = livetime/realtime
+        livetime = per_file(livetime)
+        realtime = per_file(realtime)
         self.data[dt]["Counts/Dt"] = self.data[dt]["Counts"]*realtime/livetime
         self.data[dt]["Counts/Dt Uncert"] = np.nan_to_num(np.divide(
             self.data[dt]["Counts/Dt"],np.sqrt(self.data[dt]["Counts"])))
@@ -383,13 +989,16 @@ class ndpData():
     
         #Sum over range set to capture 10B alpha peaks (channels 1900-2900)
         lowchan, hichan = self.instrument["Mon Peak Channels"]
-        mon_sum = np.sum(self.data[dt_mon]["Counts/Dt"][lowchan:hichan])        
+        # One monitor sum per file for a time resolved stack
+        mon_sum = windowIntegrator(self.data[dt_mon]["Counts/Dt"]).integrate(lowchan, hichan)
         self.data[dt_dat]["Monitor"] = mon_sum
-        self.data[dt_dat]["Monitor Uncert"] = math.sqrt(mon_sum)    
+        self.data[dt_dat]["Monitor Uncert"] = np.sqrt(mon_sum)    
     
-        self.data[dt_dat]["Norm Cts"] = self.data[dt_dat]["Counts/Dt"]/self.data[dt_dat]["Monitor"]
+        monitor = per_file(self.data[dt_dat]["Monitor"])
+        monitor_uncert = per_file(self.data[dt_dat]["Monitor Uncert"])
+        self.data[dt_dat]["Norm Cts"] = self.data[dt_dat]["Counts/Dt"]/monitor
         x2 = np.nan_to_num(np.power(self.data[dt_dat]["Counts/Dt Uncert"]/self.data[dt_dat]["Counts/Dt"],2))
-        y2 = math.pow(self.data[dt_dat]["Monitor Uncert"]/self.data[dt_dat]["Monitor"],2)
+        y2 = np.power(monitor_uncert/monitor,2)
         self.data[dt_dat]["Norm Cts Uncert"] = self.data[dt_dat]["Norm Cts"]*np.sqrt(x2+y2)
     
         np.seterr(**old_settings)
@@ -420,20 +1029,46 @@ class ndpData():
         """
         Integrate the alpha peaks of the reference data set
         Also, set atomic concentration field here for now
+        
+        The peak windows are schema['Absolute']['Ref Windows'] if it is set,
+        otherwise instrument['Ref Peak Channels']. Each window adds its sum
+        and <name> Uncert to ndp.data['Ref Dat']. scale2ref uses alpha*.
         """
     
         dt = 'Ref Dat'
         if("Integrated Peaks" not in self.data[dt]["Operations"]):
             self.data[dt]["Operations"].append("Integrated Peaks")
     
-        self.data[dt]["alpha*"] = np.sum(self.data[dt]["Corr Cts"][1791:2142])        
-        self.data[dt]["alpha"] = np.sum(self.data[dt]["Corr Cts"][2291:2592])        
-        cts_uncert2 = np.power(self.data[dt]["Corr Cts Uncert"], 2)
-        self.data[dt]["alpha* Uncert"] = math.sqrt(np.sum(cts_uncert2[1791:2142]))
-        self.data[dt]["alpha Uncert"] = math.sqrt(np.sum(cts_uncert2[2291:2592]))
+        for name, (value, uncert) in self.integrate_windows(dt, self.ref_windows()).items():
+            self.data[dt][name] = value
+            self.data[dt][name + " Uncert"] = uncert
             
         return
     
+    def ref_windows(self):
+        """
+        Windows of the reference peaks, by name
+        """
+        
+        schema = getattr(self, 'schema', {})
+        if 'Ref Windows' in schema.get('Absolute', {}):
+            return schema['Absolute']['Ref Windows']
+        return self.instrument.get("Ref Peak Channels", REF_PEAK_CHANNELS)
+    
+    def integrate_windows(self, dt, windows, key="Corr Cts"):
+        """
+        Sum the channels of a datatype over windows of channels
+        
+        dt = datatype, such as 'Ref Dat'
+        windows = dictionary of name to [low, high] channels, high excluded
+        key = array to integrate. Its uncertainty is <key> Uncert.
+        
+        Returns a dictionary of name to (sum, uncertainty)
+        """
+        
+        integrator = windowIntegrator(self.data[dt][key], self.data[dt][key + " Uncert"])
+        return integrator.windows(windows)
+    
     
     def scale2ref(self):
         """
@@ -473,107 +1108,88 @@ class ndpData():
         return
     
     
-    def bin_channels(self, bin_size=21):
+    def bin_channels(self, bin_size=21, edges=None):
         """
         Bin channels from ndp.detector
+        
+        bin_size = number of channels in each bin
+        edges = channel edges of bins of any width, used in place of bin_size. 
+                ndp.binning makes edges for equal depth or logarithmic bins.
         """
 
         num_channels = self.instrument["Num Channels"]
-        num_bins = int(num_channels/bin_size)+1
+        if edges is None:
+            # Fixed width bins keep an empty bin at the end
+            edges = fixed_edges(num_channels, bin_size)
+            pad = np.zeros(1)
+        else:
+            edges = check_edges(edges, num_channels)
+            pad = np.zeros(0)
+        num_bins = len(edges) - 1
+        groups = bin_groups(edges)
                 
-        self.detector["Channels Binned"] = np.arange(num_bins)
-        self.detector["Energy Binned"] = np.zeros(num_bins)
-        self.detector["Depth Binned"] = np.zeros(num_bins)
-        self.data["Sam Dat"]["Counts Binned"] = np.zeros(num_bins)
-        self.data["Sam Dat"]["Atoms/cm2 Binned"] = np.zeros(num_bins)
-        self.data["Sam Dat"]["Atoms/cm2 Binned Uncert"] = np.zeros(num_bins)
-        self.data["Sam Dat"]["Atoms/cm3 Binned"] = np.zeros(num_bins)
-        self.data["Sam Dat"]["Atoms/cm3 Binned Uncert"] = np.zeros(num_bins)
-    
-        uncert2_1 = np.power(self.data["Sam Dat"]["Atoms/cm2 Uncert"],2)
-        uncert2_2 = np.power(self.data["Sam Dat"]["Atoms/cm3 Uncert"],2)
-    
-        for bin in range(num_bins-1):
-            lo = bin*bin_size
-            hi = (bin+1)*bin_size
-            if hi > num_channels:
-                hi = num_channels
-                bin_size = hi - lo
-            self.detector["Energy Binned"][bin] = np.median(self.detector["Energy"][lo:hi])
-            self.detector["Depth Binned"][bin] = np.median(self.detector["Corr Depth"][lo:hi])
-            self.data["Sam Dat"]["Counts Binned"][bin] = np.average(self.data["Sam Dat"]["Counts"][lo:hi])
-            self.data["Sam Dat"]["Atoms/cm2 Binned"][bin] = \
-                np.average(self.data["Sam Dat"]["Atoms/cm2"][lo:hi])
-            self.data["Sam Dat"]["Atoms/cm2 Binned Uncert"][bin] = \
-                math.sqrt(np.sum(uncert2_1[lo:hi]))/bin_size
-            self.data["Sam Dat"]["Atoms/cm3 Binned"][bin] = \
-                np.average(self.data["Sam Dat"]["Atoms/cm3"][lo:hi])
-            self.data["Sam Dat"]["Atoms/cm3 Binned Uncert"][bin] = \
-                math.sqrt(np.sum(uncert2_2[lo:hi]))/bin_size
+        self.detector["Channels Binned"] = np.arange(num_bins + pad.size)
+        self.detector["Bin Edges"] = edges
+        
+        columns = [
+            (self.detector, "Energy", "Energy Binned", 'median'),
+            (self.detector, "Corr Depth", "Depth Binned", 'median'),
+            (self.data["Sam Dat"], "Counts", "Counts Binned", 'mean'),
+            (self.data["Sam Dat"], "Atoms/cm2", "Atoms/cm2 Binned", 'mean'),
+            (self.data["Sam Dat"], "Atoms/cm2 Uncert", "Atoms/cm2 Binned Uncert", 'quadrature'),
+            (self.data["Sam Dat"], "Atoms/cm3", "Atoms/cm3 Binned", 'mean'),
+            (self.data["Sam Dat"], "Atoms/cm3 Uncert", "Atoms/cm3 Binned Uncert", 'quadrature'),
+            ]
+    
+        old_settings = np.seterr(all='ignore')  #seterr to known value
+        for source, key, binned_key, how in columns:
+            if key in source:
+                binned = bin_reduce(source[key], groups, num_bins, how)
+                pads = np.broadcast_to(pad, binned.shape[:-1] + pad.shape)
+                source[binned_key] = np.concatenate((binned, pads), axis=-1)
+        np.seterr(**old_settings)
             
         return
     
+    def set_bins(self, bins):
+        """
+        Bin channels as set by schema['Bin']. The bins are one of
+        
+        integer = number of channels in each bin
+        list = channel edges of each bin
+        {'Depth': width} = bins of equal width in Corr Depth (nm)
+        {'Log': number} = number of bins with logarithmically growing widths
+        """
+        
+        num_channels = self.instrument["Num Channels"]
+        if isinstance(bins, dict):
+            if 'Depth' in bins:
+                self.bin_channels(edges=depth_edges(self.detector["Corr Depth"], bins['Depth']))
+            elif 'Log' in bins:
+                self.bin_channels(edges=log_edges(num_channels, int(bins['Log'])))
+            else:
+                raise ValueError('Bin must have a Depth or Log key')
+        elif isinstance(bins, list):
+            self.bin_channels(edges=bins)
+        else:
+            self.bin_channels(int(bins))
+        
+        return
+    
     
 
  
-    def saveAtoms(self, path, filename, data_cols):
-        """
-        Write six column CSV for atoms/cm2 and atoms/cm3
-        """
-        
-        num_cols = len(data_cols)
-        len_cols = self.detector['Channels Binned'].size
-    
-        i=0
-        columns = np.zeros((num_cols, len_cols))
-        
-        for dkey in data_cols:
-            if dkey == 'Channels':
-                columns[i][:] = self.detector['Channels Binned']
-            if dkey == 'Energy':
-                columns[i][:] = self.detector['Energy Binned']
-            if dkey == 'Depth':
-                columns[i][:] = self.detector['Depth Binned']
-            if dkey == 'Counts':
-                columns[i][:] = self.data['Sam Dat']['Counts Binned']
-            if dkey == 'Atoms/cm2':
-                columns[i][:] = self.data['Sam Dat']['Atoms/cm2 Binned']
-            if dkey == 'Atoms/cm2 Uncert':
-                columns[i][:] = self.data['Sam Dat']['Atoms/cm2 Binned Uncert']
-            if dkey == 'Atoms/cm3':
-                columns[i][:] = self.data['Sam Dat']['Atoms/cm3 Binned']
-            if dkey == 'Atoms/cm3 Uncert':
-                columns[i][:] = self.data['Sam Dat']['Atoms/cm3 Binned Uncert']
-            i += 1
-        
-        
-        header = [['NIST Neutron Depth Profiling Data File'],
-                  ['Sample Data Files'],
-                  [self.data['Sam Dat']["Files"]],
-                  ['Sample Monitor Files'],
-                  [self.data['Sam Mon']["Files"]],
-                  ['Background Data Files'],
-                  [self.data['Bgd Dat']["Files"]],
-                  ['Background Monitor Files'],
-                  [self.data['Bgd Mon']["Files"]],
-                  ['Reference Data Files'],
-                  [self.data['Ref Dat']["Files"]],
-                  ['Reference Monitor Files'],
-                  [self.data['Ref Mon']["Files"]],
-                  ['Sample Data Operations'],
-                  [self.data['Sam Dat']['Operations']],
-                  [self.data['Sam Dat']["Datetime"]],
-                  [' '],
-                  data_cols
-                  ]
-        
-        numlines = len(self.detector['Channels Binned'])
-    
-        with open((path+filename), 'w', newline='') as csvfile:
-            #using excel comma separated value format
-            writer = csv.writer(csvfile, dialect = 'excel')
-            for x in range(len(header)):
-                writer.writerow(header[x]) 
-            writer.writerows(np.transpose(columns)) 
+    def saveAtoms(self, path, filename, data_cols, fmt='csv'):
+        """
+        Write the binned data columns and the files and operations of the
+        reduction
+        
+        data_cols = column names, such as 'Depth', 'Atoms/cm2' or 'Atoms/cm3 Uncert'
+        fmt = output format from ndp.writers.WRITERS: 'csv', 'fastcsv', 'npz',
+              'hdf5' or 'parquet'. The binary formats also hold the per channel
+              columns and the schema.
+        """
+        
+        write_profile(self, path+filename, data_cols, fmt)
             
         return
@@ -8,6 +8,8 @@ Created on Mon Aug  1 13:48:13 2022
 import json
 import os
 
+from ndp.compressed import listdir
+
 class schema():
     """
     Class that defines a data object for neutron depth profiling (NDP) data analysis.
@@ -23,6 +25,7 @@ class schema():
         'Operations' : ['Load', 'Bin', 'Save'],
         'Eval' : {
             'Type': 'TRIM',
+            'Model': 'Poly',
             },            
         'Load' : ['Sam Dat'],
         'Norm' : [],
@@ -42,9 +45,12 @@ class schema():
         'Save' : {
             'Columns' : ['Channels', 'Counts'],
             'Path' : '',
-            'Filename' : 'ndp_default.csv'
+            'Filename' : 'ndp_default.csv',
+            'Format' : 'csv'
         },
         'TRIM' : [],
+        'Checkpoints' : [],
+        'Time Resolved' : False,
         'Sam Dat' : {
             'Path' : '',
             'Files' : ''
@@ -95,17 +101,23 @@ class schema():
         with open(schemafile, 'w') as f:
             json.dump(self.schema, f, indent=4)
             
-    def get_filelist(self, path, tag):
+    def get_filelist(self, path, tag, **query):
         """
         Generate a list of filenames in path that contain (tag) in the name
 
         Parameters
         ----------
         path : string
-            Path to the directory containing the files
+            Path to the directory containing the files. The path may lead
+            into a zip archive, such as 'runs/2019.zip/'.
         tag : string
             Text common to all filenames of interest. Use a null string if all 
             files in a directory are desired.
+        query : 
+            Header conditions of ndp.catalog.spectrumCatalog.query, such as
+            detector='Lynx 1', start=datetime(2019, 7, 1) or min_live=600.
+            With any condition, the files are selected from the header catalog
+            of the directory and returned in sorted order.
 
         Returns
         -------
@@ -113,8 +125,24 @@ class schema():
 
         """
         
-        dirlist = os.listdir(path)
+        if query:
+            # Imported here so that importing ndp stays fast
+            from ndp.catalog import get_catalog
+            return get_catalog(path).query(tag=tag, **query)
+        
+        dirlist = listdir(path)
         return [x for x in dirlist if tag in x]
+    
+    def set_files(self, dt, path, tag='', **query):
+        """
+        Fill the Path and Files of a datatype (Sam Dat, Sam Mon, etc) with the
+        files of get_filelist
+        """
+        
+        self.schema[dt] = {
+            'Path' : path,
+            'Files' : self.get_filelist(path, tag, **query)
+        }
 
     
     def add_TRIMlayer(self, path, tag):
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Readers for NDP spectrum files
+
+A spectrum file has an 8 line text header followed by one line per channel.
+The second column of each channel line holds the counts in that channel.
+"""
+
+import io
+import numpy as np
+
+from ndp.compressed import open_file
+
+
+HEADER_LINES = 8
+
+
+def read_spectrum(filename, numchannels):
+    """
+    Read the header and channel counts of a single NDP spectrum file
+
+    The header is decoded once and the block of channel lines is handed to
+    NumPy in a single parse. Files that do not have a regular channel block
+    are read with the line by line parser instead.
+
+    Parameters
+    ----------
+    filename : string
+        Full path to the spectrum file, which may be compressed or a member
+        of a zip archive, see ndp.compressed
+    numchannels : int
+        Number of channel lines to read after the header
+
+    Returns
+    -------
+    Dictionary with keys <Detector>, <Label>, <Datetime>, <Live Time>,
+    <Real Time> and <Counts>. <Datetime> is the unparsed header text.
+
+    """
+
+    with open_file(filename) as f:
+        header = [f.readline() for i in range(HEADER_LINES)]
+        body = f.read()
+
+    spectrum = parse_header(header)
+    counts = parse_counts(body, numchannels)
+    if counts is None:
+        counts = parse_counts_loop(body, numchannels)
+    spectrum["Counts"] = counts
+
+    return spectrum
+
+
+def parse_header(header):
+    """
+    Decode the fields of the 8 line spectrum header used by ndpData.loadfiles
+    """
+
+    return {
+        "Detector": header[0][12:-1],
+        "Label": header[1][8:-1],
+        "Datetime": header[2][12:-10],
+        "Live Time": float(header[3][12:-1]),
+        "Real Time": float(header[4][12:-1]),
+    }
+
+
+def parse_counts(body, numchannels):
+    """
+    Parse the channel block in one pass
+
+    Returns
+    -------
+    1-D numpy array of counts, or None if the block is not a regular table
+    with the same number of columns on each of the numchannels lines.
+
+    """
+
+    rows = body.split('\n', numchannels)
+    if len(rows) < numchannels:
+        return None
+    rows = rows[:numchannels]
+
+    numcols = len(rows[0].split())
+    if numcols < 2:
+        return None
+
+    # A NUL token between rows marks where each row ends, so a single split
+    # of the whole block can be checked for a constant number of columns
+    tokens = ' \x00 '.join(rows).split()
+    if len(tokens) != (numcols+1)*numchannels - 1:
+        return None
+    if tokens[numcols::numcols+1].count('\x00') != numchannels - 1:
+        return None
+
+    try:
+        return np.array(tokens[1::numcols+1], dtype=np.float64)
+    except ValueError:
+        return None
+
+
+def parse_counts_loop(body, numchannels):
+    """
+    Parse the channel block one line at a time, the fallback for malformed files
+    """
+
+    lines = io.StringIO(body).readlines()
+    counts = np.zeros(numchannels)
+    for channel in range(numchannels):
+        values = lines[channel].split()
+        counts[channel] = float(values[1])
+
+    return counts
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only store of many reduced depth profiles
+
+A store is a directory holding one flat binary file of float64 values for
+each Save column, binned ('binned/<column>.f8') and per channel
+('channels/<column>.f8'), and an index of the samples ('index.jsonl'). The
+columns of each new sample are appended to the end of the column files, and
+its metadata (the provenance of ndp.writers, with the name, tags and the
+offset and length of its columns) is appended to the index as one line of
+JSON. Samples can have different numbers of bins.
+
+Column files are read through numpy.memmap, so one sample can be read
+without loading the others, and queries over every sample (such as the
+depth of the largest concentration of each) run on the mapped files and
+only page in what they touch.
+
+The index is written after the columns. A sample whose append was
+interrupted is not in the index, and its values are overwritten by the next
+append. A store has a single writer at a time.
+"""
+
+import json
+import os
+import numpy as np
+
+from ndp.writers import SAVE_COLUMNS, get_columns, provenance, column_name
+
+
+INDEX_FILE = 'index.jsonl'
+
+# Number of values read at a time by the queries over every sample
+BLOCK_VALUES = 1 << 22
+
+# Groups of columns, and whether the columns of each are binned
+GROUPS = {
+    'binned' : True,
+    'channels' : False,
+}
+
+
+class resultsStore():
+    """
+    Columnar store of reduced profiles, see the module description.
+
+    directory = directory of the store, created if needed
+    """
+
+    def __init__(self, directory):
+
+        self.directory = os.fspath(directory)
+        for group in GROUPS:
+            os.makedirs(os.path.join(self.directory, group), exist_ok=True)
+        self.index = self.read_index()
+        self.maps = {}
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def read_index(self):
+        """
+        Read the metadata of every sample from the index file
+        """
+
+        index = []
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                for line in f:
+                    if line.strip():
+                        index.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return index
+
+
+    def column_file(self, name, group='binned'):
+        return os.path.join(self.directory, group, column_name(name) + '.f8')
+
+
+    def columns(self):
+        """
+        Names of the columns held by any sample
+        """
+
+        names = []
+        for entry in self.index:
+            for name in entry['Columns']:
+                if name not in names:
+                    names.append(name)
+        return names
+
+
+    def append(self, ndp, name=None, tags=None, columns=None):
+        """
+        Add a reduced sample to the store
+
+        Parameters
+        ----------
+        ndp : ndpData
+            Reduced data, after the Bin stage
+        name : string
+            Name of the sample, by default the Save filename of its schema
+        tags : dictionary
+            Values to select samples by, such as {'Batch': 'X'}
+        columns : list of strings
+            Names from SAVE_COLUMNS to store, by default all of them
+
+        Returns
+        -------
+        Number of the new sample
+
+        """
+
+        columns = list(SAVE_COLUMNS) if columns is None else [c for c in columns if c in SAVE_COLUMNS]
+        schema = getattr(ndp, 'schema', {})
+        if name is None:
+            name = os.path.splitext(schema.get('Save', {}).get('Filename', ''))[0] or 'sample_%d' % len(self)
+
+        entry = provenance(ndp)
+        entry['Name'] = name
+        entry['Tags'] = tags or {}
+        entry['Columns'] = columns
+        # Columns of earlier samples that this one lacks are written as
+        # zeros, so every column file covers every sample
+        names = columns + [c for c in self.columns() if c not in columns]
+        for group, binned in GROUPS.items():
+            values = get_columns(ndp, names, binned)
+            key = group.capitalize()
+            entry[key + ' Length'] = values.shape[1]
+            entry[key + ' Offset'] = self.total(group)
+            for i, column in enumerate(names):
+                self.write_column(column, group, values[i], entry[key + ' Offset'])
+
+        with open(os.path.join(self.directory, INDEX_FILE), 'a') as f:
+            f.write(json.dumps(entry, default=str) + '\n')
+        self.index.append(entry)
+        self.maps = {}
+
+        return len(self) - 1
+
+
+    def total(self, group):
+        """
+        Number of values of each column of a group over all samples
+        """
+
+        key = group.capitalize()
+        if not self.index:
+            return 0
+        last = self.index[-1]
+        return last[key + ' Offset'] + last[key + ' Length']
+
+
+    def write_column(self, name, group, values, offset):
+        """
+        Write the values of one sample at offset (in values) of a column
+        file. Earlier samples of a new column file are filled with zeros.
+        """
+
+        filename = self.column_file(name, group)
+        mode = 'r+b' if os.path.exists(filename) else 'wb'
+        with open(filename, mode) as f:
+            f.truncate(offset * 8)
+            f.seek(offset * 8)
+            f.write(np.ascontiguousarray(values, dtype='<f8').tobytes())
+        return
+
+
+    def column(self, name, binned=True):
+        """
+        Values of a column over all samples, as a read-only memory map.
+        The values of sample i are column[offsets[i]:offsets[i]+lengths[i]],
+        see segments. Samples stored without the column hold zeros.
+        """
+
+        group = 'binned' if binned else 'channels'
+        if (name, group) not in self.maps:
+            if name not in self.columns():
+                raise KeyError('No column ' + name + ' in the store')
+            filename = self.column_file(name, group)
+            self.maps[(name, group)] = np.memmap(filename, dtype='<f8', mode='r',
+                                                 shape=(self.total(group),))
+        return self.maps[(name, group)]
+
+
+    def segments(self, binned=True):
+        """
+        (offsets, lengths) arrays of the values of each sample in the columns
+        """
+
+        key = 'Binned' if binned else 'Channels'
+        offsets = np.array([entry[key + ' Offset'] for entry in self.index], dtype=np.int64)
+        lengths = np.array([entry[key + ' Length'] for entry in self.index], dtype=np.int64)
+        return offsets, lengths
+
+
+    def blocks(self, binned=True):
+        """
+        Split the samples into blocks of about BLOCK_VALUES values
+
+        Yields
+        ------
+        (first, last, start, offsets, lengths) for samples first to last-1,
+        where start is the offset of the block in the columns and offsets
+        are relative to it
+        """
+
+        offsets, lengths = self.segments(binned)
+        first = 0
+        while first < len(offsets):
+            last = np.searchsorted(offsets, offsets[first] + BLOCK_VALUES, side='right')
+            last = max(last, first + 1)
+            yield first, last, offsets[first], offsets[first:last] - offsets[first], lengths[first:last]
+            first = last
+        return
+
+
+    def sample(self, i, binned=True):
+        """
+        Columns of sample i, as views of the memory maps
+
+        Returns
+        -------
+        (columns, metadata) with columns a dictionary of column name to values
+        """
+
+        entry = self.index[i]
+        key = 'Binned' if binned else 'Channels'
+        lo = entry[key + ' Offset']
+        hi = lo + entry[key + ' Length']
+        columns = {name: self.column(name, binned)[lo:hi] for name in entry['Columns']}
+        return columns, entry
+
+
+    def select(self, **conditions):
+        """
+        Numbers of the samples whose Tags, or whose metadata such as Name or
+        Datetime, match every condition. A value must be equal to the
+        condition or, if the condition is callable, make it return True.
+
+        Returns
+        -------
+        Array of sample numbers
+        """
+
+        selected = []
+        for i, entry in enumerate(self.index):
+            for key, condition in conditions.items():
+                value = entry['Tags'].get(key, entry.get(key))
+                if callable(condition):
+                    if not condition(value):
+                        break
+                elif value != condition:
+                    break
+            else:
+                selected.append(i)
+        return np.array(selected, dtype=np.int64)
+
+
+    def reduce(self, name, ufunc=np.fmax, binned=True):
+        """
+        Reduce the values of a column of each sample with a NumPy ufunc, such
+        as np.fmax for the largest value (ignoring NaN) or np.add for the sum.
+        The column is read one block of samples at a time.
+
+        Returns
+        -------
+        Array with one value per sample, NaN for samples without values
+        """
+
+        values = self.column(name, binned)
+        result = np.full(len(self), np.nan)
+        for first, last, start, offsets, lengths in self.blocks(binned):
+            block = np.asarray(values[start:start + offsets[-1] + lengths[-1]])
+            result[first:last] = segment_reduce(block, offsets, lengths, ufunc, np.nan)
+        return result
+
+
+    def argmax(self, name, binned=True):
+        """
+        Position within each sample of the largest finite value of a column,
+        or -1 for samples without finite values
+        """
+
+        values = self.column(name, binned)
+        positions = np.full(len(self), -1, dtype=np.int64)
+        for first, last, start, offsets, lengths in self.blocks(binned):
+            block = np.asarray(values[start:start + offsets[-1] + lengths[-1]])
+            block = np.where(np.isfinite(block), block, -np.inf)
+            maxes = segment_reduce(block, offsets, lengths, np.maximum, -np.inf)
+            hits = np.flatnonzero(block == np.repeat(maxes, lengths))
+            found = np.isfinite(maxes)
+            # First value equal to the largest one of each sample
+            hit = np.searchsorted(hits, offsets[found])
+            positions[first:last][found] = hits[hit] - offsets[found]
+        return positions
+
+
+    def peak_depth(self, name='Atoms/cm3', depth='Depth', binned=True):
+        """
+        Depth of the largest finite value of a column in each sample, NaN for
+        samples without one
+
+        For example, the samples of batch X with a peak deeper than 500 nm are
+        np.intersect1d(store.select(Batch='X'), np.flatnonzero(store.peak_depth() > 500))
+        """
+
+        offsets, lengths = self.segments(binned)
+        positions = self.argmax(name, binned)
+        result = np.full(len(self), np.nan)
+        found = positions >= 0
+        result[found] = self.column(depth, binned)[offsets[found] + positions[found]]
+        return result
+
+
+def segment_reduce(values, offsets, lengths, ufunc, fill):
+    """
+    Reduce each segment values[offsets[i]:offsets[i]+lengths[i]] of
+    contiguous segments with ufunc, giving fill for empty segments
+    """
+
+    result = np.full(len(offsets), fill)
+    full = lengths > 0
+    if np.any(full):
+        result[full] = ufunc.reduceat(values, offsets[full])
+    return result
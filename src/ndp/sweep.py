@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Depth calibration of the detector, and sweeps over calibration parameters
+
+depth_scale turns the energy calibration (Calib Coeffs), Zero Channel and
+TRIM coefficients into the Energy, Depth, Corr Depth and Del Depth of each
+channel. Every parameter may be an array with one value per variant (a
+leading axis), so many calibrations are evaluated at once by broadcasting.
+ndpData.chan2depth is depth_scale for one variant.
+
+calibrationSweep applies the variants to a reduced sample. Atoms/cm2 does
+not depend on the calibration, so only Atoms/cm3, its uncertainty and the
+binned columns are evaluated again, in chunks of variants that keep the
+temporary arrays to about CHUNK_VALUES values.
+"""
+
+import numpy as np
+
+from ndp.binning import bin_groups, bin_reduce
+from ndp.depthmodel import depth_function
+
+
+# Largest number of values in each temporary array of a sweep
+CHUNK_VALUES = 1 << 23
+
+# Relative uncertainty of Del Depth
+DEL_DEPTH_UNCERT = 0.05
+
+
+def del_depth(corr_depth):
+    """
+    Width in cm of each channel along the last axis of corr_depth (nm), the
+    difference from the previous channel. Channel 0 has no previous channel
+    and takes the width of channel 1. The last channel is left at 0, as
+    ndpData has always done.
+    """
+
+    corr_depth = np.asarray(corr_depth)
+    width = np.zeros(corr_depth.shape)
+    width[..., 1:-1] = 1e-7*(corr_depth[..., :-2] - corr_depth[..., 1:-1])
+    width[..., :1] = 1e-7*(corr_depth[..., :1] - corr_depth[..., 1:2])
+    return width
+
+
+def depth_scale(channels, calib_coeffs, zero_channel, trim_coeffs, depth=None):
+    """
+    Depth scale of the detector
+
+    Parameters
+    ----------
+    channels : 1-D array
+        Channel numbers
+    calib_coeffs : array (..., 2)
+        Slope and offset of the energy (keV) of each channel
+    zero_channel : int or integer array (...)
+        Channel of the surface of the sample
+    trim_coeffs : array (..., 3)
+        Coefficients of the TRIM depth (nm) polynomial in energy, highest
+        power first, as from ndpData.fit_TRIM
+    depth : function
+        Depth (nm) of an array of energies, used in place of the polynomial,
+        such as a lookup table of ndp.depthmodel
+
+    The leading axes of the parameters are broadcast against each other.
+
+    Returns
+    -------
+    Dictionary of Energy, Depth, Corr Depth, Del Depth and Del Depth Uncert,
+    each of shape (..., channels)
+
+    """
+
+    calib_coeffs = np.asarray(calib_coeffs, dtype=np.float64)
+    trim_coeffs = np.asarray(trim_coeffs, dtype=np.float64)
+    zero_channel = np.asarray(zero_channel, dtype=np.int64)
+
+    m = calib_coeffs[..., 0, None]
+    b = calib_coeffs[..., 1, None]
+    energy = (m*channels) + b
+
+    if depth is None:
+        a, b, c = [trim_coeffs[..., i, None] for i in range(3)]
+        depth = a*np.power(energy, 2) + b*energy + c
+    else:
+        depth = depth(energy)
+
+    shape = np.broadcast_shapes(depth.shape[:-1], zero_channel.shape) + depth.shape[-1:]
+    if depth.shape != shape:
+        depth = np.broadcast_to(depth, shape).copy()
+    if energy.shape != shape:
+        energy = np.broadcast_to(energy, shape).copy()
+    zero = np.broadcast_to(zero_channel, shape[:-1])[..., None]
+    corr_depth = depth - np.take_along_axis(depth, zero, axis=-1)
+
+    width = del_depth(corr_depth)
+
+    scale = {
+        'Energy' : energy,
+        'Depth' : depth,
+        'Corr Depth' : corr_depth,
+        'Del Depth' : width,
+        'Del Depth Uncert' : DEL_DEPTH_UNCERT * width,
+        }
+    return scale
+
+
+def fit_trims(energy, thick):
+    """
+    Fit the TRIM depth polynomial of ndpData.fit_TRIM to many sets of layer
+    energies and thicknesses at once
+
+    Parameters
+    ----------
+    energy, thick : arrays (..., layers)
+        Escape energy and depth of each sub-layer, for example the values of
+        ndp.TRIM with shifted energies
+
+    Returns
+    -------
+    (..., 3) array of coefficients, highest power first
+
+    """
+
+    energy = np.asarray(energy, dtype=np.float64)
+    thick = np.asarray(thick, dtype=np.float64)
+    energy, thick = np.broadcast_arrays(energy, thick)
+
+    # Scaling the energy keeps the normal equations well conditioned
+    scale = np.max(np.abs(energy), axis=-1, keepdims=True)
+    x = energy / scale
+    vander = np.stack((x*x, x, np.ones_like(x)), axis=-1)
+    coeffs = np.linalg.pinv(vander) @ thick[..., None]
+    coeffs = coeffs[..., 0]
+    coeffs[..., 0] /= scale[..., 0]**2
+    coeffs[..., 1] /= scale[..., 0]
+    return coeffs
+
+
+class calibrationSweep():
+    """
+    Atoms/cm3 profiles of a reduced sample for many depth calibrations
+
+    ndp = ndpData after the Absolute stage, and after binning for binned
+          results. The bins of ndp are kept for every variant.
+    """
+
+    def __init__(self, ndp):
+
+        self.ndp = ndp
+        self.channels = np.asarray(ndp.detector['Channels'])
+        self.atoms = np.asarray(ndp.data['Sam Dat']['Atoms/cm2'])
+        self.atoms_uncert = np.asarray(ndp.data['Sam Dat']['Atoms/cm2 Uncert'])
+        with np.errstate(all='ignore'):
+            self.atoms_ratio = np.nan_to_num(np.power(self.atoms_uncert/self.atoms, 2))
+
+
+    def variants(self, calib_coeffs=None, zero_channel=None, trim_coeffs=None):
+        """
+        Broadcast the parameters of the variants against each other, filling
+        the ones not given with the values of the sample
+
+        Returns
+        -------
+        (calib_coeffs, zero_channel, trim_coeffs) with shapes (n, 2), (n,) and (n, 3)
+        """
+
+        instrument = self.ndp.instrument
+        if calib_coeffs is None:
+            calib_coeffs = instrument['Calib Coeffs']
+        if zero_channel is None:
+            zero_channel = instrument['Zero Channel']
+        if trim_coeffs is None:
+            trim_coeffs = self.ndp.TRIM['Coeffs']
+
+        calib_coeffs = np.asarray(calib_coeffs, dtype=np.float64).reshape(-1, 2)
+        trim_coeffs = np.asarray(trim_coeffs, dtype=np.float64).reshape(-1, 3)
+        zero_channel = np.asarray(zero_channel, dtype=np.int64).reshape(-1)
+        num = np.broadcast_shapes(calib_coeffs.shape[:1], zero_channel.shape, trim_coeffs.shape[:1])[0]
+        return (np.broadcast_to(calib_coeffs, (num, 2)),
+                np.broadcast_to(zero_channel, (num,)),
+                np.broadcast_to(trim_coeffs, (num, 3)))
+
+
+    def profiles(self, scale):
+        """
+        Atoms/cm3 and its uncertainty for a chunk of depth scales, as
+        ndpData.scale2ref computes them
+        """
+
+        width = scale['Del Depth']
+        # Variants lead, the files of a time resolved sample follow
+        width = width.reshape(width.shape[:1] + (1,)*(self.atoms.ndim-1) + width.shape[1:])
+        width_uncert = DEL_DEPTH_UNCERT * width
+        with np.errstate(all='ignore'):
+            atoms = np.nan_to_num(self.atoms/width)
+            ratio = np.nan_to_num(np.power(width_uncert/width, 2))
+            uncert = atoms*np.sqrt(self.atoms_ratio + ratio)
+        return atoms, uncert
+
+
+    def run(self, calib_coeffs=None, zero_channel=None, trim_coeffs=None,
+            keys=('Depth Binned', 'Atoms/cm3 Binned', 'Atoms/cm3 Binned Uncert')):
+        """
+        Evaluate the variants
+
+        Parameters
+        ----------
+        calib_coeffs : array (n, 2)
+            Energy calibration of each variant
+        zero_channel : integer array (n,)
+            Zero Channel of each variant
+        trim_coeffs : array (n, 3)
+            TRIM polynomial coefficients of each variant. Without them the
+            depth model of the sample is used.
+        keys : list of strings
+            Results to keep. Channel results are Energy, Corr Depth, Del Depth,
+            Atoms/cm3 and Atoms/cm3 Uncert, binned results are Depth Binned,
+            Atoms/cm3 Binned and Atoms/cm3 Binned Uncert.
+
+        Parameters that are not given take the value of the sample, and a
+        single value is used for every variant.
+
+        Returns
+        -------
+        Dictionary of key to an array with a leading axis of variants
+
+        """
+
+        # Without TRIM variants, the depth model of the sample is kept
+        depth = None if trim_coeffs is not None else depth_function(self.ndp.TRIM)
+        calib_coeffs, zero_channel, trim_coeffs = self.variants(calib_coeffs, zero_channel, trim_coeffs)
+        num = len(zero_channel)
+        binned = any(key.endswith('Binned') or key.endswith('Binned Uncert') for key in keys)
+        if binned:
+            edges = np.asarray(self.ndp.detector['Bin Edges'])
+            num_bins = len(edges) - 1
+            pad = len(self.ndp.detector['Channels Binned']) - num_bins
+            groups = bin_groups(edges)
+
+        chunk = max(int(CHUNK_VALUES // max(self.atoms.size, 1)), 1)
+        results = {}
+        for start in range(0, num, chunk):
+            stop = min(start + chunk, num)
+            scale = depth_scale(self.channels, calib_coeffs[start:stop],
+                                zero_channel[start:stop], trim_coeffs[start:stop], depth)
+            chunk_results = dict(scale)
+            if any('Atoms' in key for key in keys):
+                chunk_results['Atoms/cm3'], chunk_results['Atoms/cm3 Uncert'] = self.profiles(scale)
+            if binned:
+                with np.errstate(all='ignore'):
+                    for key, binned_key, how in (('Corr Depth', 'Depth Binned', 'median'),
+                                                 ('Atoms/cm3', 'Atoms/cm3 Binned', 'mean'),
+                                                 ('Atoms/cm3 Uncert', 'Atoms/cm3 Binned Uncert', 'quadrature')):
+                        if binned_key in keys:
+                            values = bin_reduce(chunk_results[key], groups, num_bins, how)
+                            pads = np.zeros(values.shape[:-1] + (pad,))
+                            chunk_results[binned_key] = np.concatenate((values, pads), axis=-1)
+
+            for key in keys:
+                value = chunk_results[key]
+                if key not in results:
+                    results[key] = np.zeros((num,) + value.shape[1:])
+                results[key][start:stop] = value
+
+        return results
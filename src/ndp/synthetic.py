@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic NDP inputs for tests and benchmarks
+
+The files are written in the formats read by ndpData.loadfiles and
+ndpData.evalTRIM: spectrum files with an 8 line header followed by one
+'channel counts' line per channel, TRIM files with a 12 line header
+followed by one record per ion, and list-mode files of binary events.
+"""
+
+import copy
+import json
+import os
+from datetime import datetime
+import numpy as np
+
+from ndp.schema import schema as ndpSchema
+from ndp.listmode import EVENT_DTYPE
+
+
+DATASETS = ['Sam Dat', 'Sam Mon', 'Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon']
+
+# Depth (nm) of the layers of the synthetic TRIM stack
+TRIM_THICKNESS = [10, 50, 100, 200, 400, 800, 1600, 3200]
+
+# Last channel used by the monitor peak and reference windows of ndpData
+MIN_CHANNELS = 2902
+
+
+def write_spectrum(filename, counts, live=100.0, real=110.0, label='sample',
+                   start=datetime(2019, 7, 18, 10, 15)):
+    """
+    Write a spectrum file in the format read by ndpData.loadfiles
+
+    Parameters
+    ----------
+    filename : string
+        File to write
+    counts : 1-D array
+        Counts of each channel, written as integers
+    live, real : float
+        Live and real time in seconds
+    label : string
+        Sample label
+    start : datetime
+        Start time of the measurement
+
+    """
+
+    counts = np.asarray(counts)
+    header = ('Detector:   Lynx 1\n'
+              'Label:  ' + label + '\n'
+              'Start Time: ' + start.strftime('%a %b %d %H:%M:%S') + ' EDT ' + start.strftime('%Y') + '\n'
+              'Live Time:  ' + repr(float(live)) + '\n'
+              'Real Time:  ' + repr(float(real)) + '\n'
+              'Channels:   ' + str(len(counts)) + '\n'
+              'Units:      counts\n'
+              'Channel Counts\n')
+    rows = np.column_stack((np.arange(len(counts)), counts)).astype(np.int64)
+    with open(filename, 'w') as f:
+        f.write(header)
+        f.write(('%d %d\n'*len(counts)) % tuple(rows.ravel().tolist()))
+    return
+
+
+def write_trim(filename, material, energy, depth):
+    """
+    Write a TRIM output file with ion energies in eV and depths in Angstrom
+    """
+
+    energy = np.rint(np.asarray(energy)/100).astype(np.int64)
+    depth = np.asarray(depth).astype(np.int64)
+    rows = np.column_stack((np.arange(1, len(energy)+1), energy, depth))
+    with open(filename, 'w') as f:
+        for i in range(9):
+            f.write(' TRIM header line %d\n' % i)
+        f.write(' Layer 1 : =>' + material + ' (TRIM)\n')
+        f.write(' Event  Atom  Energy  Depth\n')
+        f.write(' Name   Numb   (eV)    X(A)\n')
+        f.write(('T%6d  2 .%05dE+07 %6dE-00\n'*len(energy)) % tuple(rows.ravel().tolist()))
+    return
+
+
+def write_events(filename, times, channels):
+    """
+    Write a list-mode file of events in the format read by ndp.listmode
+
+    Parameters
+    ----------
+    filename : string
+        File to write
+    times : 1-D array
+        Timestamp of each event in clock ticks, in increasing order
+    channels : 1-D array
+        Channel of each event
+
+    """
+
+    events = np.empty(len(times), dtype=EVENT_DTYPE)
+    events['Time'] = times
+    events['Channel'] = channels
+    with open(filename, 'wb') as f:
+        f.write(events.tobytes())
+    return
+
+
+def spectrum_events(counts, duration, tick, rng):
+    """
+    Events that histogram to counts, at uniformly random times within
+    duration seconds
+
+    Returns
+    -------
+    (times, channels) sorted by time, with times in clock ticks of tick seconds
+    """
+
+    counts = np.asarray(counts).astype(np.int64)
+    channels = np.repeat(np.arange(len(counts)), counts)
+    times = rng.integers(0, int(round(duration/tick)), len(channels))
+    order = np.argsort(times, kind='stable')
+    return times[order], channels[order]
+
+
+def spectrum_shapes(channels=4096):
+    """
+    Mean counts per channel of each dataset. The sample, monitor and reference
+    share a peak at channel 2400, inside the windows used by ref_integrate.
+    """
+
+    x = np.arange(channels)
+    peak = 3000*np.exp(-0.5*((x - 2400)/60.0)**2)
+    shapes = {
+        'Sam Dat': 20 + peak,
+        'Sam Mon': 10 + peak,
+        'Bgd Dat': 15 + 0*peak,
+        'Bgd Mon': 10 + peak,
+        'Ref Dat': 20 + 2*peak,
+        'Ref Mon': 10 + peak,
+    }
+    return shapes
+
+
+def instrument(channels=4096):
+    """
+    Default instrument configuration of ndpData with channels channels
+    """
+
+    if channels < MIN_CHANNELS:
+        raise ValueError('Synthetic spectra need at least %d channels' % MIN_CHANNELS)
+    config = {
+        "Configuration" : "Synthetic",
+        "Beam Energy": 1472.35,
+        "Num Channels": channels,
+        "Zero Channel": 2077,
+        "Mon Peak Channels": [1900, 2901],
+        "Calib Coeffs": [0.7144, -12.45],
+    }
+    return config
+
+
+def make_sample(path, files=2, channels=4096, trim_files=5, trim_rows=200,
+                name='sample', seed=2):
+    """
+    Write the spectra and TRIM files of one sample and return its schema
+
+    Parameters
+    ----------
+    path : string
+        Directory to write into. Each dataset gets a subdirectory.
+    files : int
+        Number of spectrum files in each dataset
+    channels : int
+        Number of channels of each spectrum
+    trim_files : int
+        Number of TRIM files in the layer stack, at most len(TRIM_THICKNESS)
+    trim_rows : int
+        Number of ion records in each TRIM file
+    name : string
+        Prefix of the file names and of the saved output
+    seed : int
+        Seed of the random counts, energies and depths
+
+    Returns
+    -------
+    schema dictionary that evaluates, loads, normalizes, corrects, scales,
+    bins and saves the sample
+
+    """
+
+    if trim_files > len(TRIM_THICKNESS):
+        raise ValueError('At most %d TRIM files' % len(TRIM_THICKNESS))
+    path = os.path.join(str(path), '')
+    rng = np.random.default_rng(seed)
+
+    schema = copy.deepcopy(ndpSchema().schema)
+    schema['Operations'] = ['Eval', 'Load', 'Norm', 'Correct', 'Absolute', 'Bin', 'Save']
+    schema['Load'] = list(DATASETS)
+    schema['Norm'] = ['Sam', 'Ref', 'Bgd']
+    schema['Corr'] = ['Sam', 'Ref']
+    schema['Absolute']['Atom'] = 'B'
+    schema['Absolute']['Cross Sec'] = 3600.48
+    schema['Absolute']['Abundance'] = 0.196
+    schema['Absolute']['Branch Frac'] = 0.94
+    schema['Bin'] = 21
+    schema['Save']['Columns'] = ['Channels', 'Energy', 'Depth', 'Counts', 'Atoms/cm2',
+                                 'Atoms/cm2 Uncert', 'Atoms/cm3', 'Atoms/cm3 Uncert']
+    schema['Save']['Path'] = path
+    schema['Save']['Filename'] = name + '.csv'
+
+    schema.update(write_datasets(path, DATASETS, files, channels, name, rng))
+    schema['TRIM'] = write_stack(path, trim_files, trim_rows, rng)
+
+    return schema
+
+
+def write_datasets(path, datasets, files, channels, name, rng):
+    """
+    Write the spectrum files of datasets into subdirectories of path
+
+    Returns a dictionary of dataset name to its schema entry
+    """
+
+    shapes = spectrum_shapes(channels)
+    entries = {}
+    for dt in datasets:
+        dt_path = os.path.join(path, dt.replace(' ', '_'), '')
+        os.makedirs(dt_path, exist_ok=True)
+        filelist = []
+        for i in range(files):
+            filename = '%s_%s_%03d.spe' % (name, dt.replace(' ', ''), i)
+            write_spectrum(dt_path + filename, rng.poisson(shapes[dt]), live=600.0,
+                           real=610.0 + i, label=name)
+            filelist.append(filename)
+        entries[dt] = {'Path': dt_path, 'Files': filelist}
+    return entries
+
+
+def write_stack(path, trim_files, trim_rows, rng):
+    """
+    Write the TRIM files of a layer stack into path/TRIM
+
+    Returns the schema['TRIM'] list of layers
+    """
+
+    trim_path = os.path.join(path, 'TRIM', '')
+    os.makedirs(trim_path, exist_ok=True)
+    filelist = []
+    for thick in TRIM_THICKNESS[:trim_files]:
+        filename = '%d nm alpha.txt' % thick
+        energy = 1472350 - 380*thick*(1 + 0.0004*thick) + rng.normal(0, 2000, trim_rows)
+        depth = 10*thick + rng.normal(0, 5, trim_rows)
+        write_trim(trim_path + filename, 'Cr2O3', energy, depth)
+        filelist.append(filename)
+    return [{'Path': trim_path, 'Files': filelist}]
+
+
+def make_batch(path, samples=4, files=2, channels=4096, trim_files=5,
+               trim_rows=200, seed=2):
+    """
+    Write samples that share their background, reference and TRIM files
+
+    Arguments are those of make_sample. Only the sample data and monitor
+    files are written for each sample after the first. Returns a list of
+    schemas, one for each sample.
+    """
+
+    first = make_sample(path, files, channels, trim_files, trim_rows,
+                        name='sample_000', seed=seed)
+    schemas = [first]
+    for i in range(1, samples):
+        name = 'sample_%03d' % i
+        s = copy.deepcopy(first)
+        s['Save']['Filename'] = name + '.csv'
+        rng = np.random.default_rng(seed + i)
+        s.update(write_datasets(os.path.join(str(path), ''), ['Sam Dat', 'Sam Mon'],
+                                files, channels, name, rng))
+        schemas.append(s)
+    return schemas
+
+
+def save_schema(schema, filename):
+    """
+    Write a schema dictionary to a JSON file
+    """
+
+    with open(filename, 'w') as f:
+        json.dump(schema, f, indent=4)
+    return
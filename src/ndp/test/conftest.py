@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+import numpy as np
+import pytest
+from ndp.synthetic import write_spectrum, make_sample, save_schema
+
+
+@pytest.fixture
+def spectra(tmp_path):
+    '''Three random 4096 channel spectra in a temporary directory'''
+    rng = np.random.default_rng(1)
+    files = []
+    for i in range(3):
+        filename = 'spec_%03d.spe' % i
+        counts = rng.poisson(50, 4096)
+        write_spectrum(tmp_path / filename, counts, live=100.0 + i, real=110.5 + i)
+        files.append(filename)
+    return str(tmp_path) + '/', files
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    '''Keep the ndp caches out of the user cache directory'''
+    path = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('NDP_CACHE_DIR', str(path))
+    return path
+
+
+@pytest.fixture
+def sample(tmp_path):
+    '''Sample, background and reference spectra, TRIM files and a schema
+
+    Returns the path to the schema and the schema dictionary
+    '''
+    schema = make_sample(tmp_path)
+    schemafile = str(tmp_path / 'schema.json')
+    save_schema(schema, schemafile)
+    return schemafile, schema
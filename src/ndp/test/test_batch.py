@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+import copy
+import ndp
+from ndp import ndpBatch
+
+
+def test_batch_matches_runschema(sample):
+    schemafile, schema = sample
+    schemas = []
+    for i in range(3):
+        s = copy.deepcopy(schema)
+        s['Sam Dat']['Files'] = schema['Sam Dat']['Files'][i % 2:]
+        s['Save']['Filename'] = 'sample_%d.csv' % i
+        schemas.append(s)
+
+    expected = []
+    for s in schemas:
+        data = ndp.ndpData()
+        data.runschema(s)
+        with open(s['Save']['Path'] + s['Save']['Filename']) as f:
+            expected.append(f.read())
+
+    for workers in (1, 2):
+        batch = ndpBatch(workers=workers)
+        for s in schemas:
+            batch.add_schema(s)
+        results = batch.run()
+
+        # One copy each of the TRIM, background and reference products
+        assert len(batch.products) == 3
+        assert len(results) == 3
+        assert results[0].shared == ['TRIM', 'Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon']
+        for s, text in zip(schemas, expected):
+            with open(s['Save']['Path'] + s['Save']['Filename']) as f:
+                assert f.read() == text
+
+
+def test_batch_unordered_schema(sample):
+    schemafile, schema = sample
+    schema['Operations'] = ['Load', 'Eval', 'Norm', 'Correct', 'Absolute', 'Bin']
+    batch = ndpBatch()
+    batch.add_schema(schema)
+    batch.run()
+    assert batch.products == {}
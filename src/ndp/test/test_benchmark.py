@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+import json
+from ndp.benchmark import run_benchmark, STAGES
+
+
+def test_benchmark(tmp_path):
+    output = str(tmp_path / 'benchmark.json')
+    results = run_benchmark('small', repeat=1, path=str(tmp_path), output=output,
+                            files=1, channels=4200, trim_rows=50, samples=2)
+
+    with open(output) as f:
+        assert json.load(f) == results
+    assert results['Size']['channels'] == 4200
+    run = results['Runschema']
+    assert list(run['Stages']) == STAGES + ['Read']
+    assert run['Peak Memory'] > 0
+    for record in run['Stages'].values():
+        assert len(record['Time']) == 1
+    assert sum(run['Stages'][stage]['Median'] for stage in STAGES) <= run['Median']
+    assert run['Stages']['Load']['Bytes'] == run['Stages']['Read']['Bytes'] - run['Stages']['Eval']['Bytes']
+    assert results['Batch']['Samples'] == 2
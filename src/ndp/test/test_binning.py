@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+import numpy as np
+import ndp
+from ndp.binning import fixed_edges, depth_edges, log_edges, bin_groups, bin_reduce
+
+
+def test_edges():
+    assert np.array_equal(fixed_edges(10, 3), [0, 3, 6, 9])
+    assert np.array_equal(depth_edges([0.5, 1.5, 2.5, 3.5, 4.5], 2), [0, 2, 4, 5])
+
+    edges = log_edges(4096, 50)
+    assert edges[0] == 0 and edges[-1] == 4096
+    assert np.all(np.diff(edges) > 0)
+
+
+def test_bin_reduce_stack():
+    x = np.arange(20.0).reshape(2, 10)
+    edges = np.array([0, 1, 4, 10])
+    out = bin_reduce(x, bin_groups(edges), 3, 'mean')
+    assert np.array_equal(out[0], [0.0, 2.0, 6.5])
+    assert np.array_equal(out[1], [10.0, 12.0, 16.5])
+
+
+def test_bin_channels_edges():
+    data = ndp.ndpData()
+    sam = data.data['Sam Dat']
+    for key in ('Counts', 'Atoms/cm2', 'Atoms/cm2 Uncert', 'Atoms/cm3', 'Atoms/cm3 Uncert'):
+        sam[key] = np.ones(4096)
+
+    data.bin_channels(21)
+    assert sam['Counts Binned'].size == 196
+    assert sam['Counts Binned'][-1] == 0.0
+
+    data.bin_channels(edges=[0, 96, 4096])
+    assert np.array_equal(data.detector['Channels Binned'], [0, 1])
+    assert np.array_equal(sam['Counts Binned'], [1.0, 1.0])
+    assert np.allclose(sam['Atoms/cm2 Binned Uncert'], [1/np.sqrt(96), 1/np.sqrt(4000)])
+
+    data.set_bins({'Log': 40})
+    assert data.detector['Bin Edges'][-1] == 4096
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ndp
+from ndp.cache import spectrumCache
+from ndp.synthetic import write_spectrum
+
+
+def load(path, files, cache):
+    data = ndp.ndpData()
+    data.cache = cache
+    data.data['Sam Dat']['Path'] = path
+    data.data['Sam Dat']['Files'] = files
+    data.loadfiles('Sam Dat')
+    return data
+
+
+def test_cache_matches_parse(spectra, cache_dir):
+    path, files = spectra
+    plain = load(path, files, None)
+    first = load(path, files, spectrumCache())
+    assert len(first.cache.index) == 3
+    assert os.path.exists(os.path.join(first.cache.path, 'index.json'))
+
+    second = load(path, files, spectrumCache())
+    for data in (first, second):
+        for key in ('Counts', 'Live Time', 'Real Time', 'Datetime', 'Labels', 'Detector'):
+            assert np.array_equal(data.data['Sam Dat'][key], plain.data['Sam Dat'][key])
+
+
+def test_cache_invalidated_by_edit(spectra):
+    path, files = spectra
+    cache = spectrumCache()
+    load(path, files[:1], cache)
+
+    write_spectrum(path + files[0], np.ones(4096), live=1.0, real=2.0)
+    data = load(path, files[:1], cache)
+    assert data.data['Sam Dat']['Live Time'] == 1.0
+    assert np.all(data.data['Sam Dat']['Counts'] == 1.0)
+
+
+def test_strict_cache(spectra):
+    path, files = spectra
+    strict = spectrumCache(strict=True)
+    loose = spectrumCache(strict=False)
+    load(path, files[:1], strict)
+    load(path, files[:1], loose)
+
+    # A rewrite with the same size and time stamp is found by the hash only
+    st = os.stat(path + files[0])
+    with open(path + files[0], 'rb') as f:
+        text = f.read()
+    with open(path + files[0], 'wb') as f:
+        f.write(text.replace(b'Live Time:  100.0', b'Live Time:  900.0', 1))
+    os.utime(path + files[0], ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert load(path, files[:1], strict).data['Sam Dat']['Live Time'] == 900.0
+    assert load(path, files[:1], loose).data['Sam Dat']['Live Time'] == 100.0
+
+
+def test_cache_eviction(spectra, tmp_path):
+    path, files = spectra
+    cache = spectrumCache(str(tmp_path / 'small'), max_bytes=70000)
+    load(path, files, cache)
+    assert len(cache.index) == 2
+    assert len([x for x in os.listdir(cache.path) if x.endswith('.npy')]) == 2
+
+
+def test_cache_opt_in(monkeypatch):
+    monkeypatch.delenv('NDP_CACHE', raising=False)
+    assert ndp.ndpData().cache is None
+    monkeypatch.setenv('NDP_CACHE', '1')
+    assert ndp.ndpData().cache is not None and not ndp.ndpData().cache.strict
+    monkeypatch.setenv('NDP_CACHE', 'strict')
+    assert ndp.ndpData().cache.strict and ndp.ndpData().trim_cache.strict
+
+
+def test_concurrent_flush(spectra, tmp_path):
+    path, files = spectra
+    location = str(tmp_path / 'shared')
+    caches = [spectrumCache(location) for i in range(8)]
+    spectrum = {'Counts': np.ones(16), 'Live Time': 1.0}
+
+    def write(i):
+        caches[i].put('key%d' % i, path + files[0], spectrum)
+        caches[i].flush()
+
+    # Writers that read the index at the same time keep each other's entries
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(write, range(8)))
+    assert sorted(spectrumCache(location).index) == ['key%d' % i for i in range(8)]
+    assert not [x for x in os.listdir(location) if x.endswith('.tmp') or x.endswith('.lock')]
+
+
+def test_trim_cache(sample, monkeypatch):
+    schemafile, schema = sample
+    monkeypatch.setenv('NDP_CACHE', '1')
+    first = ndp.ndpData()
+    first.schema = schema
+    first.set_TRIM()
+
+    def fail(*args):
+        raise AssertionError('TRIM files evaluated again')
+
+    # Served from memory, then from disk in a new session
+    second = ndp.ndpData()
+    second.schema = schema
+    monkeypatch.setattr(second, 'evalTRIM', fail)
+    second.set_TRIM()
+    ndp.cache.trim_memory.clear()
+    second.set_TRIM()
+    for key in ('Energy', 'Depth', 'Coeffs'):
+        assert np.array_equal(first.TRIM[key], second.TRIM[key])
+    assert first.TRIM['Material'] == second.TRIM['Material']
+    assert np.array_equal(first.detector['Depth'], second.detector['Depth'])
+
+    # Changing a layer file evaluates the stack again
+    layer = schema['TRIM'][0]
+    with open(layer['Path'] + layer['Files'][0], 'a') as f:
+        f.write('T%6d  2 .%05dE+07 %6dE-00\n' % (201, 10000, 100))
+    monkeypatch.undo()
+    second.set_TRIM()
+    assert not np.array_equal(first.TRIM['Energy'], second.TRIM['Energy'])
+    stacks = os.listdir(os.path.join(second.trim_cache.path))
+    assert len(stacks) == 1
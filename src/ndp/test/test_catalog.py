@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import gzip
+import os
+import zipfile
+from datetime import datetime
+import numpy as np
+import ndp
+from ndp.catalog import spectrumCatalog, parse_start, HEADER_BYTES
+from ndp.synthetic import write_spectrum
+
+
+def test_catalog(tmp_path):
+    path = str(tmp_path) + '/'
+    counts = np.ones(4096)
+    for i in range(4):
+        write_spectrum(path + 'run_%d.spe' % i, counts, live=100.0*(i+1),
+                       label='sam' if i % 2 else 'ref', start=datetime(2019, 7, 10+i, 12))
+    with open(path + 'notes.txt', 'w') as f:
+        f.write('not a spectrum\n')
+
+    catalog = spectrumCatalog(path)
+    assert catalog.update() == 5
+    assert catalog.query(label='sam') == ['run_1.spe', 'run_3.spe']
+    assert catalog.query(min_live=150, max_live=300) == ['run_1.spe', 'run_2.spe']
+    assert catalog.query(start=datetime(2019, 7, 11), end='2019-07-12T23:00:00') == ['run_1.spe', 'run_2.spe']
+    assert catalog.query(pattern='*_3.*', detector='Lynx 1') == ['run_3.spe']
+    assert catalog.entries['run_0.spe']['Start'] == '2019-07-10T12:00:00'
+
+    # A second catalog of the directory reads the saved headers
+    write_spectrum(path + 'run_0.spe', counts, live=900.0, label='ref')
+    os.remove(path + 'run_3.spe')
+    catalog = spectrumCatalog(path)
+    assert catalog.update() == 1
+    assert catalog.update() == 0
+    assert catalog.query(min_live=800) == ['run_0.spe']
+    assert 'run_3.spe' not in catalog.entries
+
+    s = ndp.schema()
+    assert s.get_filelist(path, 'run', label='ref') == ['run_0.spe', 'run_2.spe']
+    s.set_files('Sam Dat', path, 'run', label='sam')
+    assert s.schema['Sam Dat'] == {'Path': path, 'Files': ['run_1.spe']}
+
+
+def test_catalog_archive(tmp_path):
+    path = str(tmp_path) + '/'
+    counts = np.ones(4096)
+    archive = path + 'runs.zip'
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for i in range(2):
+            write_spectrum(path + 'run.spe', counts, live=100.0*(i+1), label='sam')
+            with open(path + 'run.spe', 'rb') as f:
+                data = f.read()
+            zf.writestr('day/run_%d.spe' % i, data)
+            zf.writestr('day/run_%d.spe.gz' % i, gzip.compress(data))
+        zf.writestr('day/sub/other.spe', data)
+        # A file without line breaks is not read whole
+        zf.writestr('day/blank.txt', b'x'*(10*HEADER_BYTES))
+
+    catalog = spectrumCatalog(archive + '/day/', path=path + 'catalog.json')
+    assert catalog.update() == 5
+    assert 'sub' not in catalog.entries
+    assert catalog.query(label='sam', min_live=150) == ['run_1.spe', 'run_1.spe.gz']
+    assert 'Error' in catalog.entries['blank.txt']
+    assert catalog.update() == 0
+    assert ndp.schema().get_filelist(archive + '/day/', '.gz', label='sam') == ['run_0.spe.gz', 'run_1.spe.gz']
+
+
+def test_parse_start():
+    assert parse_start('Start Time: Thu Jul 18 10:15:00 EDT 2019\n') == '2019-07-18T10:15:00'
+    assert parse_start('Start Time: unknown\n') == ''
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import copy
+import os
+import numpy as np
+import pytest
+import ndp
+from ndp.profiling import stageHook
+
+
+class recorder(stageHook):
+    def __init__(self):
+        self.files = []
+    def before(self, event):
+        if event['Kind'] == 'File':
+            self.files.append(event['File'])
+
+
+def test_checkpoints(sample, tmp_path):
+    schemafile, schema = sample
+    full = ndp.ndpData()
+    full.runschema(copy.deepcopy(schema))
+    files = {kind: str(tmp_path / (kind + '.npz')) for kind in ('Bgd', 'Ref', 'TRIM')}
+    for kind, filename in files.items():
+        full.save_checkpoint(filename, kind)
+
+    data = ndp.ndpData()
+    meta = data.load_checkpoint(files['Ref'])
+    assert meta['Kind'] == 'Ref' and meta['Version'] == 1
+    assert meta['Inputs']['Datasets']['Ref Dat']['Files'] == schema['Ref Dat']['Files']
+    assert data.shared == ['Ref Dat', 'Ref Mon']
+    assert data.data['Ref Dat']['alpha*'] == full.data['Ref Dat']['alpha*']
+    assert data.data['Ref Dat']['Datetime'] == full.data['Ref Dat']['Datetime']
+
+    # The schema loads the checkpoints in place of reading the files again
+    schema['Checkpoints'] = list(files.values())
+    for dt in ['Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon']:
+        schema[dt]['Files'] = list(schema[dt]['Files'])
+    data = ndp.ndpData()
+    data.add_hook(recorder())
+    data.runschema(copy.deepcopy(schema))
+    assert len(data.hooks[0].files) == 4
+    assert all(['Sam_' in filename for filename in data.hooks[0].files])
+    assert sorted(data.shared) == ['Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon', 'TRIM']
+    for key in ('Atoms/cm2', 'Atoms/cm3 Uncert', 'Depth Binned'):
+        source = data.detector if key == 'Depth Binned' else data.data['Sam Dat']
+        expected = full.detector if key == 'Depth Binned' else full.data['Sam Dat']
+        assert np.array_equal(source[key], expected[key])
+
+    # A checkpoint of files changed since, or of other instrument values, is
+    # not used
+    data = ndp.ndpData()
+    data.schema = copy.deepcopy(schema)
+    assert data.use_checkpoint(files['Bgd'])
+    bgd = schema['Bgd Dat']['Path'] + schema['Bgd Dat']['Files'][0]
+    st = os.stat(bgd)
+    os.utime(bgd, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    with pytest.warns(UserWarning, match='Files'):
+        assert not data.use_checkpoint(files['Bgd'])
+    os.utime(bgd, ns=(st.st_atime_ns, st.st_mtime_ns))
+    data.instrument['Mon Peak Channels'] = [1800, 2901]
+    with pytest.warns(UserWarning, match='Instrument'):
+        assert not data.use_checkpoint(files['Ref'])
+    assert data.use_checkpoint(files['TRIM'])
+    data.schema['Eval'] = {'Model': 'Spline'}
+    with pytest.warns(UserWarning, match='Model'):
+        assert not data.use_checkpoint(files['TRIM'])
+    data.schema['Eval'] = ['TRIM']
+    assert data.use_checkpoint(files['TRIM'])
+    data.instrument['Calib Coeffs'] = [2.0, 10.0]
+    with pytest.warns(UserWarning, match='Instrument'):
+        assert not data.use_checkpoint(files['TRIM'])
+
+    # as is one of datasets the schema does not list
+    del data.schema['Bgd Mon']
+    with pytest.warns(UserWarning):
+        assert not data.use_checkpoint(files['Bgd'])
+
+    # A checkpoint of other files is not used
+    schema['Bgd Dat']['Files'] = schema['Bgd Dat']['Files'][:1]
+    data = ndp.ndpData()
+    with pytest.warns(UserWarning):
+        data.runschema(schema)
+    assert 'Bgd Dat' not in data.shared
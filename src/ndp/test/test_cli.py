@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+import copy
+import json
+import subprocess
+import sys
+import ndp
+from ndp.cli import main
+
+
+def test_cli(sample, tmp_path):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(copy.deepcopy(schema))
+    with open(schema['Save']['Path'] + schema['Save']['Filename']) as f:
+        expected = f.read()
+
+    second = copy.deepcopy(schema)
+    second['Save']['Filename'] = 'second.csv'
+    with open(tmp_path / 'second.json', 'w') as f:
+        json.dump(second, f)
+
+    out = tmp_path / 'out'
+    assert main([str(tmp_path / '*.json'), '-j', '2', '-o', str(out), '-q']) == 0
+    for filename in ('sample.csv', 'second.csv'):
+        with open(out / filename) as f:
+            assert f.read() == expected
+
+    assert main([str(tmp_path / 'missing.json')]) == 1
+
+
+def test_import_is_lazy():
+    code = 'import sys, ndp; print("numpy" in sys.modules, "ndp.reduce" in sys.modules)'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.stdout.split() == ['False', 'False']
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import copy
+import gzip
+import lzma
+import os
+import zipfile
+import numpy as np
+import pytest
+import ndp
+from ndp.compressed import open_file, listdir, file_stat
+
+
+def test_compressed_schema(sample, tmp_path):
+    schemafile, schema = sample
+    expected = ndp.ndpData()
+    expected.runschema(copy.deepcopy(schema))
+
+    # Sample files gzipped, TRIM files xz compressed, reference files in a zip
+    for filename in schema['Sam Dat']['Files']:
+        with open(schema['Sam Dat']['Path'] + filename, 'rb') as f, \
+             gzip.open(schema['Sam Dat']['Path'] + filename + '.gz', 'wb') as g:
+            g.write(f.read())
+    layer = schema['TRIM'][0]
+    for filename in layer['Files']:
+        with open(layer['Path'] + filename, 'rb') as f, \
+             lzma.open(layer['Path'] + filename + '.xz', 'wb') as g:
+            g.write(f.read())
+    archive = str(tmp_path / 'ref.zip')
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for dt in ['Ref Dat', 'Ref Mon']:
+            for filename in schema[dt]['Files']:
+                with open(schema[dt]['Path'] + filename, 'rb') as f:
+                    data = f.read()
+                if dt == 'Ref Mon':
+                    zf.writestr(dt + '/' + filename + '.gz', gzip.compress(data))
+                else:
+                    zf.writestr(dt + '/' + filename, data)
+
+    s = ndp.schema()
+    s.schema = copy.deepcopy(schema)
+    s.schema['Sam Dat']['Files'] = s.get_filelist(schema['Sam Dat']['Path'], '.gz')
+    s.schema['Ref Dat'] = {'Path': archive + '/Ref Dat/', 'Files': s.get_filelist(archive + '/Ref Dat/', '')}
+    s.schema['Ref Mon'] = {'Path': archive + '/Ref Mon/', 'Files': s.get_filelist(archive + '/Ref Mon', '')}
+    s.schema['TRIM'] = []
+    s.add_TRIMlayer(layer['Path'], '.xz')
+    assert sorted(s.schema['Ref Mon']['Files']) == [f + '.gz' for f in schema['Ref Mon']['Files']]
+    assert len(s.schema['TRIM'][0]['Files']) == len(layer['Files'])
+    s.schema['TRIM'][0]['Files'] = [f + '.xz' for f in layer['Files']]
+
+    data = ndp.ndpData()
+    data.runschema(s.schema, incremental=True)
+    assert np.array_equal(data.TRIM['Coeffs'], expected.TRIM['Coeffs'])
+    for key in ('Counts', 'Atoms/cm2', 'Atoms/cm3 Binned'):
+        assert np.array_equal(data.data['Sam Dat'][key], expected.data['Sam Dat'][key])
+
+    # Unchanged archives are skipped by an incremental run
+    data.runschema(s.schema, incremental=True)
+    assert data.stages['Skipped'][:2] == ['Eval', 'Load']
+
+
+def test_zip_members(tmp_path):
+    archive = str(tmp_path / 'a.zip')
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('x.txt', 'one\ntwo\n')
+        zf.writestr('sub/y.txt', 'three\n')
+    assert sorted(listdir(archive)) == ['sub', 'x.txt']
+    assert listdir(archive + '/sub/') == ['y.txt']
+    with open_file(archive + '/x.txt') as f:
+        assert f.readline() == 'one\n'
+        assert f.read() == 'two\n'
+    assert file_stat(archive + '/sub/y.txt')[0] == 6
+
+
+def test_zip_members_closed(tmp_path):
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('no /proc/self/fd')
+    archive = str(tmp_path / 'a.zip')
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('x.txt', 'one\n')
+        zf.writestr('x.txt.gz', gzip.compress(b'one\n'))
+        zf.writestr('x.txt.xz', lzma.compress(b'one\n'))
+
+    # The archive is closed with the stream, not when it is collected
+    fds = len(os.listdir('/proc/self/fd'))
+    for member in ('x.txt', 'x.txt.gz', 'x.txt.xz'):
+        for mode in ('r', 'rb'):
+            with open_file(archive + '/' + member, mode) as f:
+                assert f.readline() in ('one\n', b'one\n')
+                assert len(os.listdir('/proc/self/fd')) == fds + 1
+            assert len(os.listdir('/proc/self/fd')) == fds
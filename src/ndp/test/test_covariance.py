@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import numpy as np
+import ndp
+from ndp.covariance import lowRankCovariance, profile_covariance, binned_covariance, depth_windows
+from ndp.montecarlo import monteCarlo
+
+
+def test_windows():
+    rng = np.random.default_rng(0)
+    variance = rng.uniform(1, 2, 50)
+    factors = rng.normal(size=(50, 3))
+    coupling = np.array([[1.0, 0.5, 0.0], [0.5, 2.0, 0.0], [0.0, 0.0, 1.0]])
+    cov = lowRankCovariance(variance, factors, coupling)
+    dense = np.diag(variance) + factors @ coupling @ factors.T
+    assert np.allclose(cov.diagonal(), np.diag(dense))
+
+    windows = [[0, 10], [5, 20], [20, 50], [0, 0]]
+    weights = [1.0, 0.5, 2.0, 1.0]
+    project = np.zeros((4, 50))
+    for i, (low, high) in enumerate(windows):
+        project[i, low:high] = weights[i]
+    assert np.allclose(cov.windows(windows, weights), project @ dense @ project.T)
+
+    edges = [0, 7, 30, 50]
+    means = cov.bins(edges)
+    assert np.isclose(means[1, 1], dense[7:30, 7:30].sum()/23**2)
+
+    corr_depth = np.concatenate((np.linspace(1000, 0, 41), -np.arange(1, 10)))
+    windows = depth_windows(corr_depth, 40, [[0, 100], [100, 1000.5]])
+    assert np.array_equal(windows, [[37, 41], [0, 37]])
+
+
+def test_profile_covariance(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema)
+
+    cov = profile_covariance(data)
+    assert cov.factors.shape[:1] == (4096,)
+    binned = binned_covariance(data)
+    num_bins = len(data.detector['Channels Binned'])
+    assert binned.shape == (num_bins, num_bins)
+    assert np.all(binned[-1] == 0)
+
+    # The covariance of the bins matches the spread of Monte Carlo replicas
+    bins = np.arange(80, 120)
+    replicas = monteCarlo(data, seed=3).run(replicas=1000, keep=True)['Atoms/cm2 Binned']['Replicas']
+    sampled = np.cov(replicas[:, bins].T)
+    model = binned[np.ix_(bins, bins)]
+    assert abs(np.median(np.diag(sampled)/np.diag(model)) - 1) < 0.1
+    off = ~np.eye(len(bins), dtype=bool)
+    assert abs(np.median(sampled[off]/model[off]) - 1) < 0.2
+
+    # Atoms/cm3 shares the scale of Del Depth
+    volume = profile_covariance(data, 'Atoms/cm3')
+    assert volume.sources[-1] == 'Del Depth'
+    independent = profile_covariance(data, 'Atoms/cm3', shared_depth=False)
+    assert np.allclose(volume.diagonal(), independent.diagonal())
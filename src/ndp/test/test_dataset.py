@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+import pickle
+import warnings
+import numpy as np
+import ndp
+from ndp.dataset import ndpDataset, compact
+
+
+def test_dataset_mapping():
+    d = ndpDataset(length=4)
+    d['Files'] = ['a', 'b']
+    d['Counts'] = np.arange(4.0)
+    d['Counts'] += 1
+    for i in range(6):
+        d['Col %d' % i] = np.full(4, float(i))
+    del d['Col 0']
+    assert list(d)[:2] == ['Counts', 'Col 1']
+    assert np.array_equal(d['Counts'], [1, 2, 3, 4])
+    assert np.array_equal(d['Col 5'], np.full(4, 5.0))
+    assert d['Files'] == ['a', 'b']
+    assert 'Col 0' not in d
+    assert dict(pickle.loads(pickle.dumps(d))).keys() == dict(d).keys()
+
+
+def test_compact_runschema(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schemafile)
+    with open(schema['Save']['Path'] + schema['Save']['Filename']) as f:
+        expected = f.read()
+    before = sum(x.nbytes for d in data.data.values() for x in d.values() if isinstance(x, np.ndarray))
+
+    data.compact(np.float64)
+    data.runschema(schemafile, incremental=False)
+    with open(schema['Save']['Path'] + schema['Save']['Filename']) as f:
+        assert f.read() == expected
+
+    # The nan_to_num sentinels of the float64 arrays fit in float32 without overflow
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        data.compact(np.float32, drop_intermediates=True)
+    sam = data.data['Sam Dat']
+    assert not np.any(np.isinf(sam['Atoms/cm3']))
+    assert 'Norm Cts' not in sam
+    assert sam['Atoms/cm2'].dtype == np.float32
+    assert sum(d.nbytes() for d in data.data.values()) < before/3
+
+    # The stages whose arrays were dropped run again
+    assert list(data.stage_record) == ['Eval']
+    schema['Bin'] = 7
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Load', 'Norm', 'Corr', 'Absolute', 'Bin', 'Save']
+    assert data.data['Sam Dat']['Atoms/cm3 Binned'].dtype == np.float32
+
+    # Without dropping, only the changed stages run
+    data.compact(np.float32)
+    schema['Bin'] = 5
+    data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Bin', 'Save']
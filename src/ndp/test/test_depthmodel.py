@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import copy
+import json
+import os
+import numpy as np
+import ndp
+import ndp.depthmodel
+from ndp.depthmodel import get_model, splineModel, pchip_slopes, depth_to_energy
+
+
+ENERGY = np.array([1472.35, 1468.65, 1452.9, 1432.8, 1390.3, 1295.9, 1100.0])
+THICK = np.array([0.0, 10.0, 50.0, 100.0, 200.0, 400.0, 800.0])
+
+
+def test_models():
+    for name in ['Poly', 'Linear', 'Spline']:
+        model = get_model(name, ENERGY, THICK, energy_range=(-12.45, 2913.0))
+        assert get_model(name, ENERGY, THICK, energy_range=(-12.45, 2913.0)) is model
+        assert model.table_energy[0] == -12.45 and model.table_energy[-1] == 2913.0
+        energy = np.linspace(1100.0, 1472.35, 101)
+        assert np.allclose(model.depth(energy), model.evaluate(energy), atol=0.01)
+        if name != 'Poly':
+            # Interpolating models pass through the TRIM points
+            assert np.allclose(model.evaluate(ENERGY), THICK, atol=1e-9)
+        depth = np.linspace(0.0, 800.0, 17)
+        assert np.allclose(model.depth(model.inverse(depth)), depth, atol=1e-6)
+
+    # The spline does not overshoot between points
+    model = splineModel(ENERGY, THICK)
+    energy = np.linspace(1100.0, 1472.35, 1001)
+    assert np.all(np.diff(model.evaluate(energy)) <= 0)
+    assert np.all(pchip_slopes(model.energy, model.thick) <= 0)
+
+    # A parabola is inverted on the part that falls with energy
+    energies = np.linspace(0.0, 10.0, 101)
+    depths = (energies - 7.0)**2
+    assert np.allclose(depth_to_energy([4.0, 9.0], energies, depths), [5.0, 4.0])
+
+
+def test_models_bounded(monkeypatch):
+    monkeypatch.setattr(ndp.depthmodel, 'MAX_MODELS', 2)
+    ndp.depthmodel.MODELS.clear()
+    models = [get_model('Linear', ENERGY, THICK*scale, points=65) for scale in (1.0, 2.0)]
+    assert get_model('Linear', ENERGY, THICK, points=65) is models[0]
+    # The least recently used model makes room for a new one
+    get_model('Linear', ENERGY, THICK*3.0, points=65)
+    assert len(ndp.depthmodel.MODELS) == 2
+    assert get_model('Linear', ENERGY, THICK, points=65) is models[0]
+    assert get_model('Linear', ENERGY, THICK*2.0, points=65) is not models[1]
+
+
+def test_depth_model_reduction(sample):
+    schemafile, schema = sample
+    poly = ndp.ndpData()
+    poly.runschema(schema)
+    a, b, c = poly.TRIM['Coeffs']
+    energy = poly.detector['Energy']
+    assert np.array_equal(poly.detector['Depth'], a*np.power(energy, 2) + b*energy + c)
+
+    spline = copy.deepcopy(schema)
+    spline['Eval']['Model'] = 'Spline'
+    data = ndp.ndpData()
+    data.runschema(spline)
+    assert data.TRIM['Model'] == 'Spline'
+    model = get_model('Spline', data.TRIM['Energy'], data.TRIM['Depth'])
+    assert np.allclose(data.detector['Depth'], model.evaluate(energy), atol=1e-3)
+
+    # Depths map back to the channels they came from
+    channels = np.array([1500.0, 1800.0, 2077.0])
+    depth = np.interp(channels, data.detector['Channels'], data.detector['Corr Depth'])
+    assert np.allclose(data.depth2chan(depth), channels, atol=1e-3)
+    assert data.depth2chan(0.0) == data.instrument['Zero Channel']
+
+    # A calibration sweep keeps the depth model of the sample
+    from ndp.sweep import calibrationSweep
+    same = calibrationSweep(data).run()
+    assert np.array_equal(same['Atoms/cm3 Binned'][0], data.data['Sam Dat']['Atoms/cm3 Binned'])
+
+
+def test_eval_list(sample):
+    schemafile, schema = sample
+    # The example schema lists what to evaluate, with no model
+    example = os.path.join(os.path.dirname(ndp.__file__), 'example_files', 'schema.json')
+    with open(example) as f:
+        schema['Eval'] = json.load(f)['Eval']
+    assert schema['Eval'] == ['TRIM']
+    data = ndp.ndpData()
+    data.schema = schema
+    data.set_TRIM()
+    assert data.TRIM['Model'] == 'Poly'
+    assert data.depth_model() == 'Poly'
+
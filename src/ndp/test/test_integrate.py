@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import copy
+import numpy as np
+import pytest
+import ndp
+import ndp.integrate
+from ndp.integrate import windowIntegrator
+
+
+def test_windows():
+    rng = np.random.default_rng(3)
+    x = rng.poisson(100, (3, 4096)).astype(float)
+    u = np.sqrt(x)
+    integrator = windowIntegrator(x, u)
+
+    windows = [[0, 4096], [1791, 2142], [2291, 2592], [10, 10]]
+    sums, uncerts = integrator.windows(windows)
+    for i, (low, high) in enumerate(windows):
+        assert np.allclose(sums[:, i], np.sum(x[:, low:high], axis=-1), rtol=1e-14)
+        assert np.allclose(uncerts[:, i], np.sqrt(np.sum(u[:, low:high]**2, axis=-1)), rtol=1e-14)
+    assert np.allclose(integrator.integrate(5, 50), x[:, 5:50].sum(axis=-1), rtol=1e-14)
+
+    low, sums, uncerts = windowIntegrator(x[0]).sliding(21, step=7, start=100, stop=400)
+    assert low[0] == 100 and low[-1] + 21 <= 400
+    assert np.allclose(sums, [x[0, i:i+21].sum() for i in low], rtol=1e-14)
+    assert uncerts is None
+
+    with pytest.raises(ValueError):
+        integrator.windows([[0, 5000]])
+
+
+def test_narrow_windows_float64(monkeypatch):
+    # Cumulative sums in float64, as where longdouble is no wider
+    monkeypatch.setattr(ndp.integrate, 'PREFIX_DTYPE', np.float64)
+    x = np.ones((2, 4096))
+    x[:, 0] = 1e17
+    u = np.sqrt(x)
+    integrator = windowIntegrator(x, u)
+    assert integrator.sums.dtype == np.float64
+
+    # Narrow windows past a large value are exact
+    sums, uncerts = integrator.windows([[4000, 4005], [4090, 4096], [3000, 3000]])
+    assert np.array_equal(sums, [[5.0, 6.0, 0.0]]*2)
+    assert np.allclose(uncerts, np.sqrt([[5.0, 6.0, 0.0]]*2), rtol=1e-15)
+    assert integrator.integrate(100, 163)[0] == 63.0
+    assert np.isclose(integrator.uncert(100, 163)[0], np.sqrt(63.0), rtol=1e-15)
+    # Wide windows are within the rounding of the cumulative sum
+    x[:, 0] = 1e6
+    wide = windowIntegrator(x).integrate(1000, 4000)
+    assert np.allclose(wide, 3000.0, rtol=0, atol=4*np.finfo(np.float64).eps*np.sum(x[0]))
+
+
+def test_ref_windows(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(copy.deepcopy(schema))
+    ref = data.data['Ref Dat']
+    assert np.isclose(ref['alpha*'], np.sum(ref['Corr Cts'][1791:2142]), rtol=1e-12)
+    assert np.isclose(ref['alpha Uncert'], np.sqrt(np.sum(ref['Corr Cts Uncert'][2291:2592]**2)), rtol=1e-12)
+
+    schema['Absolute']['Ref Windows'] = {'alpha*': [1700, 2200], 'beta': [100, 200]}
+    data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Absolute', 'Bin', 'Save']
+    assert np.isclose(ref['alpha*'], np.sum(ref['Corr Cts'][1700:2200]), rtol=1e-12)
+    assert np.isclose(ref['beta'], np.sum(ref['Corr Cts'][100:200]), rtol=1e-12)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import copy
+import gzip
+import numpy as np
+import ndp
+from ndp.listmode import histogram_events, read_listmode
+from ndp.synthetic import write_spectrum, write_events, spectrum_events
+
+
+def brute_force(times, channels, numchannels, dead, pile):
+    '''Histogram with the gates applied one event at a time'''
+    counts = np.zeros(numchannels, dtype=np.int64)
+    for i in range(len(times)):
+        prev_gap = times[i] - times[i-1] if i > 0 else np.inf
+        next_gap = times[i+1] - times[i] if i < len(times)-1 else np.inf
+        if prev_gap >= max(dead, pile) and next_gap >= pile:
+            counts[channels[i]] += 1
+    return counts
+
+
+def test_histogram(tmp_path):
+    rng = np.random.default_rng(3)
+    counts = rng.poisson(20, 256)
+    times, channels = spectrum_events(counts, 10.0, 1e-6, rng)
+    write_events(tmp_path / 'run.evt', times, channels)
+
+    h = histogram_events(tmp_path / 'run.evt', 256, tick=1e-6, stop=10.0, chunk_events=1000)
+    assert np.array_equal(h['Counts'], counts)
+    assert h['Real Time'] == 10.0 and h['Live Time'] == 10.0
+    assert h['Recorded'] == h['Kept'] == counts.sum()
+
+    # Time slices add up to the whole file
+    s = histogram_events(tmp_path / 'run.evt', 256, tick=1e-6, stop=10.0, slice_width=2.5, chunk_events=999)
+    assert s['Counts'].shape == (4, 256)
+    assert np.array_equal(s['Counts'].sum(axis=0), counts)
+    assert np.allclose(s['Elapsed'], [0.0, 2.5, 5.0, 7.5])
+    assert np.allclose(s['Real Time'], 2.5)
+
+    # A time window keeps the events inside it
+    w = histogram_events(tmp_path / 'run.evt', 256, tick=1e-6, start=2.0, stop=4.0)
+    inside = (times >= 2000000) & (times < 4000000)
+    assert np.array_equal(w['Counts'], np.bincount(channels[inside], minlength=256))
+
+    # Gates match the event by event rule across chunk boundaries
+    for dead, pile in [(2000, 0), (0, 1500), (1000, 2500)]:
+        g = histogram_events(tmp_path / 'run.evt', 256, tick=1e-6, dead_time=dead*1e-6,
+                             pile_up=pile*1e-6, chunk_events=777)
+        expected = brute_force(times, channels, 256, dead, pile)
+        assert np.array_equal(g['Counts'], expected)
+        assert g['Kept'] < g['Recorded']
+        assert np.isclose(g['Live Time'], g['Real Time']*expected.sum()/len(times))
+
+    # Compressed files give the same spectrum
+    with open(tmp_path / 'run.evt', 'rb') as f, gzip.open(tmp_path / 'run.evt.gz', 'wb') as g:
+        g.write(f.read())
+    z = histogram_events(tmp_path / 'run.evt.gz', 256, tick=1e-6, stop=10.0, chunk_events=1000)
+    assert np.array_equal(z['Counts'], counts)
+
+
+def test_listmode_reduction(sample):
+    '''List-mode sample files reduce like the text spectra they histogram to'''
+    schemafile, schema = sample
+    rng = np.random.default_rng(4)
+    events = copy.deepcopy(schema)
+    events['Time Resolved'] = True
+    for dt in ['Sam Dat', 'Sam Mon']:
+        path = schema[dt]['Path']
+        files = []
+        for i, filename in enumerate(schema[dt]['Files']):
+            counts = rng.poisson(40, 4096)
+            write_spectrum(path + filename, counts, live=300.0, real=300.0)
+            times, channels = spectrum_events(counts, 300.0, 1e-6, rng)
+            write_events(path + filename + '.evt', times, channels)
+            files.append(filename + '.evt')
+        # The second file starts when the first one ends
+        starts = dict(zip(files, ['2019-07-18T10:15:00', '2019-07-18T10:20:00']))
+        events[dt] = {'Path': path, 'Files': files,
+                      'List Mode': {'Tick': 1e-6, 'Stop': 300.0, 'Slice': 150.0, 'Datetime': starts}}
+
+    text = ndp.ndpData()
+    text.runschema(schema)
+    listmode = ndp.ndpData()
+    listmode.runschema(events)
+
+    sam = listmode.data['Sam Dat']
+    assert sam['Counts'].shape == (4, 4096)
+    assert np.allclose(sam['Elapsed'], [0.0, 150.0, 300.0, 450.0])
+    assert np.array_equal(sam['Counts'].sum(axis=0), text.data['Sam Dat']['Counts'])
+
+    spectra = read_listmode(schema['Sam Dat']['Path'] + events['Sam Dat']['Files'][0], 4096,
+                            {'Tick': 1e-6, 'Stop': 300.0})
+    assert len(spectra) == 1
+    assert spectra[0]['Datetime'] and spectra[0]['Live Time'] == 300.0
+
+    # Summed, the list-mode reduction matches the text one
+    events['Time Resolved'] = False
+    listmode.runschema(events)
+    for key in ('Counts/Dt', 'Atoms/cm2', 'Atoms/cm3 Binned'):
+        assert np.allclose(listmode.data['Sam Dat'][key], text.data['Sam Dat'][key], rtol=1e-12, atol=0)
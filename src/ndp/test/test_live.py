@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import copy
+import numpy as np
+import ndp
+from ndp import ndpLive
+from ndp.profiling import stageHook
+from ndp.synthetic import write_spectrum, write_events, spectrum_events
+
+
+class recorder(stageHook):
+    def __init__(self):
+        self.files = []
+    def before(self, event):
+        if event['Kind'] == 'File':
+            self.files.append(event['File'])
+
+
+def test_live_update(sample):
+    schemafile, schema = sample
+    schema['Save']['Filename'] = 'live.csv'
+    path = schema['Sam Dat']['Path']
+    files = schema['Sam Dat']['Files']
+
+    live = ndpLive(tags={'Sam Dat': 'SamDat'})
+    live.start(schema)
+    assert live.update() == []
+
+    # One file grows and a new file appears
+    rng = np.random.default_rng(4)
+    write_spectrum(path + files[1], rng.poisson(40, 4096), live=900.0, real=915.0)
+    write_spectrum(path + 'sample_SamDat_002.spe', rng.poisson(40, 4096), live=300.0, real=305.0)
+    changed = live.update()
+    assert sorted(changed) == [('Sam Dat', files[1]), ('Sam Dat', 'sample_SamDat_002.spe')]
+    # Load and every stage after it run again on an incremental run
+    assert list(live.ndp.stage_record) == ['Eval']
+
+    schema['Sam Dat']['Files'] = files + ['sample_SamDat_002.spe']
+    full = ndp.ndpData()
+    full.runschema(schema)
+    for key in ('Counts', 'Live Time', 'Real Time', 'Atoms/cm2', 'Atoms/cm3 Binned'):
+        assert np.allclose(live.ndp.data['Sam Dat'][key], full.data['Sam Dat'][key], rtol=1e-12)
+
+    updates = []
+    for data in live.watch(interval=0.01, timeout=0.05, callback=lambda d, c: updates.append(c)):
+        pass
+    assert updates == []
+
+
+def test_live_listmode(sample):
+    schemafile, schema = sample
+    rng = np.random.default_rng(5)
+    path = schema['Sam Dat']['Path']
+    files = []
+    for filename in schema['Sam Dat']['Files']:
+        times, channels = spectrum_events(rng.poisson(40, 4096), 300.0, 1e-6, rng)
+        write_events(path + filename + '.evt', times, channels)
+        files.append(filename + '.evt')
+    options = {'Tick': 1e-6, 'Datetime': '2019-07-18T10:15:00'}
+    schema['Sam Dat'] = {'Path': path, 'Files': files, 'List Mode': options}
+
+    # Each file is read once by the run of the schema
+    live = ndpLive()
+    live.ndp.add_hook(recorder())
+    live.start(copy.deepcopy(schema))
+    loaded = [schema[dt]['Path'] + f for dt in schema['Load'] for f in schema[dt]['Files']]
+    assert sorted(f for f in live.ndp.hooks[0].files if f in loaded) == sorted(loaded)
+
+    # A list-mode file that grows is histogrammed again
+    times, channels = spectrum_events(rng.poisson(40, 4096), 600.0, 1e-6, rng)
+    write_events(path + files[0], times, channels)
+    assert live.update() == [('Sam Dat', files[0])]
+    full = ndp.ndpData()
+    full.runschema(schema)
+    for key in ('Counts', 'Live Time', 'Real Time', 'Atoms/cm2'):
+        assert np.allclose(live.ndp.data['Sam Dat'][key], full.data['Sam Dat'][key], rtol=1e-12)
+
+
+def test_live_time_resolved(sample):
+    schemafile, schema = sample
+    schema['Time Resolved'] = True
+    files = {dt: list(schema[dt]['Files']) for dt in ('Sam Dat', 'Sam Mon')}
+
+    live = ndpLive(tags={'Sam Dat': 'SamDat', 'Sam Mon': 'SamMon'})
+    live.start(copy.deepcopy(schema))
+    assert live.ndp.data['Sam Dat']['Counts'].shape == (len(files['Sam Dat']), 4096)
+
+    # A file that grows replaces its row and a new file adds one
+    rng = np.random.default_rng(6)
+    write_spectrum(schema['Sam Dat']['Path'] + files['Sam Dat'][0], rng.poisson(40, 4096), live=900.0, real=915.0)
+    for dt in files:
+        filename = 'sample_%s_%03d.spe' % (dt.replace(' ', ''), len(files[dt]))
+        write_spectrum(schema[dt]['Path'] + filename, rng.poisson(40, 4096), live=600.0, real=605.0)
+        files[dt].append(filename)
+    assert len(live.update()) == 3
+
+    for dt in files:
+        schema[dt]['Files'] = files[dt]
+    full = ndp.ndpData()
+    full.runschema(schema)
+    live_time = live.ndp.data['Sam Dat']['Live Time']
+    assert len(live_time) == len(files['Sam Dat'])
+    assert live_time[0] == 900.0 and live_time[-1] == 600.0
+    for key in ('Counts', 'Live Time', 'Real Time', 'Elapsed', 'Atoms/cm2', 'Atoms/cm3 Binned'):
+        assert np.allclose(live.ndp.data['Sam Dat'][key], full.data['Sam Dat'][key], rtol=1e-12)
+    assert live.ndp.data['Sam Dat']['Labels'] == full.data['Sam Dat']['Labels']
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import numpy as np
+import ndp
+import ndp.montecarlo
+from ndp.montecarlo import monteCarlo, add_moments
+
+
+def test_montecarlo(sample, monkeypatch):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema)
+    sam = data.data['Sam Dat']
+
+    results = monteCarlo(data, seed=1).run(replicas=400)
+    assert results['Atoms/cm2']['Mean'].shape == (4096,)
+    bins = slice(80, 120)
+    # With many counts the replicas agree with the first order uncertainties
+    for key in ['Atoms/cm2 Binned', 'Atoms/cm3 Binned']:
+        ratio = results[key]['Mean'][bins]/sam[key][bins]
+        assert abs(np.nanmedian(ratio) - 1) < 0.02
+        ratio = results[key]['Std'][bins]/sam[key + ' Uncert'][bins]
+        assert abs(np.nanmedian(ratio) - 1) < 0.2
+    band = results['Atoms/cm2 Binned']
+    assert np.all(band['Low'][bins] <= band['Median'][bins])
+    assert np.all(band['Median'][bins] <= band['High'][bins])
+    assert np.allclose(results['Depth Binned']['Mean'], data.detector['Depth Binned'])
+
+    # Small chunks, a varied calibration and kept replicas
+    monkeypatch.setattr(ndp.montecarlo, 'CHUNK_VALUES', 4*3*4096*20)
+    results = monteCarlo(data, seed=2).run(replicas=50, calib_uncert=[1e-4, 0.05], keep=True)
+    assert results['Atoms/cm3 Binned']['Replicas'].shape == (50, len(data.detector['Channels Binned']))
+    assert np.all(results['Depth Binned']['Std'][bins] > 0)
+    replicas = results['Atoms/cm3 Binned']['Replicas']
+    assert np.allclose(results['Atoms/cm3 Binned']['Mean'], np.nanmean(replicas, axis=0), rtol=1e-12, equal_nan=True)
+    assert np.allclose(results['Atoms/cm3 Binned']['Std'], np.nanstd(replicas, axis=0, ddof=1), rtol=1e-9, equal_nan=True)
+
+    # Without keep, the percentiles come from the first QUANTILE_REPLICAS replicas
+    monkeypatch.setattr(ndp.montecarlo, 'QUANTILE_REPLICAS', 30)
+    bounded = monteCarlo(data, seed=2).run(replicas=50, calib_uncert=[1e-4, 0.05])
+    assert 'Replicas' not in bounded['Atoms/cm3 Binned']
+    assert np.array_equal(bounded['Atoms/cm3 Binned']['Median'], np.nanmedian(replicas[:30], axis=0), equal_nan=True)
+    assert np.array_equal(bounded['Atoms/cm3 Binned']['Mean'], results['Atoms/cm3 Binned']['Mean'], equal_nan=True)
+
+
+def test_add_moments():
+    rng = np.random.default_rng(3)
+    noise = rng.normal(0.0, 1e-3, (1000, 5))
+    noise[::7, 1] = np.nan
+    noise[:, 4] = np.inf
+    x = 1e6 + noise
+    moments = None
+    for chunk in (x[:1], x[1:300], x[300:301], x[301:]):
+        moments = add_moments(moments, chunk)
+    count, mean, m2 = moments
+    assert list(count) == [1000, 1000 - 143, 1000, 1000, 0]
+    assert np.allclose(mean[:4] - 1e6, np.nanmean(noise[:, :4], axis=0), rtol=0, atol=1e-9)
+    # Sums of x**2 lose every digit of a spread this small next to the mean
+    std = np.sqrt(m2[:4]/(count[:4] - 1))
+    assert np.allclose(std, np.nanstd(noise[:, :4], axis=0, ddof=1), rtol=1e-6)
+    assert m2[4] == 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import copy
+import json
+import os
+import zipfile
+import pytest
+import ndp
+from ndp.profiling import stageHook, stageProfiler, NO_HOOKS
+
+
+def test_profiler(sample, tmp_path):
+    schemafile, schema = sample
+    log = str(tmp_path / 'profile.jsonl')
+    data = ndp.ndpData()
+    assert data.stage('Load') is NO_HOOKS
+
+    profiler = stageProfiler(memory=True, log=log)
+    data.add_hook(profiler)
+    data.workers = 2
+    data.runschema(schema)
+    profiler.clear()
+    report = profiler.report()
+    assert report['Events'] == []
+
+    with open(log) as f:
+        events = [json.loads(line) for line in f]
+    stages = [e['Stage'] for e in events if e['Kind'] == 'Stage']
+    assert stages == ['Eval', 'Load', 'Norm', 'Corr', 'Absolute', 'Bin', 'Save']
+    files = [e for e in events if e['Kind'] == 'File']
+    assert len(files) == 6*2 + 5
+
+    load = [e for e in events if e['Stage'] == 'Load'][0]
+    assert load['Bytes'] == sum(e['Bytes'] for e in files if e['File'].endswith('.spe'))
+    assert load['Peak Memory'] > 0
+    assert all('Arrays' in e and 'Peak Memory' in e for e in events if e['Kind'] == 'Stage')
+    # The peak of tracemalloc is not that of one thread, so reads have none
+    assert not any('Peak Memory' in e or 'Allocated' in e for e in files)
+
+
+def test_hook_order_and_errors(sample):
+    schemafile, schema = sample
+    calls = []
+
+    class recorder(stageHook):
+        def before(self, event):
+            calls.append(('before', event['Stage']))
+        def after(self, event):
+            calls.append(('after', event['Stage'], event.get('Error')))
+
+    data = ndp.ndpData()
+    hook = recorder()
+    data.add_hook(hook)
+    schema['Operations'] = ['Load', 'Bin']
+    schema['Sam Dat']['Files'] = ['missing.spe']
+    with pytest.raises(OSError):
+        data.runschema(schema)
+    assert calls[0] == ('before', 'Load')
+    assert calls[1] == ('before', 'Read')
+    assert calls[2][:2] == ('after', 'Read') and 'FileNotFoundError' in calls[2][2]
+    assert calls[-1][:2] == ('after', 'Load') and 'FileNotFoundError' in calls[-1][2]
+
+    data.remove_hook(hook)
+    assert data.stage('Load') is NO_HOOKS
+
+
+def test_profiler_zip_member(sample, tmp_path):
+    schemafile, schema = sample
+    archive = str(tmp_path / 'ref.zip')
+    dt = schema['Ref Dat']
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for filename in dt['Files']:
+            zf.write(dt['Path'] + filename, filename)
+    sizes = [os.path.getsize(dt['Path'] + filename) for filename in dt['Files']]
+    schema = copy.deepcopy(schema)
+    schema['Ref Dat']['Path'] = archive + '/'
+
+    profiler = stageProfiler()
+    data = ndp.ndpData()
+    data.add_hook(profiler)
+    data.runschema(schema)
+    members = [e for e in profiler.report()['Events'] if e['Kind'] == 'File' and e['File'].startswith(archive)]
+    assert len(members) == len(sizes)
+    assert 'Error' not in members[0]
+    # The uncompressed size of each member, which the parser reads
+    assert sorted(e['Bytes'] for e in members) == sorted(sizes)
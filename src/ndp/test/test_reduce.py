@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import json
+import os
+import pytest
+import numpy as np
+import ndp
+import ndp.reduce
+from ndp.synthetic import write_spectrum
+
+
+def test_incremental_runschema(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schemafile, incremental=True)
+    assert data.stages['Skipped'] == []
+    live = data.data['Sam Dat']['Live Time']
+
+    schema['Bin'] = 11
+    schema['Save']['Filename'] = 'rebinned.csv'
+    with open(schemafile, 'w') as f:
+        json.dump(schema, f)
+    data.runschema(schemafile, incremental=True)
+    assert data.stages['Run'] == ['Bin', 'Save']
+    assert data.stages['Skipped'] == ['Eval', 'Load', 'Norm', 'Corr', 'Absolute']
+    assert data.data['Sam Dat']['Live Time'] == live
+
+    fresh = ndp.ndpData()
+    fresh.runschema(schemafile)
+    assert np.array_equal(fresh.data['Sam Dat']['Atoms/cm3 Binned'],
+                          data.data['Sam Dat']['Atoms/cm3 Binned'])
+
+    schema['Save']['Columns'] = ['Channels', 'Counts']
+    data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Save']
+
+    # A changed data file is loaded again, along with everything after it
+    path = schema['Sam Dat']['Path']
+    write_spectrum(path + schema['Sam Dat']['Files'][0], np.ones(4096), live=1.0, real=1.0)
+    data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Load', 'Norm', 'Corr', 'Absolute', 'Bin', 'Save']
+    assert data.data['Sam Dat']['Live Time'] == 601.0
+
+    data.runschema(schema, incremental=False)
+    assert data.stages['Skipped'] == []
+
+
+def test_failed_stage_runs_again(sample):
+    schemafile, schema = sample
+    schema['Save']['Path'] = schema['Save']['Path'] + 'missing/'
+    data = ndp.ndpData()
+    with pytest.raises(OSError):
+        data.runschema(schema, incremental=True)
+
+    # Only the stage that failed, and what follows it, runs again
+    os.makedirs(schema['Save']['Path'])
+    data.runschema(schema, incremental=True)
+    assert data.stages['Run'] == ['Save']
+    assert os.path.exists(schema['Save']['Path'] + schema['Save']['Filename'])
+
+
+def test_runschema_not_incremental_by_default(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema)
+    data.runschema(schema)
+    assert data.stages['Skipped'] == []
+
+
+def test_forget_stage(sample, monkeypatch):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema, incremental=True)
+    data.forget_stage('Corr')
+    assert sorted(data.stage_record) == ['Eval', 'Load', 'Norm']
+
+    # Stages downstream through other stages are forgotten too
+    monkeypatch.setitem(ndp.reduce.STAGE_DEPENDS, 'Bin', ['Absolute'])
+    data.runschema(schema, incremental=True)
+    data.forget_stage('Load')
+    assert list(data.stage_record) == ['Eval']
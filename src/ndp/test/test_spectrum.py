@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import numpy as np
+import ndp
+from ndp.spectrum import read_spectrum, parse_counts, parse_counts_loop
+
+
+def test_read_spectrum(spectra):
+    path, files = spectra
+    spectrum = read_spectrum(path + files[0], 4096)
+
+    assert spectrum['Detector'] == 'Lynx 1'
+    assert spectrum['Label'] == 'sample'
+    assert spectrum['Live Time'] == 100.0
+    assert spectrum['Real Time'] == 110.5
+    assert spectrum['Counts'].shape == (4096,)
+
+
+def test_parse_counts_matches_loop():
+    body = ''.join('%d %s\n' % (i, repr(0.1*i)) for i in range(16)) + 'trailer\n'
+    fast = parse_counts(body, 16)
+    slow = parse_counts_loop(body, 16)
+    assert np.array_equal(fast, slow)
+
+    # Ragged rows are left to the line by line parser
+    assert parse_counts('0 1 2\n1 3\n', 2) is None
+    assert np.array_equal(parse_counts_loop('0 1 2\n1 3\n', 2), [1.0, 3.0])
+
+
+def test_loadfiles(spectra):
+    path, files = spectra
+    data = ndp.ndpData()
+    data.data['Sam Dat']['Path'] = path
+    data.data['Sam Dat']['Files'] = files
+    data.loadfiles('Sam Dat')
+
+    counts = np.zeros(4096)
+    for filename in files:
+        counts += parse_counts_loop(open(path + filename).read().split('\n', 8)[8], 4096)
+    assert np.array_equal(data.data['Sam Dat']['Counts'], counts)
+    assert data.data['Sam Dat']['Live Time'] == 303.0
+    assert data.data['Sam Dat']['Datetime'].year == 2018
+
+
+def test_loadfiles_workers(spectra):
+    path, files = spectra
+    results = []
+    for workers in (1, 4):
+        data = ndp.ndpData()
+        data.cache = None
+        data.workers = workers
+        for dt in ('Sam Dat', 'Sam Mon'):
+            data.data[dt]['Path'] = path
+            data.data[dt]['Files'] = files
+        data.loaddatasets(['Sam Dat', 'Sam Mon'])
+        results.append(data.data)
+
+    for dt in ('Sam Dat', 'Sam Mon'):
+        assert np.array_equal(results[0][dt]['Counts'], results[1][dt]['Counts'])
+        assert results[0][dt]['Live Time'] == results[1][dt]['Live Time']
+        assert results[0][dt]['Labels'] == results[1][dt]['Labels']
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import copy
+import numpy as np
+import ndp
+import ndp.store
+from ndp.store import resultsStore
+from ndp.synthetic import make_batch
+
+
+def test_store(tmp_path, monkeypatch):
+    schemas = make_batch(tmp_path / 'data', samples=3)
+    schemas[2]['Bin'] = 41
+    batch = ndp.ndpBatch()
+    for schema in schemas:
+        batch.add_schema(schema)
+    results = batch.run()
+
+    store = resultsStore(tmp_path / 'store')
+    for i, result in enumerate(results):
+        assert store.append(result, tags={'Batch': 'X' if i < 2 else 'Y'}) == i
+
+    # Reopened, the store reads each sample back from the memory maps
+    store = resultsStore(tmp_path / 'store')
+    assert len(store) == 3
+    for i, result in enumerate(results):
+        columns, meta = store.sample(i)
+        assert meta['Name'] == 'sample_%03d' % i
+        assert meta['Operations'] == result.data['Sam Dat']['Operations']
+        assert np.array_equal(columns['Atoms/cm3'], result.data['Sam Dat']['Atoms/cm3 Binned'], equal_nan=True)
+        assert np.array_equal(columns['Depth'], result.detector['Depth Binned'])
+        channels, meta = store.sample(i, binned=False)
+        assert np.array_equal(channels['Atoms/cm2 Uncert'], result.data['Sam Dat']['Atoms/cm2 Uncert'], equal_nan=True)
+    assert len(store.sample(2)[0]['Depth']) < len(store.sample(0)[0]['Depth'])
+
+    # Queries over every sample, read in blocks of a few samples
+    monkeypatch.setattr(ndp.store, 'BLOCK_VALUES', 100)
+    assert np.array_equal(store.select(Batch='X'), [0, 1])
+    assert np.array_equal(store.select(Name=lambda name: name.endswith('2')), [2])
+    peaks = store.peak_depth()
+    counts = store.reduce('Counts', np.add)
+    for i, result in enumerate(results):
+        values = result.data['Sam Dat']['Atoms/cm3 Binned']
+        values = np.where(np.isfinite(values), values, -np.inf)
+        assert peaks[i] == result.detector['Depth Binned'][np.argmax(values)]
+        assert np.isclose(counts[i], result.data['Sam Dat']['Counts Binned'].sum())
+    deep = np.intersect1d(store.select(Batch='X'), np.flatnonzero(peaks > peaks.min()))
+    assert all(peaks[deep] > peaks.min())
+
+    # An interrupted append leaves values that are not in the index
+    with open(store.column_file('Depth'), 'ab') as f:
+        f.write(b'\0'*24)
+    store.append(results[0], name='again', columns=['Depth', 'Atoms/cm3'])
+    columns, meta = store.sample(3)
+    assert list(columns) == ['Depth', 'Atoms/cm3']
+    assert np.array_equal(columns['Depth'], results[0].detector['Depth Binned'])
+
+
+def test_save_store(sample):
+    schemafile, schema = sample
+    schema = copy.deepcopy(schema)
+    schema['Save']['Format'] = 'store'
+    schema['Save']['Filename'] = 'store'
+    data = ndp.ndpData()
+    data.runschema(schema)
+    store = resultsStore(schema['Save']['Path'] + 'store')
+    assert len(store) == 1
+    assert np.array_equal(store.sample(0)[0]['Counts'], data.data['Sam Dat']['Counts Binned'])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import copy
+import numpy as np
+import ndp
+import ndp.sweep
+from ndp.sweep import depth_scale, del_depth, fit_trims, calibrationSweep
+
+
+def test_depth_scale():
+    corr = np.cumsum(np.linspace(-3, -1, 50))
+    width = del_depth(corr)
+    for x in range(1, 49):
+        assert width[x] == 1e-7*(corr[x-1] - corr[x])
+    # Channel 0 no longer wraps around to the last channel
+    assert width[0] == width[1]
+    assert width[-1] == 0
+
+    channels = np.arange(4096)
+    calib = [[0.7144, -12.45], [0.72, -12.0]]
+    scale = depth_scale(channels, calib, [2077, 2000], [1e-4, -1.0, 1500.0])
+    assert scale['Corr Depth'].shape == (2, 4096)
+    one = depth_scale(channels, calib[1], 2000, [1e-4, -1.0, 1500.0])
+    assert np.array_equal(scale['Del Depth'][1], one['Del Depth'])
+    assert scale['Corr Depth'][0][2077] == 0 and scale['Corr Depth'][1][2000] == 0
+
+    energy = np.array([1472.35, 1400.0, 1300.0, 1150.0, 900.0])
+    thick = np.array([0.0, 180.0, 420.0, 800.0, 1500.0])
+    coeffs = fit_trims(energy + np.array([[0.0], [5.0]]), thick)
+    assert np.allclose(coeffs[1], np.polyfit(energy + 5.0, thick, deg=2), rtol=1e-9)
+
+
+def test_sweep(sample, monkeypatch):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema)
+
+    # The calibration of the sample reproduces its profile exactly
+    sweep = calibrationSweep(data)
+    same = sweep.run()
+    assert np.array_equal(same['Atoms/cm3 Binned'][0], data.data['Sam Dat']['Atoms/cm3 Binned'])
+    assert np.array_equal(same['Depth Binned'][0], data.detector['Depth Binned'])
+
+    m, b = data.instrument['Calib Coeffs']
+    calib = np.column_stack((m*np.linspace(0.99, 1.01, 7), np.full(7, b)))
+    zero = 2077 + np.arange(-3, 4)
+    monkeypatch.setattr(ndp.sweep, 'CHUNK_VALUES', 3*4096)
+    keys = ['Del Depth', 'Atoms/cm3', 'Atoms/cm3 Binned Uncert']
+    results = sweep.run(calib, zero, keys=keys)
+    assert results['Atoms/cm3'].shape == (7, 4096)
+
+    # Each variant matches a reduction with that calibration
+    for i in [0, 4, 6]:
+        variant = copy.deepcopy(data)
+        variant.instrument['Calib Coeffs'] = list(calib[i])
+        variant.instrument['Zero Channel'] = int(zero[i])
+        variant.chan2depth()
+        variant.scale2ref()
+        variant.set_bins(schema['Bin'])
+        assert np.array_equal(results['Del Depth'][i], variant.detector['Del Depth'])
+        assert np.array_equal(results['Atoms/cm3'][i], variant.data['Sam Dat']['Atoms/cm3'])
+        assert np.allclose(results['Atoms/cm3 Binned Uncert'][i],
+                           variant.data['Sam Dat']['Atoms/cm3 Binned Uncert'], rtol=1e-12, atol=0)
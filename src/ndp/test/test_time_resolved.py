@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+import copy
+from datetime import datetime
+import numpy as np
+import ndp
+from ndp.writers import read_profile
+from ndp.synthetic import write_spectrum
+
+
+def test_time_resolved(sample):
+    schemafile, schema = sample
+    rng = np.random.default_rng(5)
+    for i in range(2):
+        for dt in ['Sam Dat', 'Sam Mon']:
+            write_spectrum(schema[dt]['Path'] + schema[dt]['Files'][i], rng.poisson(50 + 40*i, 4096),
+                           live=600.0 - i, real=610.0 + i, start=datetime(2019, 7, 18, 10 + i, 15))
+
+    stacked = copy.deepcopy(schema)
+    stacked['Time Resolved'] = True
+    stacked['Save']['Format'] = 'npz'
+    stacked['Save']['Filename'] = 'stacked.npz'
+    data = ndp.ndpData()
+    data.runschema(stacked)
+    sam = data.data['Sam Dat']
+    assert sam['Counts'].shape == (2, 4096)
+    assert np.array_equal(sam['Elapsed'], [0.0, 3600.0])
+    assert np.array_equal(sam['Live Time'], [600.0, 599.0])
+
+    # Each file of the stack matches a reduction of that file alone
+    for i in range(2):
+        single = copy.deepcopy(schema)
+        for dt in ['Sam Dat', 'Sam Mon']:
+            single[dt]['Files'] = schema[dt]['Files'][i:i+1]
+        one = ndp.ndpData()
+        one.runschema(single)
+        for key in ('Counts/Dt', 'Norm Cts Uncert', 'Atoms/cm2', 'Atoms/cm3 Uncert', 'Atoms/cm3 Binned'):
+            assert np.allclose(sam[key][i], one.data['Sam Dat'][key], rtol=1e-12, atol=0)
+        assert np.isclose(sam['Monitor'][i], one.data['Sam Dat']['Monitor'], rtol=1e-12)
+
+    binned, channels, meta = read_profile(schema['Save']['Path'] + 'stacked.npz')
+    assert np.allclose(binned['Atoms/cm2'], sam['Atoms/cm2 Binned'].mean(axis=0))
+    with np.load(schema['Save']['Path'] + 'stacked.npz') as f:
+        assert f['stack'].shape == (len(schema['Save']['Columns']), 2, sam['Counts Binned'].shape[1])
+        assert np.array_equal(f['elapsed'], [0.0, 3600.0])
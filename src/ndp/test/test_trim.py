@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import numpy as np
+from ndp.trim import read_trim, parse_fixed, parse_records, ENERGY, DEPTH
+from ndp.synthetic import write_trim
+
+
+def regex_records(body):
+    '''One regex search per record, as evalTRIM has always parsed them'''
+    lines = body.splitlines()
+    ev = [float(ENERGY.search(line).group()) for line in lines]
+    depth = [float(DEPTH.search(line).group()) for line in lines]
+    return np.array(ev), np.array(depth)
+
+
+def test_read_trim(tmp_path):
+    rng = np.random.default_rng(3)
+    energy = rng.uniform(2e5, 1.4e6, 500)
+    depth = rng.uniform(0, 50000, 500)
+    write_trim(tmp_path / 'layer.txt', 'Si', energy, depth)
+
+    material, kev, nm = read_trim(tmp_path / 'layer.txt')
+    assert material == 'Si (TRIM)'
+    assert kev.size == 500
+    assert np.allclose(kev, energy/1000.0, atol=0.1)
+    assert np.allclose(nm, depth/10, atol=0.1)
+
+
+def test_fixed_width_matches_regex():
+    body = ('T     1  2 .14724E+07    100E-00  .3E-01\n'
+            'T     2  2  .9999E+06  10000E-01 -.2E-02\n'
+            'T     3  2 .00012E+07      7E-02  .1E-01\n')
+    fixed = parse_fixed(body)
+    assert fixed is not None
+    for a, b, c in zip(fixed, parse_records(body), regex_records(body)):
+        assert np.array_equal(a, b)
+        assert np.array_equal(a, c)
+
+
+def test_variable_width_records():
+    body = ('T 1 2 .1234E+07 100E-00\n'
+            'T 2 .12345E+07 2 100E-00\n'
+            'T 3 2 .1E+07 55E-01 1.5E-03\n')
+    assert parse_fixed(body) is None
+    for a, b in zip(parse_records(body), regex_records(body)):
+        assert np.array_equal(a, b)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import importlib.util
+import os
+from datetime import datetime
+import numpy as np
+import pytest
+import ndp
+from ndp.writers import write_profile, read_profile
+
+
+def reduced(sample):
+    schemafile, schema = sample
+    data = ndp.ndpData()
+    data.runschema(schema)
+    return data, schema['Save']['Path'], schema['Save']['Columns']
+
+
+def profile(data):
+    """
+    Fixed binned columns and file lists, with values that exercise the
+    formatting of floats
+    """
+    data.detector['Channels Binned'] = np.arange(6)
+    data.detector['Energy Binned'] = np.array([0.0, 1/3, 2.5, 1e-7, 1472.35, 12345.678901234567])
+    data.detector['Depth Binned'] = np.array([-1.5, 0.1, 2/7, 1e16, 123.456, np.nan])
+    sam = data.data['Sam Dat']
+    sam['Counts Binned'] = np.array([0.0, 1.0, 17.25, 1e5, 3.0, 2.0])
+    sam['Atoms/cm2 Binned'] = np.array([1.1e15, 2.2e15, 3.3e-5, 0.0, 5e20, 1.7976931348623157e308])
+    sam['Atoms/cm2 Binned Uncert'] = sam['Atoms/cm2 Binned']/7
+    sam['Atoms/cm3 Binned'] = np.array([1e20, np.inf, -2e19, 0.1, 0.2, 0.3])
+    sam['Atoms/cm3 Binned Uncert'] = np.array([1e18, 2e18, 3e18, 4e18, 5e18, 6e18])/3
+    for i, dt in enumerate(['Sam Dat', 'Sam Mon', 'Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon']):
+        data.data[dt]['Files'] = ['%s_%03d.spe' % (dt.replace(' ', ''), j) for j in range(i % 3 + 1)]
+    sam['Operations'] = ['Channel Sum', 'Deadtime Scaled', 'Normalized', 'Corrected', 'Scaled to Reference']
+    sam['Datetime'] = datetime(2019, 7, 18, 10, 15, 30)
+    return data
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'fastcsv'])
+def test_csv_unchanged(tmp_path, fmt):
+    # data/profile_golden.csv was written by saveAtoms before the writers
+    # were added, from the same profile
+    data = profile(ndp.ndpData())
+    columns = ['Channels', 'Energy', 'Depth', 'Counts', 'Atoms/cm2', 'Atoms/cm2 Uncert',
+               'Atoms/cm3', 'Atoms/cm3 Uncert']
+    data.saveAtoms(str(tmp_path) + '/', 'profile.csv', columns, fmt)
+
+    golden = os.path.join(os.path.dirname(__file__), 'data', 'profile_golden.csv')
+    with open(tmp_path / 'profile.csv', newline='') as f, open(golden, newline='') as g:
+        assert f.read() == g.read()
+
+
+def test_fastcsv(sample):
+    data, path, columns = reduced(sample)
+    write_profile(data, path + 'fast.csv', columns, 'fastcsv')
+
+    with open(path + 'sample.csv', newline='') as f, open(path + 'fast.csv', newline='') as g:
+        assert f.read() == g.read()
+
+    binned, channels, meta = read_profile(path + 'fast.csv')
+    expected, channels, meta = read_profile(path + 'sample.csv')
+    for dkey in columns:
+        assert np.array_equal(binned[dkey], expected[dkey], equal_nan=True)
+
+
+@pytest.mark.parametrize('fmt, ext, module', [
+    ('npz', '.npz', None),
+    ('hdf5', '.h5', 'h5py'),
+    ('parquet', '.parquet', 'pyarrow'),
+])
+def test_binary_round_trip(sample, fmt, ext, module):
+    if module is not None and importlib.util.find_spec(module) is None:
+        pytest.skip(module + ' is not installed')
+    data, path, columns = reduced(sample)
+    write_profile(data, path + 'sample' + ext, columns, fmt)
+
+    binned, channels, meta = read_profile(path + 'sample' + ext)
+    assert list(binned) == columns
+    assert np.array_equal(binned['Atoms/cm2'], data.data['Sam Dat']['Atoms/cm2 Binned'])
+    assert np.array_equal(channels['Counts'], data.data['Sam Dat']['Counts'])
+    assert np.array_equal(channels['Depth'], data.detector['Corr Depth'])
+    assert meta['Files']['Sam Dat'] == list(data.data['Sam Dat']['Files'])
+    assert meta['Operations'] == list(data.data['Sam Dat']['Operations'])
+    assert meta['Schema']['Save']['Columns'] == columns
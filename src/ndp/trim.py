@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for TRIM ion transmission files
+
+A TRIM file has a 12 line header with the material label on line 10,
+followed by one record per ion. The escape energy of the ion (eV) is the
+first number of the form .nnnE+nn in a record, and the depth (Angstrom) is
+the first number of the form nnnE-nn.
+"""
+
+import re
+import numpy as np
+
+from ndp.compressed import open_file
+
+
+HEADER_LINES = 12
+
+# Regex to extract the material label from TRIM header (line 10)
+MATERIAL = re.compile(r'\>.*\)')
+# Regex to extract energy from the third or fourth column of the TRIM file
+ENERGY = re.compile(r'\.[0-9]*E\+[0-9]*')
+# Regex to extract depth from the fourth or fifth column of the TRIM file
+DEPTH = re.compile(r'[0-9]*E-[0-9]*')
+
+# The same patterns anchored to return the first match on every line of a block
+ENERGY_RECORDS = re.compile(r'^[^\n]*?(\.[0-9]*E\+[0-9]*)', re.M)
+DEPTH_RECORDS = re.compile(r'^[^\n]*?([0-9]*E-[0-9]*)', re.M)
+
+
+def read_trim(filename):
+    """
+    Read the material, ion energies and ion depths of a TRIM file
+
+    Parameters
+    ----------
+    filename : string
+        Full path to the TRIM file, which may be compressed or a member of a
+        zip archive, see ndp.compressed
+
+    Returns
+    -------
+    material : string
+        Material label from the header
+    energy : 1-D numpy array
+        Escape energy of each ion in keV
+    depth : 1-D numpy array
+        Depth of each ion in nm
+
+    """
+
+    with open_file(filename) as f:
+        text = f.read()
+
+    lines = text.split('\n', HEADER_LINES)
+    material = MATERIAL.search(lines[9]).group()[1:]
+    body = lines[HEADER_LINES] if len(lines) > HEADER_LINES else ''
+
+    records = parse_fixed(body)
+    if records is None:
+        records = parse_records(body)
+    ev, depth = records
+
+    return material, ev/1000.0, depth/10
+
+
+def parse_records(body):
+    """
+    Parse the energy and depth of every record with one regex scan of the block
+    """
+
+    numlines = body.count('\n')
+    if body and not body.endswith('\n'):
+        numlines += 1
+
+    ev = ENERGY_RECORDS.findall(body)
+    depth = DEPTH_RECORDS.findall(body)
+    if len(ev) != numlines or len(depth) != numlines:
+        raise ValueError('TRIM record without an energy and a depth')
+
+    return np.array(ev, dtype=np.float64), np.array(depth, dtype=np.float64)
+
+
+def is_digit(c):
+    return (c >= ord('0')) & (c <= ord('9'))
+
+
+def leading_spaces(line, start):
+    """
+    Position of the first of the spaces that come before position start of line
+    """
+
+    while start > 0 and line[start-1] == ' ':
+        start -= 1
+    return start
+
+
+def parse_fixed(body):
+    """
+    Parse a block of records that all have the same width by slicing the
+    energy and depth columns out of a 2-D array of characters
+
+    The columns are located in the first record, including any spaces that
+    right-align the numbers. Every record is then checked to hold its numbers
+    inside the same columns, so the result is the same as searching each
+    record with the ENERGY and DEPTH regexes.
+
+    Returns
+    -------
+    (energy, depth) arrays, or None if the block is not fixed width
+    """
+
+    width = body.find('\n')
+    if width < 1:
+        return None
+    try:
+        raw = np.frombuffer(body.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return None
+    if raw.size % (width+1) == width:
+        raw = np.append(raw, np.uint8(ord('\n')))
+    if raw.size % (width+1) != 0:
+        return None
+    block = raw.reshape(-1, width+1)
+    if np.any(block[:, width] != ord('\n')):
+        return None
+    block = block[:, :width]
+
+    first = body[:width]
+    m2 = ENERGY.search(first)
+    m3 = DEPTH.search(first)
+    if m2 is None or m3 is None:
+        return None
+
+    # Energy: spaces, a '.', digits, 'E+' and digits, with no '.' before it
+    s2, e2 = m2.span()
+    k2 = first.index('E', s2)
+    c2 = leading_spaces(first, s2)
+    mantissa = block[:, c2:k2]
+    dot = mantissa == ord('.')
+    seen = np.cumsum(dot, axis=1)
+    ok = not np.any(block[:, :c2] == ord('.'))
+    ok = ok and np.all(seen[:, -1] == 1)
+    ok = ok and np.all((mantissa == ord(' ')) & (seen == 0) | dot | is_digit(mantissa) & (seen == 1))
+    ok = ok and np.all(block[:, k2] == ord('E')) and np.all(block[:, k2+1] == ord('+'))
+    ok = ok and np.all(is_digit(block[:, k2+2:e2]))
+    ok = ok and (e2 == width or not np.any(is_digit(block[:, e2])))
+
+    # Depth: spaces, digits, 'E-' and digits, with no 'E-' before it
+    s3, e3 = m3.span()
+    k3 = first.index('E', s3)
+    c3 = leading_spaces(first, s3)
+    mantissa = block[:, c3:k3]
+    digit = is_digit(mantissa)
+    seen = np.cumsum(digit, axis=1)
+    ok = ok and not np.any((block[:, :k3] == ord('E')) & (block[:, 1:k3+1] == ord('-')))
+    ok = ok and np.all((mantissa == ord(' ')) & (seen == 0) | digit)
+    ok = ok and (c3 == 0 or not np.any(digit[:, 0] & is_digit(block[:, c3-1])))
+    ok = ok and np.all(block[:, k3] == ord('E')) and np.all(block[:, k3+1] == ord('-'))
+    ok = ok and np.all(is_digit(block[:, k3+2:e3]))
+    ok = ok and (e3 == width or not np.any(is_digit(block[:, e3])))
+    if not ok:
+        return None
+
+    try:
+        ev = np.ascontiguousarray(block[:, c2:e2]).view('S%d' % (e2-c2))[:, 0].astype(np.float64)
+        depth = np.ascontiguousarray(block[:, c3:e3]).view('S%d' % (e3-c3))[:, 0].astype(np.float64)
+    except ValueError:
+        return None
+
+    return ev, depth
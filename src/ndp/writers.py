@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Output writers and readers for reduced NDP depth profiles
+
+Every format holds the binned columns requested in schema['Save'] and the
+provenance of the reduction. The binary formats also hold the full
+resolution (per channel) columns.
+
+csv = the original text format, written one row at a time
+fastcsv = the same layout written with a single formatting call
+npz = compressed NumPy archive
+hdf5 = chunked, compressed HDF5 file (requires h5py)
+parquet = columnar Apache Parquet file (requires pyarrow)
+store = appended to the results store in the directory filename, see ndp.store
+"""
+
+import csv
+import json
+import os
+import numpy as np
+
+
+# Save column name: (source, binned key, per channel key)
+SAVE_COLUMNS = {
+    'Channels' : ('detector', 'Channels Binned', 'Channels'),
+    'Energy' : ('detector', 'Energy Binned', 'Energy'),
+    'Depth' : ('detector', 'Depth Binned', 'Corr Depth'),
+    'Counts' : ('Sam Dat', 'Counts Binned', 'Counts'),
+    'Atoms/cm2' : ('Sam Dat', 'Atoms/cm2 Binned', 'Atoms/cm2'),
+    'Atoms/cm2 Uncert' : ('Sam Dat', 'Atoms/cm2 Binned Uncert', 'Atoms/cm2 Uncert'),
+    'Atoms/cm3' : ('Sam Dat', 'Atoms/cm3 Binned', 'Atoms/cm3'),
+    'Atoms/cm3 Uncert' : ('Sam Dat', 'Atoms/cm3 Binned Uncert', 'Atoms/cm3 Uncert'),
+}
+
+DATASETS = ['Sam Dat', 'Sam Mon', 'Bgd Dat', 'Bgd Mon', 'Ref Dat', 'Ref Mon']
+
+HEADER_TITLE = 'NIST Neutron Depth Profiling Data File'
+
+
+def get_columns(ndp, data_cols, binned=True):
+    """
+    Collect the Save columns of a reduction
+
+    Parameters
+    ----------
+    ndp : ndpData
+        Reduced data
+    data_cols : list of strings
+        Names of columns from SAVE_COLUMNS. Unknown names give a column of zeros.
+    binned : bool
+        Binned columns if True, per channel columns if False. Per channel
+        columns that have not been computed are left as zeros.
+    
+    Columns of a time resolved reduction are the mean over the files.
+
+    Returns
+    -------
+    2-D numpy array with one row per column
+
+    """
+
+    if binned:
+        length = ndp.detector['Channels Binned'].size
+    else:
+        length = ndp.instrument['Num Channels']
+    columns = np.zeros((len(data_cols), length))
+
+    for i, dkey in enumerate(data_cols):
+        if dkey not in SAVE_COLUMNS:
+            continue
+        source, binned_key, channel_key = SAVE_COLUMNS[dkey]
+        source = ndp.detector if source == 'detector' else ndp.data[source]
+        if binned:
+            columns[i][:] = file_mean(source[binned_key])
+        elif channel_key in source:
+            columns[i][:] = file_mean(source[channel_key])
+
+    return columns
+
+
+def file_mean(x):
+    x = np.asarray(x)
+    if x.ndim != 2:
+        return x
+    with np.errstate(all='ignore'):
+        return x.mean(axis=0)
+
+
+def get_stack(ndp, data_cols):
+    """
+    Binned columns of each file of a time resolved reduction
+
+    Returns
+    -------
+    (columns x files x bins) numpy array, or None if the sample is not time
+    resolved
+    """
+
+    counts = ndp.data['Sam Dat'].get('Counts Binned')
+    if counts is None or np.ndim(counts) != 2:
+        return None
+    stack = np.zeros((len(data_cols),) + counts.shape)
+    for i, dkey in enumerate(data_cols):
+        if dkey not in SAVE_COLUMNS:
+            continue
+        source, binned_key, channel_key = SAVE_COLUMNS[dkey]
+        source = ndp.detector if source == 'detector' else ndp.data[source]
+        stack[i][:] = source[binned_key]
+    return stack
+
+
+def provenance(ndp):
+    """
+    Dictionary describing where a reduction came from: the files of each
+    dataset, the sample operations and measurement time, the instrument and
+    the schema
+    """
+
+    meta = {
+        'Title' : HEADER_TITLE,
+        'Files' : {dt: list(ndp.data[dt]['Files']) for dt in DATASETS},
+        'Paths' : {dt: ndp.data[dt].get('Path', '') for dt in DATASETS},
+        'Operations' : list(ndp.data['Sam Dat']['Operations']),
+        'Datetime' : str(ndp.data['Sam Dat'].get('Datetime', '')),
+        'Instrument' : ndp.instrument,
+        'Schema' : getattr(ndp, 'schema', {}),
+    }
+    return meta
+
+
+def csv_header(ndp, data_cols):
+    """
+    Header rows of the CSV output
+    """
+
+    header = [[HEADER_TITLE],
+              ['Sample Data Files'],
+              [ndp.data['Sam Dat']["Files"]],
+              ['Sample Monitor Files'],
+              [ndp.data['Sam Mon']["Files"]],
+              ['Background Data Files'],
+              [ndp.data['Bgd Dat']["Files"]],
+              ['Background Monitor Files'],
+              [ndp.data['Bgd Mon']["Files"]],
+              ['Reference Data Files'],
+              [ndp.data['Ref Dat']["Files"]],
+              ['Reference Monitor Files'],
+              [ndp.data['Ref Mon']["Files"]],
+              ['Sample Data Operations'],
+              [ndp.data['Sam Dat']['Operations']],
+              [ndp.data['Sam Dat']["Datetime"]],
+              [' '],
+              data_cols
+              ]
+    return header
+
+
+def write_csv(ndp, filename, data_cols):
+    """
+    Write the binned columns as CSV, one row at a time
+    """
+
+    columns = get_columns(ndp, data_cols)
+    header = csv_header(ndp, data_cols)
+
+    with open(filename, 'w', newline='') as csvfile:
+        #using excel comma separated value format
+        writer = csv.writer(csvfile, dialect = 'excel')
+        for x in range(len(header)):
+            writer.writerow(header[x])
+        writer.writerows(np.transpose(columns))
+
+    return
+
+
+def write_fastcsv(ndp, filename, data_cols):
+    """
+    Write the same header as write_csv, then format every value of the binned
+    columns with one string operation. Values are written with repr, as the
+    csv module writes them, so the file is the same as that of write_csv.
+    """
+
+    columns = get_columns(ndp, data_cols)
+    header = csv_header(ndp, data_cols)
+    row = ','.join(['%r']*len(data_cols)) + '\r\n'
+
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, dialect = 'excel')
+        for x in range(len(header)):
+            writer.writerow(header[x])
+        csvfile.write((row*columns.shape[1]) % tuple(columns.T.ravel().tolist()))
+
+    return
+
+
+def write_npz(ndp, filename, data_cols):
+    """
+    Write binned and per channel columns, and the provenance as JSON, to a
+    compressed NumPy archive. A time resolved reduction adds the binned
+    columns of every file as 'stack' and the start time of each file as
+    'elapsed'.
+    """
+
+    arrays = {}
+    stack = get_stack(ndp, data_cols)
+    if stack is not None:
+        arrays['stack'] = stack
+        arrays['elapsed'] = np.asarray(ndp.data['Sam Dat']['Elapsed'])
+    np.savez_compressed(filename,
+                        columns=np.array(data_cols, dtype=str),
+                        binned=get_columns(ndp, data_cols),
+                        channels=get_columns(ndp, data_cols, binned=False),
+                        metadata=np.array(json.dumps(provenance(ndp), default=str)),
+                        **arrays)
+    return
+
+
+def column_name(dkey):
+    return dkey.replace('/', ' per ')
+
+
+def write_hdf5(ndp, filename, data_cols):
+    """
+    Write binned and per channel columns to the groups 'binned' and 'channels'
+    of an HDF5 file, one chunked and compressed dataset per column. Provenance
+    is stored as attributes of the file.
+    """
+
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('Writing HDF5 files requires h5py (pip install h5py)')
+
+    meta = provenance(ndp)
+    with h5py.File(filename, 'w') as f:
+        for group, binned in (('binned', True), ('channels', False)):
+            g = f.create_group(group)
+            columns = get_columns(ndp, data_cols, binned)
+            for i, dkey in enumerate(data_cols):
+                d = g.create_dataset(column_name(dkey), data=columns[i],
+                                     chunks=True, compression='gzip')
+                d.attrs['Name'] = dkey
+        f.attrs['Columns'] = list(data_cols)
+        f.attrs['Title'] = meta['Title']
+        f.attrs['Operations'] = meta['Operations']
+        f.attrs['Datetime'] = meta['Datetime']
+        for dt in DATASETS:
+            f.attrs[dt + ' Files'] = meta['Files'][dt]
+        f.attrs['Metadata'] = json.dumps(meta, default=str)
+
+    return
+
+
+def write_parquet(ndp, filename, data_cols):
+    """
+    Write a Parquet table with a column for each per channel column and each
+    binned column, named '<column> Binned'. Binned columns are shorter and are
+    padded with nulls. Provenance is stored in the table metadata.
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Writing Parquet files requires pyarrow (pip install pyarrow)')
+
+    channels = get_columns(ndp, data_cols, binned=False)
+    binned = get_columns(ndp, data_cols)
+    length = max(channels.shape[1], binned.shape[1])
+    mask = np.arange(length) >= binned.shape[1]
+
+    arrays = {}
+    for i, dkey in enumerate(data_cols):
+        arrays[dkey] = pa.array(np.resize(channels[i], length),
+                                mask=np.arange(length) >= channels.shape[1])
+        arrays[dkey + ' Binned'] = pa.array(np.resize(binned[i], length), mask=mask)
+
+    table = pa.table(arrays)
+    table = table.replace_schema_metadata({'ndp': json.dumps(provenance(ndp), default=str)})
+    pq.write_table(table, filename)
+
+    return
+
+
+def write_store(ndp, filename, data_cols):
+    """
+    Append the binned and per channel columns, and the provenance, to the
+    results store in the directory filename
+    """
+
+    # Imported here since ndp.store builds on this module
+    from ndp.store import resultsStore
+    resultsStore(filename).append(ndp, columns=data_cols)
+    return
+
+
+WRITERS = {
+    'csv' : write_csv,
+    'fastcsv' : write_fastcsv,
+    'npz' : write_npz,
+    'hdf5' : write_hdf5,
+    'parquet' : write_parquet,
+    'store' : write_store,
+}
+
+EXTENSIONS = {
+    '.csv' : 'csv',
+    '.npz' : 'npz',
+    '.h5' : 'hdf5',
+    '.hdf5' : 'hdf5',
+    '.parquet' : 'parquet',
+}
+
+
+def write_profile(ndp, filename, data_cols, fmt='csv'):
+    """
+    Write a reduced profile in one of the formats of WRITERS
+    """
+
+    if fmt not in WRITERS:
+        raise ValueError('Unknown output format ' + str(fmt))
+    WRITERS[fmt](ndp, filename, data_cols)
+    return
+
+
+def read_profile(filename, fmt=None):
+    """
+    Read a profile written by write_profile
+
+    Parameters
+    ----------
+    filename : string
+        File to read
+    fmt : string
+        Format of the file, from its extension if None
+
+    Returns
+    -------
+    binned : dictionary of binned columns
+    channels : dictionary of per channel columns, empty for CSV files
+    metadata : provenance dictionary, or the header rows of a CSV file
+
+    """
+
+    if fmt is None:
+        fmt = EXTENSIONS.get(os.path.splitext(filename)[1].lower(), 'csv')
+
+    if fmt in ('csv', 'fastcsv'):
+        with open(filename, newline='') as f:
+            header = [next(f) for i in range(18)]
+            values = np.loadtxt(f, delimiter=',', ndmin=2)
+        data_cols = next(csv.reader([header[-1]]))
+        binned = {dkey: values[:, i] for i, dkey in enumerate(data_cols)}
+        meta = [next(csv.reader([line]), []) for line in header[:-1]]
+        return binned, {}, meta
+
+    if fmt == 'npz':
+        with np.load(filename) as f:
+            data_cols = [str(x) for x in f['columns']]
+            binned = {dkey: f['binned'][i] for i, dkey in enumerate(data_cols)}
+            channels = {dkey: f['channels'][i] for i, dkey in enumerate(data_cols)}
+            meta = json.loads(str(f['metadata']))
+        return binned, channels, meta
+
+    if fmt == 'hdf5':
+        import h5py
+        with h5py.File(filename, 'r') as f:
+            data_cols = [str(x) for x in f.attrs['Columns']]
+            binned = {dkey: f['binned'][column_name(dkey)][()] for dkey in data_cols}
+            channels = {dkey: f['channels'][column_name(dkey)][()] for dkey in data_cols}
+            meta = json.loads(f.attrs['Metadata'])
+        return binned, channels, meta
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(filename)
+        meta = json.loads(table.schema.metadata[b'ndp'])
+        binned = {}
+        channels = {}
+        for name in table.column_names:
+            values = table.column(name).drop_null().to_numpy()
+            if name.endswith(' Binned'):
+                binned[name[:-7]] = values
+            else:
+                channels[name] = values
+        return binned, channels, meta
+
+    raise ValueError('Unknown output format ' + str(fmt))